@@ -14,3 +14,6 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecommerce.settings')
 
 application = get_asgi_application()
+
+from ecommerce.product.autocomplete import preload # noqa: E402 #the apps must be loaded first
+preload() #builds the in-memory autocomplete index when the worker starts
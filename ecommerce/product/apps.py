@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.core import checks
 
 
 class ProductConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "ecommerce.product"
+
+    def ready(self):
+        from . import signals # noqa: F401 #connects the cache invalidation receivers
+        from .autocomplete import check_shared_cache
+        checks.register(check_shared_cache, checks.Tags.caches)
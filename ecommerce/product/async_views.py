@@ -0,0 +1,87 @@
+"""Async read path of the catalogue for ASGI deployments (asgi.py), under /api/async/.
+DRF 3.14 viewsets can't be async, so these are plain Django async views returning the same JSON as
+ProductView.retrieve, list and list_product_by_category_slug with FAST_READ_SERIALIZERS (full payload,
+no ?fields=/?expand=/?stream=). The rows are read with the async ORM, the four queries under a page of
+products (fast_serializers.fetch_product_related) only depend on the product ids and are gathered.
+A request waiting on the database doesn't hold the event loop. Django 4.1 still runs the ORM calls of one
+request on one thread, one after another, so gathering them only overlaps them once the ORM is natively async"""
+import asyncio
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, HttpResponseNotAllowed
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+
+from .cache import get_product_detail, set_product_detail
+from .conditional import async_product_detail_conditional
+from .fast_serializers import (CARD_COLUMNS, PRODUCT_COLUMNS, assemble_products, fetch_product_related,
+                               serialize_product_cards)
+from .models import Category, Product, ProductCard
+from .pagination import ProductCardCursorPagination, ProductCursorPagination
+from .renderers import FastJSONRenderer
+
+
+def json_response(data, status=200):
+    return HttpResponse(FastJSONRenderer().render(data), status=status, content_type="application/json")
+
+
+def async_api_view(view):
+    """GET/HEAD only, the DRF exceptions (NotFound for an invalid cursor ...) rendered as DRF would.
+    Django 4.1's require_safe() and friends only wrap sync views"""
+    @wraps(view)
+    async def inner(request, *args, **kwargs):
+        if request.method not in ("GET", "HEAD"):
+            return HttpResponseNotAllowed(["GET", "HEAD"])
+        try:
+            return await view(request, *args, **kwargs)
+        except APIException as e:
+            return json_response({"detail": e.detail}, status=e.status_code)
+    return inner
+
+
+async def serialize_products(products):
+    """fast_serializers.serialize_products() for a list of PRODUCT_COLUMNS rows, the related queries are gathered"""
+    related = fetch_product_related([product["id"] for product in products])
+    rows = await asyncio.gather(*[_rows(queryset) for queryset in related.values()])
+    return assemble_products(products, dict(zip(related, rows)))
+
+
+async def _rows(queryset):
+    return [row async for row in queryset] #one thread hop, Django 4.1's aiterator() runs the query in the event loop
+
+
+def paginated_response(paginator, data):
+    return json_response({"next": paginator.get_next_link(), "results": data})
+
+
+@async_api_view
+async def product_list(request):
+    """ProductView.list"""
+    paginator = ProductCursorPagination()
+    page = await paginator.apaginate_queryset(Product.objects.is_active().values(*PRODUCT_COLUMNS), Request(request))
+    return paginated_response(paginator, await serialize_products(page))
+
+
+@async_api_view
+@async_product_detail_conditional #ETag/Last-Modified, If-None-Match gets a 304 without serializing
+async def product_detail(request, slug=None):
+    """ProductView.retrieve, served from the same versioned cache"""
+    cached = await sync_to_async(get_product_detail)(slug)
+    if cached is not None:
+        return json_response(cached)
+    rows = Product.objects.is_active().filter(slug=slug).values(*PRODUCT_COLUMNS)
+    products = await serialize_products(await _rows(rows))
+    await sync_to_async(set_product_detail)(slug, products)
+    return json_response(products)
+
+
+@async_api_view
+async def product_list_by_category_slug(request, slug=None):
+    """ProductView.list_product_by_category_slug"""
+    category = await Category.objects.filter(slug=slug).afirst()
+    cards = ProductCard.objects.is_active()
+    cards = cards.in_category_subtree(category) if category else cards.none()
+    paginator = ProductCardCursorPagination()
+    page = await paginator.apaginate_queryset(cards.values(*CARD_COLUMNS), Request(request))
+    return paginated_response(paginator, serialize_product_cards(page))
@@ -0,0 +1,41 @@
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+
+from .models import ProductAttributeValue, ProductLineAttributeValue
+from .signals import product_lines_changed, products_changed
+
+
+def assign_attribute_values(model, parent_field, parent_id, attribute_values):
+    """Assigns a set of attribute values to one product / product line.
+    The whole set is validated with one query: each value with its attribute and the value the
+    parent already has for that attribute. The new rows are written with one bulk_create,
+    the (parent, attribute) constraint covers a concurrent assignment.
+    Values the parent already has are skipped. Returns the number of new assignments"""
+    value_ids = {getattr(value, "pk", value) for value in attribute_values}
+    new, errors = model.objects.plan(parent_field, parent_id, value_ids)
+    if errors:
+        raise ValidationError(errors)
+
+    try:
+        with transaction.atomic():
+            model.objects.bulk_create([
+                model(**{parent_field: parent_id, "attribute_value_id": pk, "attribute_id": attribute_id})
+                for pk, attribute_id in new.items()
+            ])
+    except IntegrityError:
+        raise ValidationError("An attribute was assigned concurrently, try again.")
+    return len(new)
+
+
+def assign_product_attribute_values(product_id, attribute_values):
+    count = assign_attribute_values(ProductAttributeValue, "product_id", product_id, attribute_values)
+    if count:
+        products_changed([product_id]) #bulk_create sends no signals
+    return count
+
+
+def assign_product_line_attribute_values(product_line_id, attribute_values):
+    count = assign_attribute_values(ProductLineAttributeValue, "product_line_id", product_line_id, attribute_values)
+    if count:
+        product_lines_changed([product_line_id])
+    return count
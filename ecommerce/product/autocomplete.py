@@ -0,0 +1,230 @@
+"""Prefix autocomplete for the search box, answered from memory without a database query.
+Every active product adds a few entries: each word start of its name ("samsung oled tv", "oled tv", "tv"),
+its pid and the skus of its active product lines, lowercased and cut to KEY_LENGTH characters.
+The entries are kept sorted in two parallel arrays, a list of keys and an array of product ids,
+a lookup is a binary search for the prefix followed by a scan of the next entries.
+Each worker process has its own copy: built when the worker starts (AUTOCOMPLETE_PRELOAD, wsgi.py/asgi.py)
+or on the first lookup, then kept up to date from the change log in the shared cache (cache.py),
+checked at most every AUTOCOMPLETE_SYNC_INTERVAL seconds. The cache must be shared by the workers
+(check_shared_cache()), with a local memory cache the other workers never see the changes.
+A gap in the log rebuilds the index in a background thread, the lookups use the old entries meanwhile"""
+import bisect
+import logging
+import re
+import sys
+import threading
+import time
+from array import array
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import DatabaseError, connections
+
+from .cache import get_autocomplete_changes, get_autocomplete_generation
+from .models import Product, ProductLine
+
+logger = logging.getLogger(__name__)
+
+KEY_LENGTH = 32
+WORD_START = re.compile(r"\b\w")
+
+
+def normalize(text):
+    return " ".join(text.lower().split())[:KEY_LENGTH]
+
+
+def product_keys(name, pid, skus):
+    name = " ".join(name.lower().split())
+    keys = {name[match.start():][:KEY_LENGTH] for match in WORD_START.finditer(name)}
+    keys.update(normalize(value) for value in [pid, *skus] if value)
+    return sorted(keys)
+
+
+def load_products(product_ids=None):
+    """{product id: (name, slug, pid, [skus])} of the active products, all of them when product_ids is None.
+    Two queries, read in chunks"""
+    products = Product.objects.is_active()
+    lines = ProductLine.objects.is_active().filter(product__is_active=True)
+    if product_ids is not None:
+        products = products.filter(pk__in=product_ids)
+        lines = lines.filter(product_id__in=product_ids)
+    rows = {pk: (name, slug, pid, []) for pk, name, slug, pid in
+            products.values_list("pk", "name", "slug", "pid").iterator(chunk_size=10000)}
+    for product_id, sku in lines.values_list("product_id", "sku").iterator(chunk_size=10000):
+        if product_id in rows:
+            rows[product_id][3].append(sku)
+    return rows
+
+
+class PrefixIndex:
+    """Sorted (key, product id) entries, safe to share between threads"""
+
+    def __init__(self):
+        self.keys = [] # sorted
+        self.ids = array("q") # ids[i] is the product of keys[i]
+        self.products = {} # product id: (name, slug, pid, keys)
+        self.generation = None # last change log generation applied, None until loaded
+        self.synced_at = 0.0
+        self.missing_since = None # when the next generation was first found missing from the log
+        self._rebuild = None # the background rebuild thread
+        self._lock = threading.RLock()
+
+    def load(self):
+        """Builds the index from the database, the generation is read first so a change committed
+        while the rows are read is replayed by the next sync()"""
+        generation = get_autocomplete_generation()
+        rows = load_products()
+        entries = []
+        products = {}
+        for pk, (name, slug, pid, skus) in rows.items():
+            keys = product_keys(name, pid, skus)
+            products[pk] = (name, slug, pid, tuple(keys))
+            entries.extend((key, pk) for key in keys)
+        entries.sort()
+        with self._lock:
+            self.keys = [key for key, _ in entries]
+            self.ids = array("q", [pk for _, pk in entries])
+            self.products = products
+            self.generation = generation
+            self.synced_at = time.monotonic()
+            self.missing_since = None
+
+    def rebuild(self):
+        """load() in a background thread, the lookups go on with the current entries. One rebuild at a time"""
+        if not settings.AUTOCOMPLETE_BACKGROUND_REBUILD:
+            return self.load()
+        with self._lock:
+            if self._rebuild is not None and self._rebuild.is_alive():
+                return
+            self._rebuild = threading.Thread(target=self._load_in_thread, name="autocomplete-rebuild", daemon=True)
+            self._rebuild.start()
+
+    def _load_in_thread(self):
+        try:
+            self.load()
+        except Exception:
+            logger.exception("Autocomplete index rebuild failed, the next sync retries")
+            with self._lock:
+                self.missing_since = None
+        finally:
+            connections.close_all() #this thread's connections
+
+    def _remove(self, pk):
+        for key in self.products.pop(pk, (None, None, None, ()))[3]:
+            i = bisect.bisect_left(self.keys, key)
+            while self.ids[i] != pk: #same key, other products
+                i += 1
+            del self.keys[i]
+            del self.ids[i]
+
+    def update(self, product_ids, rows):
+        """product_ids were changed, rows: their load_products() rows (a missing id is removed)"""
+        with self._lock:
+            for pk in product_ids:
+                self._remove(pk)
+                if pk not in rows:
+                    continue
+                name, slug, pid, skus = rows[pk]
+                keys = product_keys(name, pid, skus)
+                self.products[pk] = (name, slug, pid, tuple(keys))
+                for key in keys:
+                    i = bisect.bisect_left(self.keys, key)
+                    while i < len(self.keys) and self.keys[i] == key and self.ids[i] < pk: #(key, id) order
+                        i += 1
+                    self.keys.insert(i, key)
+                    self.ids.insert(i, pk)
+
+    def sync(self):
+        """Applies the changes logged by every process since the last sync, at most once per
+        AUTOCOMPLETE_SYNC_INTERVAL. A generation missing from the log is waited for (the writer stores the ids
+        right after taking the number) for AUTOCOMPLETE_CHANGE_LOG_GRACE seconds, then it is a gap (expired,
+        evicted, cache cleared) and the index is rebuilt in the background.
+        The lookups go on with the current entries while the changed rows are read"""
+        if self.generation is None:
+            return self.load()
+        now = time.monotonic()
+        if now - self.synced_at < settings.AUTOCOMPLETE_SYNC_INTERVAL:
+            return
+        self.synced_at = now
+        current = get_autocomplete_generation()
+        if current == self.generation:
+            return
+        if current < self.generation: #the counter itself was evicted
+            return self.rebuild()
+        generation, changed = get_autocomplete_changes(self.generation + 1, current)
+        if generation > self.generation:
+            rows = load_products(changed)
+            with self._lock:
+                self.update(changed, rows) #applying a change twice (two threads syncing) gives the same entries
+                self.generation = max(self.generation, generation)
+                self.missing_since = None
+        if generation < current: #the next one is missing
+            if self.missing_since is None:
+                self.missing_since = now
+            if now - self.missing_since >= settings.AUTOCOMPLETE_CHANGE_LOG_GRACE:
+                self.rebuild()
+
+    def complete(self, prefix, limit=10):
+        """[(product id, name, slug, pid)] of the first `limit` products with an entry starting with prefix,
+        in key order"""
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        self.sync()
+        found = {}
+        with self._lock:
+            i = bisect.bisect_left(self.keys, prefix)
+            while len(found) < limit and i < len(self.keys) and self.keys[i].startswith(prefix):
+                pk = self.ids[i]
+                if pk not in found:
+                    found[pk] = (pk, *self.products[pk][:3])
+                i += 1
+        return list(found.values())
+
+    def stats(self):
+        """Entry counts and an estimate of the memory used (bytes), also per million entries"""
+        with self._lock:
+            size = sys.getsizeof(self.keys) + sys.getsizeof(self.ids) + sys.getsizeof(self.products)
+            size += sum(sys.getsizeof(key) for key in self.keys)
+            for product in self.products.values():
+                size += sys.getsizeof(product) + sys.getsizeof(product[3]) + sum(map(sys.getsizeof, product[:3]))
+            entries = len(self.keys)
+            return {
+                "entries": entries,
+                "products": len(self.products),
+                "bytes": size,
+                "bytes_per_million_entries": round(size / entries * 1_000_000) if entries else 0,
+                "generation": self.generation,
+                "rebuilding": self._rebuild is not None and self._rebuild.is_alive(),
+            }
+
+
+autocomplete_index = PrefixIndex()
+
+
+def check_shared_cache(app_configs=None, **kwargs):
+    """The change log needs a cache shared by the worker processes, a process-local backend is only
+    fine for a single process (runserver, DEBUG)"""
+    if settings.DEBUG or not isinstance(caches["default"], (LocMemCache, DummyCache)):
+        return []
+    return [checks.Warning(
+        "The default cache is local to each process, the autocomplete index of the other workers "
+        "never sees the product changes.",
+        hint="Use a shared cache backend (RedisCache, PyMemcacheCache), see REDIS_URL in settings/production.py.",
+        id="product.W001",
+    )]
+
+
+def preload():
+    """Called when a worker starts, the index is built on the first lookup when the database isn't ready"""
+    for warning in check_shared_cache():
+        logger.warning("%s %s", warning.msg, warning.hint)
+    if not settings.AUTOCOMPLETE_PRELOAD:
+        return
+    try:
+        autocomplete_index.load()
+    except DatabaseError:
+        logger.warning("Autocomplete index not preloaded, it is built on the first lookup", exc_info=True)
@@ -0,0 +1,396 @@
+"""Benchmarks for the catalogue read/write paths, run with
+python manage.py benchmark_catalogue <suite> [--size N] [--repeat N]
+Every suite generates its own data inside a transaction that is rolled back"""
+import random
+import statistics
+import time
+
+from .models import Category, Product, ProductImage, ProductLine, ProductType
+
+SUITES = {}
+
+
+def suite(name, atomic=True):
+    """Registers a benchmark function under a name for the management command.
+    atomic=False: the suite isn't run in the rolled back transaction, it commits its data
+    (other connections have to see it) and deletes it itself"""
+    def register(func):
+        func.atomic = atomic
+        SUITES[name] = func
+        return func
+    return register
+
+
+def timed(func, repeat):
+    """Runs func repeat times, returns the duration of each run in seconds"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def summarize(label, samples):
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    return (f"{label}: median {statistics.median(samples) * 1000:.3f}ms "
+            f"p95 {p95 * 1000:.3f}ms ({len(samples)} runs)")
+
+
+def generate_category_tree(size, branching=10):
+    """Bulk creates a single tree of `size` active categories with precomputed lft/rght values
+    (saving one by one through mptt would move the tree on every insert)"""
+    tree_id = (Category.objects.order_by("-tree_id").values_list("tree_id", flat=True).first() or 0) + 1
+    # children[i] = list of node indexes under node i, node 0 is the root
+    children = {0: []}
+    parents = {0: None}
+    for node in range(1, size):
+        parent = (node - 1) // branching
+        children.setdefault(parent, []).append(node)
+        children[node] = []
+        parents[node] = parent
+
+    lft, rght, level = {}, {}, {0: 0}
+    counter = 1
+    stack = [(0, False)]
+    while stack: #iterative depth first walk
+        node, done = stack.pop()
+        if done:
+            rght[node] = counter
+            counter += 1
+            continue
+        lft[node] = counter
+        counter += 1
+        stack.append((node, True))
+        for child in reversed(children[node]):
+            level[child] = level[node] + 1
+            stack.append((child, False))
+
+    categories = {}
+    for depth in sorted(set(level.values())): #parents must exist before their children
+        batch = [
+            Category(name=f"bench-{tree_id}-{node}", slug=f"bench-{tree_id}-{node}", is_active=True,
+                     parent=categories.get(parents[node]), tree_id=tree_id,
+                     lft=lft[node], rght=rght[node], level=depth)
+            for node in level if level[node] == depth
+        ]
+        for obj in Category.objects.bulk_create(batch):
+            categories[int(obj.name.rsplit("-", 1)[1])] = obj
+    return [categories[node] for node in range(size)]
+
+
+def generate_products(size, categories):
+    product_type = ProductType.objects.create(name="bench")
+    prefix = random.randrange(16 ** 4)
+    products = [
+        Product(name=f"bench product {i}", slug=f"bench-product-{i}", pid=f"{prefix:04x}{i:06d}"[:10],
+                category=random.choice(categories), product_type=product_type, is_active=True)
+        for i in range(size)
+    ]
+    return Product.objects.bulk_create(products, batch_size=1000)
+
+
+@suite("category_subtree")
+def category_subtree(stdout, size, repeat):
+    """Products of a subtree: one range predicate vs filtering on the list of descendant ids"""
+    categories = generate_category_tree(size)
+    generate_products(size * 2, categories)
+    samples = {"range predicate": [], "descendant id list": []}
+    for _ in range(repeat):
+        node = random.choice(categories[:max(1, size // 100)]) #upper levels, large subtrees
+        samples["range predicate"] += timed(
+            lambda: list(Product.objects.in_category_subtree(node).values_list("id", flat=True)), 1)
+        samples["descendant id list"] += timed(
+            lambda: list(Product.objects.filter(
+                category__in=list(node.get_descendants(include_self=True).values_list("id", flat=True))
+            ).values_list("id", flat=True)), 1)
+    for label, values in samples.items():
+        stdout.write(summarize(f"{size} categories, {label}", values))
+
+
+def generate_product_lines(products, per_product=2):
+    """Active product lines with one image each, the order values are set so bulk_create
+    doesn't run OrderField's per row query"""
+    lines = ProductLine.objects.bulk_create([
+        ProductLine(product=product, price="9.99", sku=f"{product.pid}-{order}", stock_qty=10,
+                    is_active=True, order=order, weight=1.0, product_type_id=product.product_type_id)
+        for product in products for order in range(1, per_product + 1)
+    ], batch_size=1000)
+    ProductImage.objects.bulk_create([
+        ProductImage(product_line=line, alternative_text="bench", url="bench.jpg", order=1) for line in lines
+    ], batch_size=1000)
+    return lines
+
+
+@suite("serializers")
+def serializers(stdout, size, repeat):
+    """ProductSerializer over prefetched instances vs the compiled fast path over .values() rows,
+    one page of PAGE_SIZE products per run, queries included"""
+    from django.conf import settings
+
+    from .fast_serializers import PRODUCT_COLUMNS, serialize_products
+    from .query_planner import optimize_queryset
+    from .serializers import ProductSerializer
+
+    products = generate_products(size, generate_category_tree(10))
+    generate_product_lines(products)
+    queryset = Product.objects.filter(pk__in=[product.pk for product in products]).order_by("-id")
+    page = settings.PAGE_SIZE
+    runs = {
+        "DRF serializer": lambda: ProductSerializer(
+            optimize_queryset(queryset, ProductSerializer)[:page], many=True).data,
+        "fast path": lambda: serialize_products(queryset.values(*PRODUCT_COLUMNS)[:page]),
+    }
+    for label, func in runs.items():
+        samples = timed(func, repeat)
+        stdout.write(summarize(f"{page} products/page, {label}", samples)
+                     + f", {page / statistics.median(samples):.0f} products/s")
+
+
+@suite("export")
+def export(stdout, size, repeat):
+    """Full catalogue export, size products with 2 product lines each, rows/s per output"""
+    from .export import EXPORT_FORMATS, export_rows
+
+    generate_product_lines(generate_products(size, generate_category_tree(10)))
+    rows = size * 2
+    for output, (write_rows, _, _) in EXPORT_FORMATS.items():
+        samples = timed(lambda: sum(1 for _ in write_rows(export_rows())), repeat)
+        stdout.write(summarize(f"{rows} rows, {output}", samples)
+                     + f", {rows / statistics.median(samples):.0f} rows/s")
+
+
+@suite("reorder")
+def reorder(stdout, size, repeat):
+    """Reordering the images of one product line, size images, shuffled on every run"""
+    from .reorder import reorder_product_images
+
+    line = generate_product_lines(generate_products(1, generate_category_tree(1)), per_product=1)[0]
+    ids = [image.pk for image in ProductImage.objects.bulk_create([
+        ProductImage(product_line=line, alternative_text="bench", url="bench.jpg", order=order)
+        for order in range(2, size + 1)])] + list(line.product_image.filter(order=1).values_list("pk", flat=True))
+
+    def shuffled():
+        random.shuffle(ids)
+        reorder_product_images(line.pk, ids)
+
+    stdout.write(summarize(f"{size} images", timed(shuffled, repeat)))
+
+
+@suite("facets")
+def facets(stdout, size, repeat):
+    """Faceted search over the whole tree and over a sub category, size products with 2 product lines,
+    a size and a colour on every line and a brand on every product. One run = one page + the counts"""
+    from .facets import facet_counts, facet_products, selected_values
+    from .models import Attribute, AttributeValue, ProductAttributeValue, ProductLineAttributeValue
+    from .read_models import rebuild_product_cards
+
+    categories = generate_category_tree(100)
+    products = generate_products(size, categories)
+    lines = generate_product_lines(products)
+    for line in lines:
+        line.price = random.randrange(1000, 50000) / 100
+    ProductLine.objects.bulk_update(lines, ["price"], batch_size=1000)
+
+    attributes = {}
+    for name, count in [("size", 10), ("colour", 8), ("brand", 20)]:
+        attribute = Attribute.objects.create(name=f"bench {name}")
+        attributes[name] = AttributeValue.objects.bulk_create(
+            [AttributeValue(attribute=attribute, attribute_value=f"{name} {i}") for i in range(count)])
+    ProductLineAttributeValue.objects.bulk_create([
+        ProductLineAttributeValue(product_line=line, attribute_value=value, attribute_id=value.attribute_id)
+        for line in lines for value in (random.choice(attributes["size"]), random.choice(attributes["colour"]))
+    ], batch_size=1000)
+    ProductAttributeValue.objects.bulk_create([
+        ProductAttributeValue(product=product, attribute_value=value, attribute_id=value.attribute_id)
+        for product in products for value in [random.choice(attributes["brand"])]
+    ], batch_size=1000)
+    start = time.perf_counter()
+    rebuild_product_cards()
+    stdout.write(f"cards and facet rows of {size} products built in {time.perf_counter() - start:.1f}s")
+
+    filters = {
+        "no filter": ([], {}),
+        "one value": ([attributes["size"][0]], {}),
+        "2 attributes + price": ([attributes["size"][0], attributes["size"][1], attributes["brand"][0]],
+                                 {"price_min": 100, "price_max": 300, "in_stock": True}),
+    }
+    for category_label, category in [("whole tree", categories[0]), ("sub category", categories[1])]:
+        for label, (values, params) in filters.items():
+            groups = selected_values([value.pk for value in values])
+
+            def search():
+                list(facet_products(category, groups, **params).order_by("-created_at", "-pk")[:20])
+                facet_counts(category, groups, **params)
+
+            stdout.write(summarize(f"{size} products, {category_label}, {label}", timed(search, repeat)))
+
+
+SEARCH_WORDS = ["samsung", "sony", "lg", "oled", "qled", "led", "smart", "tv", "monitor", "gaming", "curved",
+                "phone", "tablet", "laptop", "black", "silver", "white", "pro", "max", "mini", "ultra", "wireless",
+                "speaker", "camera", "watch", "headphones", "keyboard", "mouse", "router", "printer"]
+
+
+@suite("search")
+def search(stdout, size, repeat):
+    """Full-text search, size products named and described with random words from a small vocabulary
+    (every word is in a third of the catalogue, the worst case for ranking) and a model number shared
+    by ~10 products, one product line each. One run = one query, one page of ids.
+    The p95 target is measured on 500k products: --size 500000"""
+    from .read_models import refresh_search_documents
+    from .search import search_product_ids
+
+    rng = random.Random(1)
+    def words(count):
+        return " ".join(rng.choice(SEARCH_WORDS) for _ in range(count))
+    products = Product.objects.bulk_create([
+        Product(name=f"{words(3)} m{rng.randrange(size // 10)}", slug=f"bench-search-{i}", pid=f"s{i:09d}", description=words(12),
+                category=None, product_type=product_type, is_active=True)
+        for product_type in [ProductType.objects.create(name="bench")] for i in range(size)
+    ], batch_size=1000)
+    generate_product_lines(products, per_product=1)
+    start = time.perf_counter()
+    ids = [product.pk for product in products]
+    for offset in range(0, size, 1000):
+        refresh_search_documents(ids[offset:offset + 1000])
+    stdout.write(f"search documents of {size} products indexed in {time.perf_counter() - start:.1f}s")
+
+    queries = {
+        "one word": lambda: rng.choice(SEARCH_WORDS),
+        "two words": lambda: words(2),
+        "prefix": lambda: words(1) + " " + rng.choice(SEARCH_WORDS)[:3],
+        "model number": lambda: f"m{rng.randrange(size // 10)}",
+        "word + model number": lambda: f"{words(1)} m{rng.randrange(size // 10)}",
+        "pid": lambda: f"s{rng.randrange(size):09d}",
+    }
+    for label, query in queries.items():
+        samples = [timed(lambda: search_product_ids(query(), 21), 1)[0] for _ in range(repeat)]
+        stdout.write(summarize(f"{size} products, {label}", samples))
+
+
+@suite("autocomplete")
+def autocomplete(stdout, size, repeat):
+    """In-memory prefix autocomplete over size products (search vocabulary names, one product line each):
+    the time to build the index, its memory per million entries and the lookup latency.
+    One run = one lookup of 10 completions"""
+    from .autocomplete import PrefixIndex
+
+    rng = random.Random(1)
+    products = Product.objects.bulk_create([
+        Product(name=" ".join(rng.choice(SEARCH_WORDS) for _ in range(3)) + f" m{i}", slug=f"bench-autocomplete-{i}",
+                pid=f"a{i:09d}", category=None, product_type=product_type, is_active=True)
+        for product_type in [ProductType.objects.create(name="bench")] for i in range(size)
+    ], batch_size=1000)
+    generate_product_lines(products, per_product=1)
+
+    index = PrefixIndex()
+    start = time.perf_counter()
+    index.load()
+    stats = index.stats()
+    stdout.write(f"index of {stats['products']} products ({stats['entries']} entries) built in "
+                 f"{time.perf_counter() - start:.1f}s, {stats['bytes'] / 2**20:.1f}MB, "
+                 f"{stats['bytes_per_million_entries'] / 2**20:.1f}MB per million entries")
+
+    prefixes = {
+        "one letter": lambda: rng.choice(SEARCH_WORDS)[:1],
+        "three letters": lambda: rng.choice(SEARCH_WORDS)[:3],
+        "two words": lambda: " ".join(rng.choice(SEARCH_WORDS) for _ in range(2)),
+        "pid": lambda: f"a{rng.randrange(size):09d}"[:8],
+        "no match": lambda: "zzz",
+    }
+    for label, prefix in prefixes.items():
+        samples = [timed(lambda: index.complete(prefix(), 10), 1)[0] for _ in range(repeat)]
+        stdout.write(summarize(f"{size} products, {label}", samples))
+
+    product = products[rng.randrange(size)]
+    product.name = "renamed product"
+    samples = timed(lambda: index.update([product.pk], {product.pk: (product.name, product.slug, product.pid, [])}), repeat)
+    stdout.write(summarize(f"{size} products, incremental update of one product", samples))
+
+
+CONNECTIONS = 200 #concurrent clients
+WSGI_THREADS = 16 #threads of a threaded WSGI worker (gunicorn --threads)
+DATABASE_LATENCY = 0.002 #seconds added to every query, a database on another host
+
+
+@suite("asgi", atomic=False)
+def asgi(stdout, size, repeat):
+    """The product list, detail and category endpoints under CONNECTIONS concurrent clients: the sync DRF views
+    served by WSGI_THREADS threads (a threaded WSGI worker) vs the async views (async_views.py), one task per
+    connection and a thread per request for the ORM calls (Django's ASGI handler). In process, every query
+    waits DATABASE_LATENCY first, both use the fast serializers. Each request opens and closes its own database connection (CONN_MAX_AGE=0),
+    so the data is committed, then deleted at the end. One run = one request per connection, the latencies
+    include the time spent queued. Try --size 2000 --repeat 5"""
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+
+    from asgiref.sync import ThreadSensitiveContext, sync_to_async
+    from django.db import connections, transaction
+    from django.db.backends.signals import connection_created
+    from django.test import AsyncClient, Client, override_settings
+
+    from .models import ProductCard
+    from .read_models import refresh_product_cards
+
+    def delay(execute, sql, params, many, context):
+        time.sleep(DATABASE_LATENCY)
+        return execute(sql, params, many, context)
+
+    def add_latency(sender, connection, **kwargs):
+        if delay not in connection.execute_wrappers:
+            connection.execute_wrappers.append(delay)
+
+    def wsgi_run(url, pool):
+        start = time.perf_counter()
+        def get(i):
+            response = Client().get(url(i))
+            connections.close_all()
+            assert response.status_code == 200
+            return time.perf_counter() - start
+        return list(pool.map(get, range(CONNECTIONS)))
+
+    async def asgi_run(url):
+        start = time.perf_counter()
+        async def get(i):
+            async with ThreadSensitiveContext(): #the request's own thread for the ORM calls
+                response = await AsyncClient().get(url(i).replace("/api/", "/api/async/"))
+                await sync_to_async(connections.close_all)()
+            assert response.status_code == 200
+            return time.perf_counter() - start
+        return await asyncio.gather(*[get(i) for i in range(CONNECTIONS)])
+
+    with transaction.atomic():
+        categories = generate_category_tree(10)
+        products = generate_products(size, categories)
+        lines = generate_product_lines(products)
+        for offset in range(0, size, 1000):
+            refresh_product_cards([product.pk for product in products[offset:offset + 1000]])
+    endpoints = {
+        "list": lambda i: "/api/product/",
+        "detail": lambda i: f"/api/product/{random.choice(products).slug}/",
+        "category": lambda i: f"/api/product/category/{categories[0].slug}/",
+    }
+    connection_created.connect(add_latency)
+    try:
+        with (override_settings(ALLOWED_HOSTS=["testserver"], FAST_READ_SERIALIZERS=True), ThreadPoolExecutor(WSGI_THREADS) as pool):
+            for label, url in endpoints.items():
+                for server, run in [("WSGI", lambda: wsgi_run(url, pool)), ("ASGI", lambda: asyncio.run(asgi_run(url)))]:
+                    latencies = []
+                    start = time.perf_counter()
+                    for _ in range(repeat):
+                        latencies += run()
+                    throughput = len(latencies) / (time.perf_counter() - start)
+                    stdout.write(summarize(f"{label}, {server}, {CONNECTIONS} connections", latencies)
+                                 + f", {throughput:.0f} requests/s")
+    finally:
+        connection_created.disconnect(add_latency)
+        connections.close_all()
+        with transaction.atomic(): #without the signals, the rows are gone together
+            for queryset in [ProductCard.objects.filter(product__in=products),
+                             ProductImage.objects.filter(product_line__in=lines),
+                             ProductLine.objects.filter(pk__in=[line.pk for line in lines]),
+                             Product.objects.filter(pk__in=[product.pk for product in products]),
+                             ProductType.objects.filter(pk=products[0].product_type_id),
+                             Category.objects.filter(tree_id=categories[0].tree_id)]:
+                queryset._raw_delete(queryset.db)
@@ -0,0 +1,196 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+# Every product slug has a version number, the cached detail response is stored under that version
+# (Django's cache 'version' argument). Bumping the version makes the old entry unreachable,
+# nothing has to be deleted.
+
+
+def _version_key(slug):
+    return f"product:version:{slug}"
+
+
+def _detail_key(slug):
+    return f"product:detail:{slug}"
+
+
+def _initial_version():
+    """Versions start from a timestamp, not 1, so an evicted and recreated version
+    can't point back at an old cached response"""
+    return time.time_ns() // 1000
+
+
+def get_product_version(slug, create=True):
+    """Current version number of a slug, created on first use (create=False: None until then).
+    Versions expire too (PRODUCT_VERSION_CACHE_TIMEOUT), a recreated version starts from a new timestamp"""
+    key = _version_key(slug)
+    version = cache.get(key)
+    if version is None and create:
+        cache.add(key, _initial_version(), timeout=settings.PRODUCT_VERSION_CACHE_TIMEOUT)
+        version = cache.get(key)
+    return version
+
+
+def _bump(key):
+    try:
+        cache.incr(key)
+    except ValueError: #missing or evicted key, nothing is cached under it
+        pass
+
+
+def _get_versioned(key, slug):
+    version = get_product_version(slug, create=False) #a lookup of an unknown slug doesn't leave a key behind
+    return None if version is None else cache.get(key, version=version)
+
+
+def get_product_detail(slug):
+    """Cached retrieve payload for a slug, None on a miss"""
+    return _get_versioned(_detail_key(slug), slug)
+
+
+def set_product_detail(slug, data):
+    """Only the payload of an existing product is cached, the [] of an unknown slug isn't"""
+    if data:
+        cache.set(_detail_key(slug), data, timeout=settings.PRODUCT_DETAIL_CACHE_TIMEOUT,
+                  version=get_product_version(slug))
+
+
+def _variant_key(slug):
+    return f"product:variants:{slug}"
+
+
+def get_variant_index(slug):
+    """The variant index of a slug (see variants.py), stored under the same version as the detail
+    response: the writes that invalidate one invalidate the other"""
+    return _get_versioned(_variant_key(slug), slug)
+
+
+def set_variant_index(slug, index):
+    if index["lines"]: #an unknown slug (or a product without active lines) isn't cached
+        cache.set(_variant_key(slug), index, timeout=settings.PRODUCT_DETAIL_CACHE_TIMEOUT,
+                  version=get_product_version(slug))
+
+
+def bump_product_versions(slugs):
+    for slug in set(slugs):
+        _bump(_version_key(slug))
+
+
+# The nested category tree with product counts, rebuilt after any category or product change
+CATEGORY_TREE_KEY = "category:tree"
+
+
+def get_category_tree():
+    return cache.get(CATEGORY_TREE_KEY)
+
+
+def set_category_tree(tree):
+    cache.set(CATEGORY_TREE_KEY, tree, timeout=settings.CATEGORY_TREE_CACHE_TIMEOUT)
+
+
+def invalidate_category_tree():
+    cache.delete(CATEGORY_TREE_KEY)
+
+
+# Change log of the in-memory autocomplete index (autocomplete.py): every committed product change
+# gets a generation number (incr, atomic on a shared backend) and the changed product ids are stored under it
+# right after. Each worker process replays the generations it hasn't seen, a generation still missing after
+# AUTOCOMPLETE_CHANGE_LOG_GRACE seconds (expired, evicted) means a full rebuild.
+# Only a cache shared by the workers (redis, memcached) works, see autocomplete.check_shared_cache()
+AUTOCOMPLETE_GENERATION_KEY = "autocomplete:generation"
+
+
+def _autocomplete_changes_key(generation):
+    return f"autocomplete:changes:{generation}"
+
+
+def get_autocomplete_generation():
+    return cache.get(AUTOCOMPLETE_GENERATION_KEY, 0)
+
+
+def log_autocomplete_changes(product_ids):
+    try:
+        generation = cache.incr(AUTOCOMPLETE_GENERATION_KEY)
+    except ValueError: #missing or evicted, the workers that saw a higher number reload everything
+        cache.add(AUTOCOMPLETE_GENERATION_KEY, 0, timeout=None)
+        generation = cache.incr(AUTOCOMPLETE_GENERATION_KEY)
+    cache.set(_autocomplete_changes_key(generation), list(product_ids), timeout=settings.AUTOCOMPLETE_CHANGE_LOG_TIMEOUT)
+
+
+def get_autocomplete_changes(first, last):
+    """(last generation read, product ids changed in generations first..it), the generations are read in
+    order up to the first missing one (not written yet, or gone)"""
+    changes = cache.get_many([_autocomplete_changes_key(generation) for generation in range(first, last + 1)])
+    product_ids = set()
+    generation = first - 1
+    while _autocomplete_changes_key(generation + 1) in changes:
+        generation += 1
+        product_ids.update(changes[_autocomplete_changes_key(generation)])
+    return generation, product_ids
+
+
+class TTLCache:
+    """A small in-process cache: at most `maxsize` entries, each kept for `ttl` seconds,
+    least recently used entries are evicted first. Safe to share between threads.
+    Every worker process has its own copy, so changes from other processes are
+    only picked up when the entries expire"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict() # key: (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                self._data.pop(key, None)
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+            }
+
+
+# Category list pages, small and read heavy. Keyed on the state behind the ETag (views.CategoryView.list),
+# the signals only free the memory of the old entries in this process
+category_list_cache = TTLCache(maxsize=settings.CATEGORY_LIST_CACHE_SIZE, ttl=settings.CATEGORY_LIST_CACHE_TTL)
+
+
+def categories_changed():
+    """Drops the category list entries of this process and the shared tree, now and after the commit"""
+    category_list_cache.clear()
+    invalidate_category_tree()
+    transaction.on_commit(category_list_cache.clear)
+    transaction.on_commit(invalidate_category_tree)
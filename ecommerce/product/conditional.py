@@ -0,0 +1,84 @@
+from calendar import timegm
+from functools import wraps
+from hashlib import md5
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.decorators import method_decorator
+from django.utils.http import http_date
+from django.views.decorators.http import condition
+
+from .models import Category, Product
+
+# ETag and Last-Modified are computed from (count, max(updated_at)) of the rows behind a response,
+# one aggregate query on an indexed filter, without serializing the body.
+# A deleted or deactivated row changes the count, every other change moves updated_at.
+# Both functions of a view share the result through the request.
+
+
+def _state(request, queryset):
+    if not hasattr(request, "_catalogue_state"):
+        request._catalogue_state = queryset.aggregate(count=Count("id"), last_modified=Max("updated_at"))
+    return request._catalogue_state
+
+
+def _etag(request, state):
+    """The full path is part of the ETag, every page/query string is a different representation"""
+    last_modified = state["last_modified"].isoformat() if state["last_modified"] else ""
+    return md5(f"{request.get_full_path()}|{state['count']}|{last_modified}".encode()).hexdigest()
+
+
+async def _astate(request, queryset):
+    if not hasattr(request, "_catalogue_state"):
+        request._catalogue_state = await queryset.aaggregate(count=Count("id"), last_modified=Max("updated_at"))
+    return request._catalogue_state
+
+
+def product_detail_etag(request, slug=None, **kwargs):
+    return _etag(request, _state(request, Product.objects.is_active().filter(slug=slug)))
+
+
+def product_detail_last_modified(request, slug=None, **kwargs):
+    return _state(request, Product.objects.is_active().filter(slug=slug))["last_modified"]
+
+
+def category_list_etag(request, **kwargs):
+    return _etag(request, _state(request, Category.objects.is_active()))
+
+
+def category_list_state(request):
+    """(count, last_modified) behind the category list ETag, the same lookup as the ETag within a request"""
+    state = _state(request, Category.objects.is_active())
+    return state["count"], state["last_modified"]
+
+
+def category_list_last_modified(request, **kwargs):
+    return _state(request, Category.objects.is_active())["last_modified"]
+
+
+product_detail_conditional = method_decorator(
+    condition(etag_func=product_detail_etag, last_modified_func=product_detail_last_modified))
+
+category_list_conditional = method_decorator(
+    condition(etag_func=category_list_etag, last_modified_func=category_list_last_modified))
+
+
+def async_product_detail_conditional(view):
+    """product_detail_conditional for the async views (Django's condition() only wraps sync views),
+    same ETag/Last-Modified and the same 304/412 handling"""
+    @wraps(view)
+    async def inner(request, slug=None, **kwargs):
+        if request.method not in ("GET", "HEAD"):
+            return await view(request, slug=slug, **kwargs)
+        state = await _astate(request, Product.objects.is_active().filter(slug=slug))
+        etag = quote_etag(_etag(request, state))
+        last_modified = state["last_modified"] and int(timegm(state["last_modified"].utctimetuple()))
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = await view(request, slug=slug, **kwargs)
+        if last_modified and not response.has_header("Last-Modified"):
+            response.headers["Last-Modified"] = http_date(last_modified)
+        if not response.has_header("ETag"):
+            response.headers["ETag"] = etag
+        return response
+    return inner
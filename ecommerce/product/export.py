@@ -0,0 +1,77 @@
+"""Full catalogue export, one row per active product line of an active product, as JSONL or CSV.
+The rows are read with a server side chunked iterator, the prefetches run once per chunk,
+so the memory use depends on the chunk size, not on the size of the catalogue"""
+import csv
+import json
+
+from django.db.models import Prefetch
+
+from .models import AttributeValue, ProductImage, ProductLine
+from .renderers import FastJSONRenderer
+
+EXPORT_COLUMNS = ["pid", "name", "slug", "category", "sku", "price", "stock_qty", "order",
+                  "specification", "attribute", "images"]
+
+
+def export_queryset():
+    return (
+        ProductLine.objects.filter(is_active=True, product__is_active=True)
+        .select_related("product__category")
+        .prefetch_related(
+            Prefetch("product_image", queryset=ProductImage.objects.order_by("order", "pk")),
+            Prefetch("attribute_value", queryset=AttributeValue.objects.select_related("attribute").order_by("pk")),
+            Prefetch("product__attribute_value",
+                     queryset=AttributeValue.objects.select_related("attribute").order_by("pk")),
+        )
+        .order_by("product_id", "order", "pk")
+    )
+
+
+def export_rows(chunk_size=2000):
+    """Yields one dict per product line, in EXPORT_COLUMNS order"""
+    for line in export_queryset().iterator(chunk_size=chunk_size):
+        product = line.product
+        yield {
+            "pid": product.pid,
+            "name": product.name,
+            "slug": product.slug,
+            "category": product.category.slug if product.category else None,
+            "sku": line.sku,
+            "price": str(line.price),
+            "stock_qty": line.stock_qty,
+            "order": line.order,
+            "specification": {value.attribute.name: value.attribute_value for value in line.attribute_value.all()},
+            "attribute": {value.attribute.name: value.attribute_value for value in product.attribute_value.all()},
+            "images": [image.url.url for image in line.product_image.all() if image.url],
+        }
+
+
+def render_jsonl(rows):
+    renderer = FastJSONRenderer()
+    for row in rows:
+        yield renderer.render(row) + b"\n"
+
+
+class Echo:
+    """csv.writer target that hands the formatted line back instead of buffering it"""
+
+    def write(self, value):
+        return value
+
+
+def render_csv(rows):
+    """The nested values (specification, attribute, images) go into their cell as JSON"""
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        yield writer.writerow([
+            json.dumps(row[column], ensure_ascii=False) if isinstance(row[column], (dict, list)) else row[column]
+            for column in EXPORT_COLUMNS
+        ])
+
+
+# output name: (renderer, content type, file extension)
+EXPORT_FORMATS = {
+    "jsonl": (render_jsonl, "application/x-ndjson", "jsonl"),
+    "csv": (render_csv, "text/csv", "csv"),
+}
@@ -0,0 +1,82 @@
+"""Faceted search over a category subtree: products filtered on attribute values, price and stock,
+with the number of matching products for every attribute value.
+Everything is read from the ProductFacet table (one row per active product line and attribute value):
+- values of one attribute are OR'ed (size 32 or 40), attributes are AND'ed (size and brand),
+  a product matches when one of its active lines passes every filter
+- the counts of an attribute ignore the filter on that attribute itself, so "32: 120, 40: 80"
+  stays visible after picking 32. One grouped COUNT(DISTINCT product) for the attributes without
+  a selection, and one per attribute with a selection
+- a count without any filter left (the category page as it opens, or the only selected attribute)
+  is a SUM of the precomputed ProductFacetCount rows of the subtree's categories"""
+from django.db.models import Count, Q, Sum
+
+from .models import AttributeValue, Category, ProductCard, ProductFacet, ProductFacetCount, ProductLine
+
+
+def selected_values(value_ids):
+    """{attribute id: {value ids}} for the selected value ids, unknown ids are left out"""
+    groups = {}
+    for value_id, attribute_id in AttributeValue.objects.filter(pk__in=value_ids).values_list("pk", "attribute_id"):
+        groups.setdefault(attribute_id, set()).add(value_id)
+    return groups
+
+
+def subtree_category_ids(category):
+    return Category.objects.filter(
+        tree_id=category.tree_id, lft__range=(category.lft, category.rght)).values("id")
+
+
+def _filter(queryset, groups, rows, price_min=None, price_max=None, in_stock=False, line="product_line_id"):
+    """rows: the subtree's ProductFacet rows, the lines with a selected value are looked up among them.
+    An IN (subquery) is evaluated once and lets the database start from the lines with the selected
+    values (a few % of the subtree), a correlated EXISTS is run again for every row"""
+    if price_min is not None:
+        queryset = queryset.filter(price__gte=price_min)
+    if price_max is not None:
+        queryset = queryset.filter(price__lte=price_max)
+    if in_stock:
+        queryset = queryset.filter(stock_qty__gt=0)
+    for value_ids in groups.values():
+        queryset = queryset.filter(**{f"{line}__in": rows.filter(attribute_value__in=value_ids).values("product_line_id")})
+    return queryset
+
+
+def facet_products(category, groups, price_min=None, price_max=None, in_stock=False):
+    """Active ProductCards of the subtree with an active line passing every filter"""
+    categories = subtree_category_ids(category)
+    cards = ProductCard.objects.is_active().filter(category_id__in=categories)
+    if not groups and price_min is None and price_max is None and not in_stock:
+        return cards
+    rows = ProductFacet.objects.filter(category_id__in=categories)
+    lines = _filter(ProductLine.objects.is_active().filter(product__category_id__in=categories),
+                    groups, rows, price_min, price_max, in_stock, line="pk")
+    return cards.filter(product_id__in=lines.values("product_id")) #not a correlated EXISTS, see _filter()
+
+
+def facet_counts(category, groups, price_min=None, price_max=None, in_stock=False):
+    """[{"attribute", "id", "values": [{"id", "value", "count"}]}] sorted by attribute and value name,
+    values without any matching product are left out"""
+    categories = subtree_category_ids(category)
+    rows = ProductFacet.objects.filter(category_id__in=categories)
+    totals = ProductFacetCount.objects.filter(category_id__in=categories)
+    unfiltered = price_min is None and price_max is None and not in_stock
+    queries = [(Q(attribute_id__in=groups), groups)] # (attributes to count (negated), filters applied)
+    queries += [(~Q(attribute_id=attribute_id), {other: value_ids for other, value_ids in groups.items()
+                                                 if other != attribute_id}) for attribute_id in groups]
+
+    counts = {} # value id: count
+    for excluded, others in queries:
+        if unfiltered and not others: #the precomputed per category counts, summed over the subtree
+            queryset = totals.exclude(excluded).values_list("attribute_value_id").annotate(Sum("products"))
+        else:
+            queryset = (_filter(rows.exclude(excluded), others, rows, price_min, price_max, in_stock)
+                        .values_list("attribute_value_id").annotate(Count("product_id", distinct=True)))
+        counts.update(queryset.order_by())
+
+    facets = {} # attribute id: facet
+    values = (AttributeValue.objects.filter(pk__in=counts).order_by("attribute__name", "attribute_value", "pk")
+              .values_list("attribute_id", "attribute__name", "pk", "attribute_value"))
+    for attribute_id, name, value_id, value in values:
+        facet = facets.setdefault(attribute_id, {"attribute": name, "id": attribute_id, "values": []})
+        facet["values"].append({"id": value_id, "value": value, "count": counts[value_id]})
+    return list(facets.values())
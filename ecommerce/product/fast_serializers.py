@@ -0,0 +1,119 @@
+"""Fast read path for ProductSerializer and ProductCategorySerializer, enabled with FAST_READ_SERIALIZERS.
+Builds the same output as the DRF serializers (byte identical JSON) from .values() rows,
+without DRF's per-field dispatch and OrderedDict building:
+- every scalar field is compiled once into a (key, column, converter) tuple, the converter is taken
+  from the DRF field itself and skipped for columns that already come out of the database as str/int
+- the nested lists are grouped in plain dicts, the specification dicts are built directly
+Fetching (4 queries, all keyed by the product ids) and assembling are separate steps,
+so the async views can run the queries themselves"""
+from functools import lru_cache
+
+from rest_framework import serializers
+
+from .models import ProductAttributeValue, ProductImage, ProductLine, ProductLineAttributeValue
+from .serializers import ProductCategorySerializer, ProductImageSerializer, ProductLineSerializer, ProductSerializer
+
+# Columns to select for each level, in output order
+PRODUCT_COLUMNS = ["id", "name", "slug", "pid", "description", "created_at"]
+PRODUCT_KEYS = ["name", "slug", "pid", "description"]
+LINE_KEYS = ["price", "sku", "stock_qty", "order"]
+IMAGE_KEYS = ["alternative_text", "url", "order"]
+CARD_COLUMNS = ["pk", "name", "slug", "pid", "created_at", "price", "image", "image_alternative_text", "image_order"]
+CARD_KEYS = ["name", "slug", "pid", "created_at", "price"]
+
+
+def _converter(field):
+    """None when the database value is already the output value"""
+    if isinstance(field, serializers.FileField): #ImageField, the column holds the file name
+        storage = field.parent.Meta.model._meta.get_field(field.source).storage
+        return lambda name: storage.url(name) if name else None
+    if isinstance(field, (serializers.CharField, serializers.IntegerField, serializers.BooleanField)):
+        return None
+    return field.to_representation #DecimalField, DateTimeField ...
+
+
+@lru_cache(maxsize=None)
+def compile_fields(serializer_class, keys):
+    """((key, converter), ...) for the scalar fields of a DRF serializer, built once per process"""
+    fields = serializer_class().fields
+    return tuple((key, _converter(fields[key])) for key in keys)
+
+
+def _row(values, compiled):
+    """values: tuple in the same order as the compiled keys"""
+    return {key: (value if convert is None or value is None else convert(value))
+            for (key, convert), value in zip(compiled, values)}
+
+
+def fetch_product_related(product_ids):
+    """The rows under a page of products, the querysets are returned unevaluated.
+    All four depend on the product ids only, so they can run concurrently"""
+    return {
+        "lines": ProductLine.objects.filter(product_id__in=product_ids).order_by("pk")
+            .values_list("product_id", "id", *LINE_KEYS),
+        "images": ProductImage.objects.filter(product_line__product_id__in=product_ids).order_by("pk")
+            .values_list("product_line_id", *IMAGE_KEYS),
+        "line_specification": ProductLineAttributeValue.objects.filter(product_line__product_id__in=product_ids)
+            .order_by("attribute_value_id")
+            .values_list("product_line_id", "attribute_value__attribute__name", "attribute_value__attribute_value"),
+        "product_specification": ProductAttributeValue.objects.filter(product_id__in=product_ids)
+            .order_by("attribute_value_id")
+            .values_list("product_id", "attribute_value__attribute__name", "attribute_value__attribute_value"),
+    }
+
+
+def assemble_products(products, related):
+    """products: PRODUCT_COLUMNS dicts, related: fetch_product_related() rows (evaluated or not)
+    Returns the ProductSerializer output as plain dicts"""
+    product_fields = compile_fields(ProductSerializer, tuple(PRODUCT_KEYS))
+    line_fields = compile_fields(ProductLineSerializer, tuple(LINE_KEYS))
+    image_fields = compile_fields(ProductImageSerializer, tuple(IMAGE_KEYS))
+
+    images = {}
+    for line_id, *values in related["images"]:
+        images.setdefault(line_id, []).append(_row(values, image_fields))
+
+    line_specification = {}
+    for line_id, name, value in related["line_specification"]:
+        line_specification.setdefault(line_id, {})[name] = value
+
+    lines = {}
+    for product_id, line_id, *values in related["lines"]:
+        line = _row(values, line_fields)
+        line["product_image"] = images.get(line_id, [])
+        line["specification"] = line_specification.get(line_id, {})
+        lines.setdefault(product_id, []).append(line)
+
+    product_specification = {}
+    for product_id, name, value in related["product_specification"]:
+        product_specification.setdefault(product_id, {})[name] = value
+
+    output = []
+    for product in products:
+        data = _row([product[key] for key in PRODUCT_KEYS], product_fields)
+        data["product_line"] = lines.get(product["id"], [])
+        data["attribute"] = product_specification.get(product["id"], {})
+        output.append(data)
+    return output
+
+
+def serialize_products(products):
+    """ProductSerializer(many=True).data for .values(*PRODUCT_COLUMNS) rows"""
+    products = list(products)
+    return assemble_products(products, fetch_product_related([product["id"] for product in products]))
+
+
+def serialize_product_cards(cards):
+    """ProductCategorySerializer(many=True).data for ProductCard .values(*CARD_COLUMNS) rows"""
+    card_fields = compile_fields(ProductCategorySerializer, tuple(CARD_KEYS))
+    url = _converter(ProductImageSerializer().fields["url"])
+    output = []
+    for card in cards:
+        data = _row([card[key] for key in CARD_KEYS], card_fields)
+        if card["price"] is None: #no active product line
+            del data["price"]
+        else:
+            data["image"] = [{"alternative_text": card["image_alternative_text"], "url": url(card["image"]),
+                              "order": card["image_order"]}] if card["image"] else []
+        output.append(data)
+    return output
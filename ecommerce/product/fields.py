@@ -1,6 +1,10 @@
-from django.db import models
+from django.apps import apps
+from django.db import models, router, transaction
+from django.db.models import F, OuterRef
+from django.db.models.functions import Coalesce, Greatest
 from django.core import checks
-from django.core.exceptions import ObjectDoesNotExist
+
+ALLOCATE_BATCH = 250 #parents per UPDATE, 3 parameters each, under SQLite's 999 variables
 
 
 class OrderField(models.PositiveIntegerField):
@@ -8,8 +12,9 @@ class OrderField(models.PositiveIntegerField):
     
     description = "Ordering field on a unique field"
 
-    def __init__(self, unique_for_field=None, *args, **kwargs):
+    def __init__(self, unique_for_field=None, counter=None, *args, **kwargs):
         self.unique_for_field = unique_for_field
+        self.counter = counter #"app_label.Model" with scope, parent_id and value fields, see allocate()
         super().__init__(*args, **kwargs)
 
 
@@ -18,6 +23,7 @@ class OrderField(models.PositiveIntegerField):
         return [
             *super().check(**kwargs),
             *self._check_for_field_attribute(**kwargs),
+            *self._check_counter_attribute(**kwargs),
         ]
     
     def _check_for_field_attribute(self, **kwargs):
@@ -32,27 +38,99 @@ class OrderField(models.PositiveIntegerField):
                     ]
         else:
             return []
-        
+
+    def _check_counter_attribute(self, **kwargs):
+        if self.counter is None:
+            return [
+                checks.Error("OrderField must define a 'counter' model"),
+                    ]
+        return []
+
+
+    @property
+    def parent_attname(self):
+        """product -> product_id"""
+        return self.model._meta.get_field(self.unique_for_field).attname
+
+    @property
+    def counter_model(self):
+        return apps.get_model(self.counter)
+
+    def _next_value(self, using, count):
+        """The counter's new value: past the parent's highest order (the (parent, order) unique index), plus count"""
+        last = (self.model._default_manager.using(using).filter(**{self.parent_attname: OuterRef("parent_id")})
+                .order_by(f"-{self.attname}").values(self.attname)[:1])
+        return Greatest(F("value"), Coalesce(models.Subquery(last), 0)) + count
+
+    def allocate(self, parent_id, count=1, using=None):
+        """Reserves count consecutive order values for one parent and returns the first one.
+        The parent's OrderCounter row is incremented in the database (UPDATE ... SET value = value + count),
+        so two writers never read the same value: the updated row stays locked (PostgreSQL) or the
+        database write locked (SQLite) until the transaction commits.
+        Greatest() with the parent's highest order keeps the counter ahead of rows saved with an
+        explicit order (admin, bulk import), that lookup uses the (parent, order) unique index"""
+        counter_model = self.counter_model
+        scope = self.model._meta.label_lower
+        counters = counter_model.objects.using(using).filter(scope=scope, parent_id=parent_id)
+        value = self._next_value(using, count)
+        with transaction.atomic(using=using):
+            if not counters.update(value=value):
+                # First child of this parent, a concurrent writer may create the row first
+                counter_model.objects.using(using).bulk_create(
+                    [counter_model(scope=scope, parent_id=parent_id)], ignore_conflicts=True)
+                counters.update(value=value)
+            return counters.values_list("value", flat=True).get() - count + 1
+
+    def allocate_many(self, counts, using=None):
+        """allocate() for several parents, counts: {parent id: count}. Returns {parent id: first value}.
+        Three queries per ALLOCATE_BATCH parents: the missing counter rows, one UPDATE with a CASE
+        per parent, and reading the values back"""
+        counter_model = self.counter_model
+        scope = self.model._meta.label_lower
+        first = {}
+        parent_ids = list(counts)
+        with transaction.atomic(using=using):
+            for start in range(0, len(parent_ids), ALLOCATE_BATCH):
+                batch = parent_ids[start:start + ALLOCATE_BATCH]
+                counter_model.objects.using(using).bulk_create(
+                    [counter_model(scope=scope, parent_id=parent_id) for parent_id in batch], ignore_conflicts=True)
+                counters = counter_model.objects.using(using).filter(scope=scope, parent_id__in=batch)
+                count = models.Case(*[models.When(parent_id=parent_id, then=counts[parent_id]) for parent_id in batch])
+                counters.update(value=self._next_value(using, count))
+                for parent_id, value in counters.values_list("parent_id", "value"):
+                    first[parent_id] = value - counts[parent_id] + 1
+        return first
 
     def pre_save(self, model_instance, add):
         """Every/Each instance of order number created passes/passed through the pre_save function here"""
-        # print(model_instance)
         if getattr(model_instance, self.attname) is None:
-            """When no order number value is inputed,
-              If there is no order number value inputed, then we would need to generate one."""
-            qs = self.model.objects.all() #self.model ProductLine model
-            # ' Select * from ProductLine where product="shoe" '
-            try: # Build your query to filter out all of the Product-Line that belongs to a specific product
-                query = {
-                    self.unique_for_field: getattr(model_instance, self.unique_for_field) 
-                    }# {"product": "Nike shoe"}
-                qs = qs.filter(**query) # print(query)  # print(qs)
-                last_item = qs.latest(self.attname) #self.attname == order #latest gets the last item
-                value = last_item.order+1
-            except ObjectDoesNotExist: #If no data in the database, then value = 1, first value
-                value = 1
-            return value #This saves directly to the order field in the db, #order = OrderField(unique_for_field="product" , blank=True)
-        else:
-            return super().pre_save(model_instance, add)
-        
-        
+            """When no order number value is inputed, the next one is taken from the parent's counter"""
+            using = router.db_for_write(self.model, instance=model_instance)
+            value = self.allocate(getattr(model_instance, self.parent_attname), using=using)
+            setattr(model_instance, self.attname, value) #the instance knows its order after save()
+            return value
+        return super().pre_save(model_instance, add)
+
+
+def allocate_orders(objs, field_name="order"):
+    """Fills in the missing order values of unsaved objects (of one model) before a bulk_create.
+    One parent is one allocate() (two queries), more parents are one allocate_many(),
+    whatever the number of new children"""
+    missing = {} # parent id: objects
+    field = None
+    for obj in objs:
+        field = obj._meta.get_field(field_name)
+        if getattr(obj, field.attname) is None:
+            missing.setdefault(getattr(obj, field.parent_attname), []).append(obj)
+    if not missing:
+        return objs
+    using = router.db_for_write(field.model)
+    if len(missing) == 1:
+        [(parent_id, children)] = missing.items()
+        first = {parent_id: field.allocate(parent_id, count=len(children), using=using)}
+    else:
+        first = field.allocate_many({parent_id: len(children) for parent_id, children in missing.items()}, using=using)
+    for parent_id, children in missing.items():
+        for offset, obj in enumerate(children):
+            setattr(obj, field.attname, first[parent_id] + offset)
+    return objs
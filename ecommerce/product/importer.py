@@ -0,0 +1,375 @@
+"""Bulk catalogue import, one input row per product line (the columns of the export, plus
+product_type and weight). The model save() methods run full_clean() and OrderField runs a
+latest() query per row, so the rows are handled in batches instead:
+- every value is checked with the model field's own clean() (lengths, decimals, slugs ...), no queries
+- categories, product types, products, product lines and attribute values are looked up once per batch
+- order values are allocated from the OrderField counters with allocate_orders(), like OrderField.pre_save
+- everything is written with bulk_create/bulk_update, the product cards and caches are refreshed once per batch
+A batch is one transaction, invalid rows are reported and skipped
+Active flags: line_is_active is the product line's flag and product_is_active the product's, is_active is the
+default of both. A product is active when any of its rows in the batch has product_is_active (or, without the
+column, an active line), so an inactive first variant doesn't hide the other variants of the product"""
+import csv
+import hashlib
+import json
+from decimal import Decimal
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .cache import invalidate_category_tree
+from .fields import allocate_orders
+from .models import (Attribute, AttributeValue, Category, Product, ProductAttributeValue, ProductImage,
+                     ProductLine, ProductLineAttributeValue, ProductType)
+from .signals import products_changed
+
+IMPORT_COLUMNS = ["pid", "name", "slug", "description", "category", "product_type", "is_active",
+                  "product_is_active", "line_is_active", "sku", "price", "stock_qty", "weight",
+                  "specification", "attribute", "images"]
+JSON_COLUMNS = {"specification": dict, "attribute": dict, "images": list}
+
+PRODUCT_FIELDS = ["pid", "name", "slug", "description"]
+LINE_FIELDS = ["sku", "price", "stock_qty", "weight"]
+
+
+def read_jsonl(stream):
+    """Yields (line number, raw row), the JSON is decoded in clean_row so a bad line is one error"""
+    for number, line in enumerate(stream, 1):
+        if line.strip():
+            yield number, line
+
+
+def read_csv(stream):
+    """The nested columns (specification, attribute, images) hold JSON, like the export writes them"""
+    for number, row in enumerate(csv.DictReader(stream), 2): #line 1 is the header
+        yield number, row
+
+
+READERS = {"jsonl": read_jsonl, "csv": read_csv}
+
+
+def _boolean(value, default=True):
+    if value in (None, ""):
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ("1", "true", "t", "yes")
+
+
+def _decode(raw):
+    if isinstance(raw, str):
+        try:
+            raw = json.loads(raw)
+        except ValueError as e:
+            raise ValidationError(f"Invalid JSON: {e}")
+        if not isinstance(raw, dict):
+            raise ValidationError("Expected a JSON object")
+    return raw
+
+
+def _messages(error):
+    if hasattr(error, "error_dict"):
+        return "; ".join(f"{name}: {message}" for name, messages in error.message_dict.items() for message in messages)
+    return "; ".join(error.messages)
+
+
+def clean_row(raw, default_product_type=None):
+    """A typed row, or ValidationError. Same field checks as full_clean(), without the queries"""
+    raw = _decode(raw)
+    row = {}
+    errors = {}
+    for model, names in ((Product, PRODUCT_FIELDS), (ProductLine, LINE_FIELDS)):
+        for name in names:
+            value = raw.get(name)
+            if name == "slug" and not value:
+                value = slugify(raw.get("name") or "")
+            if name == "description" and value is None:
+                value = ""
+            try:
+                row[name] = model._meta.get_field(name).clean(value, None)
+            except ValidationError as e:
+                errors[name] = e.messages
+
+    for name, kind in JSON_COLUMNS.items():
+        value = raw.get(name) or kind()
+        if isinstance(value, str):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                value = None
+        if not isinstance(value, kind):
+            errors[name] = [f"Expected a JSON {kind.__name__}"]
+        row[name] = value
+
+    row["category"] = raw.get("category") or None
+    row["product_type"] = raw.get("product_type") or default_product_type
+    if not row["product_type"]:
+        errors["product_type"] = ["This field cannot be blank."]
+    row["line_is_active"] = _boolean(raw.get("line_is_active"), _boolean(raw.get("is_active")))
+    row["product_is_active"] = _boolean(raw.get("product_is_active"), row["line_is_active"])
+    if errors:
+        raise ValidationError(errors)
+    return row
+
+
+def _lookup_attribute_values(pairs):
+    """{(attribute name, value): AttributeValue id}, the missing attributes and values are created.
+    A fixed number of queries for the whole batch"""
+    names = {name for name, _ in pairs}
+    attributes = {}
+    for pk, name in Attribute.objects.filter(name__in=names).order_by("-pk").values_list("id", "name"):
+        attributes[name] = pk #the oldest attribute wins when names repeat
+    missing = [Attribute(name=name) for name in sorted(names - set(attributes))]
+    for attribute in Attribute.objects.bulk_create(missing):
+        attributes[attribute.name] = attribute.pk
+
+    values = {}
+    rows = AttributeValue.objects.filter(
+        attribute_id__in=attributes.values(), attribute_value__in={value for _, value in pairs}
+    ).order_by("-pk").values_list("id", "attribute_id", "attribute_value")
+    names_by_id = {pk: name for name, pk in attributes.items()}
+    for pk, attribute_id, value in rows:
+        values[(names_by_id[attribute_id], value)] = pk
+    missing = [AttributeValue(attribute_id=attributes[name], attribute_value=value)
+               for name, value in sorted(set(pairs) - set(values))]
+    for value in AttributeValue.objects.bulk_create(missing):
+        values[(names_by_id[value.attribute_id], value.attribute_value)] = value.pk
+    return values, attributes
+
+
+def _sync_assignments(model, parent_field, wanted):
+    """wanted: {parent id: {attribute id: attribute value id}}
+    Makes the parents' assignments for those attributes match, one value per attribute
+    (the invariant ProductAttributeValue/ProductLineAttributeValue.clean() checks)"""
+    if not wanted:
+        return
+    existing = model.objects.filter(**{f"{parent_field}__in": wanted}).values_list(
+        "id", parent_field, "attribute_value_id", "attribute_id")
+    stale, present = [], set()
+    for pk, parent_id, value_id, attribute_id in existing:
+        target = wanted[parent_id].get(attribute_id)
+        if target is None:
+            continue #an attribute the row doesn't mention is kept
+        if target == value_id:
+            present.add((parent_id, value_id))
+        else:
+            stale.append(pk)
+    if stale:
+        model.objects.filter(pk__in=stale).delete()
+    model.objects.bulk_create([
+        model(**{parent_field: parent_id, "attribute_value_id": value_id, "attribute_id": attribute_id})
+        for parent_id, values in wanted.items() for attribute_id, value_id in values.items()
+        if (parent_id, value_id) not in present
+    ])
+
+
+def import_batch(rows):
+    """rows: [(line number, clean_row() dict)]
+    Returns {"products_created", "products_updated", "lines_created", "lines_updated", "errors"}"""
+    result = {"products_created": 0, "products_updated": 0, "lines_created": 0, "lines_updated": 0, "errors": []}
+
+    categories = dict(Category.objects.filter(
+        slug__in={row["category"] for _, row in rows if row["category"]}).values_list("slug", "id"))
+    product_types = {}
+    for pk, name in ProductType.objects.filter(
+            name__in={row["product_type"] for _, row in rows}).order_by("-pk").values_list("id", "name"):
+        product_types[name] = pk
+
+    valid, seen = [], set()
+    for number, row in rows:
+        if row["category"] and row["category"] not in categories:
+            result["errors"].append((number, f"Unknown category {row['category']!r}"))
+        elif row["product_type"] not in product_types:
+            result["errors"].append((number, f"Unknown product type {row['product_type']!r}"))
+        elif (row["pid"], row["sku"]) in seen:
+            result["errors"].append((number, f"Duplicate sku {row['sku']!r} for product {row['pid']!r}"))
+        else:
+            seen.add((row["pid"], row["sku"]))
+            valid.append(row)
+    if not valid:
+        return result
+
+    with transaction.atomic():
+        # Products, the first row of a pid carries the product columns, any of its rows can make it active
+        products = Product.objects.in_bulk({row["pid"] for row in valid}, field_name="pid")
+        product_active = {}
+        for row in valid:
+            product_active[row["pid"]] = product_active.get(row["pid"], False) or row["product_is_active"]
+        created, updated = {}, {}
+        old_slugs = set() #a renamed product's detail is cached under its old slug
+        for row in valid:
+            if row["pid"] in created or row["pid"] in updated:
+                continue
+            values = {"name": row["name"], "slug": row["slug"], "description": row["description"],
+                      "category_id": categories.get(row["category"]), "is_active": product_active[row["pid"]],
+                      "product_type_id": product_types[row["product_type"]]}
+            product = products.get(row["pid"])
+            if product is None:
+                created[row["pid"]] = Product(pid=row["pid"], **values)
+            else:
+                old_slugs.add(product.slug)
+                for name, value in values.items():
+                    setattr(product, name, value)
+                updated[row["pid"]] = product
+        Product.objects.bulk_create(created.values())
+        Product.objects.bulk_update(updated.values(), ["name", "slug", "description", "category_id",
+                                                       "is_active", "product_type_id"])
+        products = {**updated, **created}
+        result["products_created"], result["products_updated"] = len(created), len(updated)
+
+        # Product lines, matched by (product, sku), new lines go after the product's last order (its counter)
+        product_ids = [product.pk for product in products.values()]
+        lines = {}
+        existing = ProductLine.objects.filter(product_id__in=product_ids, sku__in={sku for _, sku in seen})
+        for line in existing.order_by("-pk"):
+            lines[(line.product_id, line.sku)] = line #the oldest line wins when skus repeat
+        new_lines, changed_lines = [], []
+        row_lines = [] # (row, line)
+        for row in valid:
+            product = products[row["pid"]]
+            line = lines.get((product.pk, row["sku"]))
+            if line is None:
+                line = ProductLine(product=product, sku=row["sku"], product_type_id=product.product_type_id)
+                new_lines.append(line)
+            else:
+                changed_lines.append(line)
+            line.price, line.stock_qty, line.weight = row["price"], row["stock_qty"], row["weight"]
+            line.is_active = row["line_is_active"]
+            row_lines.append((row, line))
+        ProductLine.objects.bulk_create(allocate_orders(new_lines))
+        ProductLine.objects.bulk_update(changed_lines, ["price", "stock_qty", "weight", "is_active"])
+        result["lines_created"], result["lines_updated"] = len(new_lines), len(changed_lines)
+
+        # Images, appended when the url isn't on the product line yet
+        line_ids = [line.pk for _, line in row_lines]
+        known_urls = set(ProductImage.objects.filter(product_line_id__in=line_ids).values_list("product_line_id", "url"))
+        images = []
+        for row, line in row_lines:
+            for url in row["images"]:
+                url = url.lstrip("/") #the export writes storage urls
+                if (line.pk, url) in known_urls:
+                    continue
+                known_urls.add((line.pk, url))
+                images.append(ProductImage(product_line=line, url=url, alternative_text=row["name"][:100]))
+        ProductImage.objects.bulk_create(allocate_orders(images))
+
+        # Specifications
+        pairs = {(str(name), str(value)) for row, _ in row_lines
+                 for key in ("specification", "attribute") for name, value in row[key].items()}
+        values, attributes = _lookup_attribute_values(pairs)
+        line_wanted, product_wanted = {}, {}
+        for row, line in row_lines:
+            for name, value in row["specification"].items():
+                line_wanted.setdefault(line.pk, {})[attributes[str(name)]] = values[(str(name), str(value))]
+            for name, value in row["attribute"].items():
+                product_wanted.setdefault(line.product_id, {})[attributes[str(name)]] = values[(str(name), str(value))]
+        _sync_assignments(ProductLineAttributeValue, "product_line_id", line_wanted)
+        _sync_assignments(ProductAttributeValue, "product_id", product_wanted)
+
+        # bulk_create/bulk_update send no signals, refresh the cards and caches once for the batch
+        products_changed(product_ids, extra_slugs=old_slugs)
+        invalidate_category_tree()
+        transaction.on_commit(invalidate_category_tree)
+    return result
+
+
+def import_catalogue(rows, batch_size=1000, default_product_type=None):
+    """rows: (line number, raw row) from one of the READERS
+    Returns the summed import_batch() results plus "rows" (rows read)"""
+    total = {"rows": 0, "products_created": 0, "products_updated": 0, "lines_created": 0,
+             "lines_updated": 0, "errors": []}
+    rows = iter(rows)
+    while batch := list(islice(rows, batch_size)):
+        total["rows"] += len(batch)
+        cleaned = []
+        for number, raw in batch:
+            try:
+                cleaned.append((number, clean_row(raw, default_product_type)))
+            except ValidationError as e:
+                total["errors"].append((number, _messages(e)))
+        result = import_batch(cleaned)
+        for key, value in result.items():
+            total[key] += value
+    return total
+
+
+# Delta sync: hourly supplier snapshots of sku, price and stock_qty
+
+SYNC_FIELDS = ["sku", "price", "stock_qty"]
+
+
+def clean_sync_row(raw):
+    raw = _decode(raw)
+    row, errors = {}, {}
+    for name in SYNC_FIELDS:
+        try:
+            row[name] = ProductLine._meta.get_field(name).clean(raw.get(name), None)
+        except ValidationError as e:
+            errors[name] = e.messages
+    if errors:
+        raise ValidationError(errors)
+    return row
+
+
+def row_digest(price, stock_qty):
+    """Hash of the synced columns, the same for Decimal("10.0"), "10.00" and 10"""
+    value = f"{Decimal(price).quantize(Decimal('0.01'))}|{int(stock_qty)}"
+    return hashlib.blake2b(value.encode(), digest_size=16).digest()
+
+
+def sync_batch(rows):
+    """rows: [(line number, clean_sync_row() dict)]
+    Compares each row's digest with the digest of the product lines' current values,
+    only the lines that differ are written, and only their products are invalidated"""
+    result = {"changed": 0, "unchanged": 0, "unknown": 0, "errors": [], "products": set()}
+    current = {} # sku: [(line id, product id, digest)], a sku can be on more than one product line
+    for pk, sku, product_id, price, stock_qty in ProductLine.objects.filter(
+            sku__in={row["sku"] for _, row in rows}).values_list("id", "sku", "product_id", "price", "stock_qty"):
+        current.setdefault(sku, []).append((pk, product_id, row_digest(price, stock_qty)))
+
+    changed, seen = [], set()
+    now = timezone.now() #bulk_update doesn't run auto_now
+    for number, row in rows:
+        if row["sku"] in seen:
+            result["errors"].append((number, f"Duplicate sku {row['sku']!r}"))
+            continue
+        seen.add(row["sku"])
+        if row["sku"] not in current:
+            result["unknown"] += 1
+            continue
+        digest = row_digest(row["price"], row["stock_qty"])
+        for pk, product_id, current_digest in current[row["sku"]]:
+            if digest == current_digest:
+                result["unchanged"] += 1
+                continue
+            changed.append(ProductLine(pk=pk, price=row["price"], stock_qty=row["stock_qty"], updated_at=now))
+            result["products"].add(product_id)
+    result["changed"] = len(changed)
+
+    if changed:
+        with transaction.atomic():
+            ProductLine.objects.bulk_update(changed, ["price", "stock_qty", "updated_at"])
+            products_changed(result["products"]) #cards (price) and cached product details
+    return result
+
+
+def sync_catalogue(rows, batch_size=1000):
+    """rows: (line number, raw row) from one of the READERS
+    Returns {"rows", "changed", "unchanged", "unknown" (skus without a product line), "errors", "products"},
+    changed/unchanged count product lines, products holds the ids of the products that were invalidated"""
+    total = {"rows": 0, "changed": 0, "unchanged": 0, "unknown": 0, "errors": [], "products": set()}
+    rows = iter(rows)
+    while batch := list(islice(rows, batch_size)):
+        total["rows"] += len(batch)
+        cleaned = []
+        for number, raw in batch:
+            try:
+                cleaned.append((number, clean_sync_row(raw)))
+            except ValidationError as e:
+                total["errors"].append((number, _messages(e)))
+        for key, value in sync_batch(cleaned).items():
+            total[key] = total[key] | value if key == "products" else total[key] + value
+    return total
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ecommerce.product.benchmarks import SUITES
+
+
+class Command(BaseCommand):
+    help = "Runs a catalogue benchmark suite on generated data, the data is rolled back afterwards"
+
+    def add_arguments(self, parser):
+        parser.add_argument("suite", choices=sorted(SUITES))
+        parser.add_argument("--size", type=int, default=10000, help="Amount of generated rows")
+        parser.add_argument("--repeat", type=int, default=50, help="Timed runs per measurement")
+
+    def handle(self, *args, **options):
+        benchmark = SUITES[options["suite"]]
+        if not benchmark.atomic: #cleans up after itself
+            return benchmark(self.stdout, options["size"], options["repeat"])
+        with transaction.atomic():
+            benchmark(self.stdout, options["size"], options["repeat"])
+            transaction.set_rollback(True) #never keep benchmark data
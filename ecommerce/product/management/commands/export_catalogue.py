@@ -0,0 +1,37 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ecommerce.product.export import EXPORT_FORMATS, export_rows
+
+
+class Command(BaseCommand):
+    help = "Writes the active catalogue, one row per active product line, as JSONL or CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output", choices=sorted(EXPORT_FORMATS), default="jsonl")
+        parser.add_argument("--file", help="Destination file, standard output when left out")
+        parser.add_argument("--chunk-size", type=int, default=settings.EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        write_rows = EXPORT_FORMATS[options["output"]][0]
+        rows = 0
+
+        def counted(iterable):
+            nonlocal rows
+            for row in iterable:
+                rows += 1
+                yield row
+
+        start = time.perf_counter()
+        chunks = write_rows(counted(export_rows(options["chunk_size"])))
+        if options["file"]:
+            with open(options["file"], "wb") as destination:
+                for chunk in chunks:
+                    destination.write(chunk.encode() if isinstance(chunk, str) else chunk)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk.decode() if isinstance(chunk, bytes) else chunk, ending="")
+        elapsed = time.perf_counter() - start
+        self.stderr.write(f"Exported {rows} rows in {elapsed:.2f}s ({rows / elapsed if elapsed else 0:.0f} rows/s)")
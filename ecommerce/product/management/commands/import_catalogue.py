@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ecommerce.product.importer import READERS, import_catalogue, sync_catalogue
+
+
+class Command(BaseCommand):
+    help = "Imports product lines from a JSONL or CSV file (the export format plus product_type and weight) in bulk"
+
+    def add_arguments(self, parser):
+        parser.add_argument("file")
+        parser.add_argument("--input", choices=sorted(READERS), help="File format, taken from the extension by default")
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--product-type", help="Product type name for rows without a product_type column")
+        parser.add_argument("--sync", action="store_true",
+                            help="Supplier snapshot (sku, price, stock_qty): only the product lines that changed are updated")
+
+    def handle(self, *args, **options):
+        input_format = options["input"] or options["file"].rsplit(".", 1)[-1].lower()
+        if input_format not in READERS:
+            raise CommandError(f"Unknown format {input_format!r}, use --input {'/'.join(sorted(READERS))}")
+
+        start = time.perf_counter()
+        with open(options["file"], newline="", encoding="utf-8") as stream:
+            rows = READERS[input_format](stream)
+            if options["sync"]:
+                result = sync_catalogue(rows, batch_size=options["batch_size"])
+            else:
+                result = import_catalogue(rows, batch_size=options["batch_size"],
+                                          default_product_type=options["product_type"])
+        elapsed = time.perf_counter() - start
+
+        for number, message in result["errors"][:20]:
+            self.stderr.write(f"line {number}: {message}")
+        if len(result["errors"]) > 20:
+            self.stderr.write(f"... {len(result['errors']) - 20} more errors")
+        summary = f"Read {result['rows']} rows in {elapsed:.2f}s ({result['rows'] / elapsed if elapsed else 0:.0f} rows/s): "
+        if options["sync"]:
+            self.stdout.write(
+                summary + f"{result['changed']} product lines changed, {result['unchanged']} unchanged, "
+                f"{result['unknown']} unknown skus, {len(result['products'])} products invalidated, "
+                f"{len(result['errors'])} rows rejected"
+            )
+            return
+        self.stdout.write(
+            summary +
+            f"{result['products_created']} products created, {result['products_updated']} updated, "
+            f"{result['lines_created']} product lines created, {result['lines_updated']} updated, "
+            f"{len(result['errors'])} rows rejected"
+        )
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from ecommerce.product.read_models import rebuild_product_cards
+
+
+class Command(BaseCommand):
+    help = "Recomputes the denormalized ProductCard, ProductFacet and ProductSearchDocument rows of every product"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        count = rebuild_product_cards(batch_size=options["batch_size"])
+        self.stdout.write(f"Rebuilt {count} product cards")
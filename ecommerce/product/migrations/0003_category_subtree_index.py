@@ -0,0 +1,21 @@
+# Generated by Django 4.1.1 on 2026-10-18 08:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0002_listing_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='category',
+            name='product_category_tree_lft_idx',
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(models.F('tree_id'), models.F('lft'), models.F('rght'), name='product_category_subtree_idx'),
+        ),
+    ]
@@ -0,0 +1,84 @@
+# Generated by Django 4.1.1 on 2026-10-18 08:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+import mptt.fields
+
+BATCH = 1000
+
+
+def fill_product_cards(apps, schema_editor):
+    """The cards of the existing products, what read_models.refresh_product_cards() writes, with the models
+    of this migration (the current ones have columns that don't exist yet)"""
+    Category = apps.get_model("product", "Category")
+    Product = apps.get_model("product", "Product")
+    ProductLine = apps.get_model("product", "ProductLine")
+    ProductImage = apps.get_model("product", "ProductImage")
+    ProductCard = apps.get_model("product", "ProductCard")
+
+    nodes = {pk: (parent_id, slug) for pk, parent_id, slug in Category.objects.values_list("id", "parent_id", "slug")}
+    paths = {}
+    for pk in nodes:
+        slugs, node = [], pk
+        while node is not None:
+            parent_id, slug = nodes[node]
+            slugs.append(slug)
+            node = parent_id
+        paths[pk] = "/".join(reversed(slugs))
+
+    ids = list(Product.objects.order_by("id").values_list("id", flat=True))
+    for start in range(0, len(ids), BATCH):
+        batch = ids[start:start + BATCH]
+        first_lines = {} # product id: (line id, price)
+        for product_id, line_id, price in (ProductLine.objects.filter(product_id__in=batch, is_active=True)
+                                           .order_by("product_id", "order", "id").values_list("product_id", "id", "price")):
+            first_lines.setdefault(product_id, (line_id, price))
+        images = {} # line id: (url, alternative_text, order)
+        for line_id, url, alternative_text, order in (
+                ProductImage.objects.filter(product_line_id__in=[line for line, _ in first_lines.values()])
+                .order_by("product_line_id", "order", "id").values_list("product_line_id", "url", "alternative_text", "order")):
+            images.setdefault(line_id, (url, alternative_text, order))
+        cards = []
+        for product in Product.objects.filter(pk__in=batch).values(
+                "id", "name", "slug", "pid", "is_active", "created_at", "category_id"):
+            line_id, price = first_lines.get(product["id"], (None, None))
+            url, alternative_text, order = images.get(line_id, ("", "", None))
+            cards.append(ProductCard(
+                product_id=product["id"], name=product["name"], slug=product["slug"], pid=product["pid"],
+                is_active=product["is_active"], created_at=product["created_at"],
+                category_id=product["category_id"], category_path=paths.get(product["category_id"], ""),
+                price=price, image=url, image_alternative_text=alternative_text, image_order=order,
+            ))
+        ProductCard.objects.bulk_create(cards)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0004_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductCard',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='card', serialize=False, to='product.product')),
+                ('name', models.CharField(max_length=100)),
+                ('slug', models.SlugField(max_length=255)),
+                ('pid', models.CharField(max_length=10)),
+                ('is_active', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField()),
+                ('category_path', models.CharField(blank=True, max_length=1000)),
+                ('price', models.DecimalField(blank=True, decimal_places=2, max_digits=6, null=True)),
+                ('image', models.ImageField(blank=True, upload_to=None)),
+                ('image_alternative_text', models.CharField(blank=True, max_length=100)),
+                ('image_order', models.PositiveIntegerField(blank=True, null=True)),
+                ('category', mptt.fields.TreeForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='product.category')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='productcard',
+            index=models.Index(fields=['created_at', 'product'], name='product_pro_created_2845ad_idx'),
+        ),
+        migrations.RunPython(fill_product_cards, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.1.1 on 2026-10-18 09:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0005_product_card'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productline',
+            index=models.Index(fields=['sku'], name='product_pro_sku_d42f1e_idx'),
+        ),
+    ]
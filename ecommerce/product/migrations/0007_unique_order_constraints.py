@@ -0,0 +1,36 @@
+# Generated by Django 4.1.1 on 2026-10-18 09:01
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def renumber_duplicate_orders(apps, schema_editor):
+    """Rows saved before the constraint can share an order, those parents are numbered 1..n again"""
+    for model_name, parent in (("ProductLine", "product_id"), ("ProductImage", "product_line_id")):
+        model = apps.get_model("product", model_name)
+        parents = (model.objects.values(parent, "order").annotate(rows=Count("id")).filter(rows__gt=1)
+                   .values_list(parent, flat=True).distinct())
+        for parent_id in parents:
+            rows = list(model.objects.filter(**{parent: parent_id}).order_by("order", "id"))
+            for order, row in enumerate(rows, 1):
+                row.order = order
+            model.objects.bulk_update(rows, ["order"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0006_productline_sku_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(renumber_duplicate_orders, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='productimage',
+            constraint=models.UniqueConstraint(fields=('product_line', 'order'), name='unique_product_image_order'),
+        ),
+        migrations.AddConstraint(
+            model_name='productline',
+            constraint=models.UniqueConstraint(fields=('product', 'order'), name='unique_product_line_order'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 4.1.1 on 2026-10-18 09:09
+
+from django.db import migrations, models
+from django.db.models import Count, Min, OuterRef, Subquery
+import django.db.models.deletion
+
+
+def fill_attribute(apps, schema_editor):
+    """Copies attribute_value.attribute into the new column, made NOT NULL afterwards. Assignments added with
+    .add() skipped clean(), so a parent can hold two values of one attribute: the oldest assignment is kept"""
+    AttributeValue = apps.get_model("product", "AttributeValue")
+    attribute = Subquery(AttributeValue.objects.filter(pk=OuterRef("attribute_value_id")).values("attribute_id")[:1])
+    for model_name, parent in (("ProductAttributeValue", "product_id"), ("ProductLineAttributeValue", "product_line_id")):
+        model = apps.get_model("product", model_name)
+        model.objects.update(attribute_id=attribute)
+        duplicates = (model.objects.values(parent, "attribute_id").annotate(rows=Count("id"), keep=Min("id"))
+                      .filter(rows__gt=1).order_by())
+        for row in duplicates:
+            model.objects.filter(**{parent: row[parent], "attribute_id": row["attribute_id"]}).exclude(
+                pk=row["keep"]).delete()
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute("SET CONSTRAINTS ALL IMMEDIATE") #no pending trigger events before the ALTER TABLE
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0008_order_counter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productattributevalue',
+            name='attribute',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='product.attribute'),
+        ),
+        migrations.AddField(
+            model_name='productlineattributevalue',
+            name='attribute',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='product.attribute'),
+        ),
+        migrations.RunPython(fill_attribute, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='productattributevalue',
+            name='attribute',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='product.attribute'),
+        ),
+        migrations.AlterField(
+            model_name='productlineattributevalue',
+            name='attribute',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='product.attribute'),
+        ),
+        migrations.AddConstraint(
+            model_name='productattributevalue',
+            constraint=models.UniqueConstraint(fields=('product', 'attribute'), name='unique_product_attribute'),
+        ),
+        migrations.AddConstraint(
+            model_name='productlineattributevalue',
+            constraint=models.UniqueConstraint(fields=('product_line', 'attribute'), name='unique_product_line_attribute'),
+        ),
+    ]
@@ -0,0 +1,92 @@
+# Generated by Django 4.1.1 on 2026-10-18 09:28
+
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+BATCH = 1000
+
+
+def fill_product_facets(apps, schema_editor):
+    """The facet rows and counts of the existing products, what read_models.rebuild_product_cards() writes,
+    with the models of this migration"""
+    Product = apps.get_model("product", "Product")
+    ProductLine = apps.get_model("product", "ProductLine")
+    ProductAttributeValue = apps.get_model("product", "ProductAttributeValue")
+    ProductLineAttributeValue = apps.get_model("product", "ProductLineAttributeValue")
+    ProductFacet = apps.get_model("product", "ProductFacet")
+    ProductFacetCount = apps.get_model("product", "ProductFacetCount")
+
+    ids = list(Product.objects.filter(is_active=True).order_by("id").values_list("id", flat=True))
+    for start in range(0, len(ids), BATCH):
+        batch = ids[start:start + BATCH]
+        values = {} # ("line" or "product", id): [(attribute id, value id)]
+        for line_id, attribute_id, value_id in ProductLineAttributeValue.objects.filter(
+                product_line__product_id__in=batch).values_list("product_line_id", "attribute_id", "attribute_value_id"):
+            values.setdefault(("line", line_id), []).append((attribute_id, value_id))
+        for product_id, attribute_id, value_id in ProductAttributeValue.objects.filter(
+                product_id__in=batch).values_list("product_id", "attribute_id", "attribute_value_id"):
+            values.setdefault(("product", product_id), []).append((attribute_id, value_id))
+        ProductFacet.objects.bulk_create([
+            ProductFacet(product_id=product_id, product_line_id=line_id, category_id=category_id,
+                         attribute_id=attribute_id, attribute_value_id=value_id, price=price, stock_qty=stock_qty)
+            for line_id, product_id, category_id, price, stock_qty in ProductLine.objects.filter(
+                product_id__in=batch, is_active=True).values_list("id", "product_id", "product__category_id",
+                                                                 "price", "stock_qty")
+            for attribute_id, value_id in values.get(("line", line_id), []) + values.get(("product", product_id), [])
+        ], batch_size=BATCH)
+
+    ProductFacetCount.objects.bulk_create([
+        ProductFacetCount(category_id=category_id, attribute_id=attribute_id, attribute_value_id=value_id,
+                          products=products)
+        for category_id, attribute_id, value_id, products in
+        ProductFacet.objects.filter(category_id__isnull=False)
+        .values_list("category_id", "attribute_id", "attribute_value_id")
+        .annotate(Count("product_id", distinct=True)).order_by()
+    ], batch_size=BATCH)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0009_attribute_assignment_constraints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductFacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('products', models.PositiveIntegerField()),
+                ('attribute', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='product.attribute')),
+                ('attribute_value', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='product.attributevalue')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='product.category')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProductFacet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=6)),
+                ('stock_qty', models.IntegerField()),
+                ('attribute', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='product.attribute')),
+                ('attribute_value', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='product.attributevalue')),
+                ('category', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='product.category')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='product.product')),
+                ('product_line', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='product.productline')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='productfacetcount',
+            constraint=models.UniqueConstraint(fields=('category', 'attribute_value'), name='unique_product_facet_count'),
+        ),
+        migrations.AddIndex(
+            model_name='productfacet',
+            index=models.Index(fields=['category', 'attribute_value', 'product', 'price', 'stock_qty'], name='product_pro_categor_b0baf5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productfacet',
+            index=models.Index(fields=['product_line', 'attribute_value'], name='product_pro_product_7a153f_idx'),
+        ),
+        migrations.RunPython(fill_product_facets, migrations.RunPython.noop),
+    ]
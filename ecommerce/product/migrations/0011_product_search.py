@@ -0,0 +1,99 @@
+# Generated by Django 4.1.1 on 2026-10-18 09:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+BATCH = 1000
+
+# SQLite: an FTS5 index over the document table (external content, the text is not stored twice),
+# kept in sync by triggers on every insert, update and delete of a document
+SQLITE_CREATE = [
+    """CREATE VIRTUAL TABLE product_search USING fts5(
+        name, body, content='product_productsearchdocument', content_rowid='product_id',
+        tokenize='unicode61 remove_diacritics 2')""",
+    """CREATE TRIGGER product_search_insert AFTER INSERT ON product_productsearchdocument BEGIN
+        INSERT INTO product_search(rowid, name, body) VALUES (new.product_id, new.name, new.body);
+    END""",
+    """CREATE TRIGGER product_search_delete AFTER DELETE ON product_productsearchdocument BEGIN
+        INSERT INTO product_search(product_search, rowid, name, body) VALUES ('delete', old.product_id, old.name, old.body);
+    END""",
+    """CREATE TRIGGER product_search_update AFTER UPDATE ON product_productsearchdocument BEGIN
+        INSERT INTO product_search(product_search, rowid, name, body) VALUES ('delete', old.product_id, old.name, old.body);
+        INSERT INTO product_search(rowid, name, body) VALUES (new.product_id, new.name, new.body);
+    END""",
+]
+SQLITE_DROP = [
+    "DROP TRIGGER IF EXISTS product_search_insert",
+    "DROP TRIGGER IF EXISTS product_search_delete",
+    "DROP TRIGGER IF EXISTS product_search_update",
+    "DROP TABLE IF EXISTS product_search",
+]
+
+# PostgreSQL: a GIN index on the weighted tsvector, search.POSTGRESQL_VECTOR is the same expression
+POSTGRESQL_CREATE = [
+    """CREATE INDEX product_search_gin ON product_productsearchdocument USING GIN ((
+        setweight(to_tsvector('simple', name), 'A') || setweight(to_tsvector('simple', body), 'B')))""",
+]
+POSTGRESQL_DROP = ["DROP INDEX IF EXISTS product_search_gin"]
+
+
+def run(statements):
+    """The statements of the current database, other databases search with LIKE (search.py)"""
+    def operation(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return operation
+
+
+def fill_search_documents(apps, schema_editor):
+    """The documents of the existing active products, what read_models.refresh_search_documents() writes,
+    with the models of this migration. After the index, the triggers index the new rows"""
+    Product = apps.get_model("product", "Product")
+    ProductLine = apps.get_model("product", "ProductLine")
+    ProductAttributeValue = apps.get_model("product", "ProductAttributeValue")
+    ProductLineAttributeValue = apps.get_model("product", "ProductLineAttributeValue")
+    ProductSearchDocument = apps.get_model("product", "ProductSearchDocument")
+
+    ids = list(Product.objects.filter(is_active=True).order_by("id").values_list("id", flat=True))
+    for start in range(0, len(ids), BATCH):
+        batch = ids[start:start + BATCH]
+        products = list(Product.objects.filter(pk__in=batch).values_list("id", "name", "description", "pid"))
+        text = {product_id: [description, pid] for product_id, _, description, pid in products}
+        for product_id, sku in ProductLine.objects.filter(product_id__in=batch, is_active=True).values_list(
+                "product_id", "sku"):
+            text[product_id].append(sku)
+        rows = ProductAttributeValue.objects.filter(product_id__in=batch).values_list(
+            "product_id", "attribute_value__attribute_value")
+        lines = ProductLineAttributeValue.objects.filter(
+            product_line__product_id__in=batch, product_line__is_active=True).values_list(
+            "product_line__product_id", "attribute_value__attribute_value")
+        for product_id, value in list(rows) + list(lines):
+            text[product_id].append(value)
+        ProductSearchDocument.objects.bulk_create([
+            ProductSearchDocument(product_id=product_id, name=name,
+                                  body=" ".join(dict.fromkeys(filter(None, text[product_id]))))
+            for product_id, name, _, _ in products
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0010_product_facet'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchDocument',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='product.product')),
+                ('name', models.CharField(max_length=100)),
+                ('body', models.TextField(blank=True)),
+            ],
+        ),
+        migrations.RunPython(
+            run({"sqlite": SQLITE_CREATE, "postgresql": POSTGRESQL_CREATE}),
+            run({"sqlite": SQLITE_DROP, "postgresql": POSTGRESQL_DROP}),
+        ),
+        migrations.RunPython(fill_search_documents, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,9 @@
 from collections.abc import Collection, Iterable
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+from mptt.managers import TreeManager
 from mptt.models import MPTTModel, TreeForeignKey
+from .cache import categories_changed
 from .fields import OrderField
 from django.core.exceptions import ValidationError
 
@@ -16,6 +19,30 @@ class IsActiveQueryset(models.QuerySet): #models.Manager , no need for managers
         return self.filter(is_active=True)
 
 
+class ProductQueryset(IsActiveQueryset):
+    def in_category_subtree(self, category):
+        """Products of a category and all of its sub categories.
+        MPTT numbers a subtree with consecutive lft values between the node's lft and rght,
+        so this is one range predicate on (tree_id, lft) instead of a list of descendant ids"""
+        return self.filter(
+            category__tree_id=category.tree_id,
+            category__lft__range=(category.lft, category.rght),
+        )
+
+
+class CategoryTreeManager(TreeManager):
+    """mptt uses it for the tree operations (Category._tree_manager). rebuild() and partial_rebuild()
+    renumber the tree with update queries, no signals: the category caches are dropped here"""
+
+    def rebuild(self):
+        super().rebuild()
+        categories_changed()
+
+    def partial_rebuild(self, tree_id):
+        super().partial_rebuild(tree_id)
+        categories_changed()
+
+
 class Category(MPTTModel):
     """Overall, this Category model is designed to store hierarchical data, 
     Where each sub category can have a parent category, except for the top-level categories. 
@@ -25,12 +52,21 @@ class Category(MPTTModel):
     slug = models.SlugField(max_length=255, unique=True)
     parent = TreeForeignKey("self", on_delete=models.PROTECT, null=True, blank=True)
     is_active = models.BooleanField(default=False) #Add this in tests
+    updated_at = models.DateTimeField(auto_now=True, editable=False) #Last-Modified/ETag of the category list
 
     objects = IsActiveQueryset.as_manager() #This is_active filter is already on the object
+    tree = CategoryTreeManager() #Category.tree.rebuild()
 
     class MPTTMeta:
         order_insertion_by = ["name"]
 
+    class Meta:
+        indexes = [
+            # Tree order (category cursor pagination) and subtree ranges (products by category)
+            # F() because the mptt fields are only added after the Meta is processed
+            models.Index(F("tree_id"), F("lft"), F("rght"), name="product_category_subtree_idx"),
+        ]
+
     def __str__(self):
         """This is what will show in the Admin Interface, debugging e.t.c"""
         return self.name
@@ -48,14 +84,20 @@ class Product(models.Model):
     
     product_type = models.ForeignKey("ProductType", on_delete=models.PROTECT, related_name="product")
     created_at = models.DateTimeField(auto_now_add=True, editable=False) #auto_now_add adds the time and date field #editable=False it wouldnt be shown in the admin
+    updated_at = models.DateTimeField(auto_now=True, editable=False) #Also touched when a product line, image or attribute changes
     # M2M reference
     attribute_value = models.ManyToManyField(to="AttributeValue", 
                                              through="ProductAttributeValue", 
                                              related_name="product_attribute_value") #related_name already in use ?
     
-    objects = IsActiveQueryset.as_manager()  #When not overriding anything
+    objects = ProductQueryset.as_manager()  #When not overriding anything
     # objects = ActiveManager() #when using #models.Manager #When not overriding anything 
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["created_at", "id"]), #Used by the product cursor pagination
+        ]
+
     def __str__(self):
         return self.name
     
@@ -80,6 +122,44 @@ class AttributeValue(models.Model):
         return self.attribute.name + '-' + self.attribute_value #For the Admin interface
     
 
+class AttributeAssignmentQueryset(models.QuerySet):
+    """Queries of the assignments of attribute values to products / product lines (the m2m through models)"""
+
+    def bulk_create(self, objs, *args, **kwargs):
+        """Fills in the attribute copy of the rows without one (.add() builds the rows without it),
+        one query for the whole batch"""
+        objs = list(objs)
+        missing = {obj.attribute_value_id for obj in objs if obj.attribute_id is None}
+        if missing:
+            attributes = dict(AttributeValue.objects.filter(pk__in=missing).values_list("id", "attribute_id"))
+            for obj in objs:
+                if obj.attribute_id is None:
+                    obj.attribute_id = attributes.get(obj.attribute_value_id)
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def plan(self, parent_field, parent_id, value_ids):
+        """Checks a set of attribute values for one parent with one query: each value with its attribute and
+        the value the parent already has for that attribute.
+        Returns ({value id: attribute id} of the new assignments, error messages)"""
+        current = self.filter(**{parent_field: parent_id, "attribute_id": models.OuterRef("attribute_id")})
+        rows = (AttributeValue.objects.filter(pk__in=value_ids)
+                .annotate(current=models.Subquery(current.values("attribute_value_id")[:1]))
+                .values_list("id", "attribute_id", "current"))
+        errors, seen, new = [], {}, {}
+        found = set()
+        for pk, attribute_id, current_value in rows:
+            found.add(pk)
+            if attribute_id in seen:
+                errors.append(f"Attribute values {seen[attribute_id]} and {pk} are for the same attribute.")
+            elif current_value is not None and current_value != pk:
+                errors.append(f"Attribute value {pk}: the attribute already has value {current_value}.")
+            elif current_value is None:
+                new[pk] = attribute_id
+            seen[attribute_id] = pk
+        errors += [f"Attribute value {pk} doesn't exist." for pk in sorted(set(value_ids) - found)]
+        return new, errors
+
+
 class ProductAttributeValue(models.Model):
     """This is the intermediate table that resolves 
     the 1 'many-to-many' relationship into two(2) 'one-to-many' relationships ,
@@ -90,25 +170,43 @@ class ProductAttributeValue(models.Model):
     product = models.ForeignKey(
         "Product", on_delete=models.CASCADE, related_name="product_attribute_value_pl"
     )
+    # Copy of attribute_value.attribute, so "one value per attribute" is a database constraint.
+    # Set in clean() and by AttributeAssignmentQueryset.bulk_create() (.add(), bulk inserts)
+    attribute = models.ForeignKey(Attribute, on_delete=models.CASCADE, editable=False, related_name="+")
+
+    objects = AttributeAssignmentQueryset.as_manager()
 
     class Meta:
         """The two values should be unique together"""
         unique_together = ("attribute_value", "product")
+        constraints = [
+            models.UniqueConstraint(fields=["product", "attribute"], name="unique_product_attribute"),
+        ]
+
+    def attribute_taken(self):
+        return ProductAttributeValue.objects.filter(
+            product_id=self.product_id, attribute_id=self.attribute_id).exclude(pk=self.pk).exists()
 
     def clean(self):
-        """Validation Check: Ensure that each attribute type is unique per product line."""
-        if ProductAttributeValue.objects.filter(
-            product=self.product,
-            attribute_value__attribute=self.attribute_value.attribute
-        ).exclude(id=self.id).exists(): 
-            #exclude , excludes the current instance of ProductLineAttributeValue (intermediate table), 
-            # so the current instance isn't flaggged as a duplicate
+        """Validation Check: Ensure that each attribute type is unique per product line.
+        One indexed lookup on (product, attribute), no join and no attribute lazy load"""
+        if self.attribute_value_id is None:
+            return #reported by clean_fields()
+        self.attribute_id = self.attribute_value.attribute_id
+        if self.attribute_taken():
             raise ValidationError(f"Duplicate attribute type for {self.product}.")
 
     def save(self, *args, **kwargs):
-        """To ensure the clean method is called."""
-        self.full_clean()
-        super(ProductAttributeValue, self).save(*args, **kwargs)
+        """To ensure the clean method is called.
+        A concurrent assignment of the same attribute ends at the constraint, reported like clean() does"""
+        self.full_clean(validate_constraints=False)
+        try:
+            with transaction.atomic():
+                super(ProductAttributeValue, self).save(*args, **kwargs)
+        except IntegrityError:
+            if self.attribute_taken():
+                raise ValidationError(f"Duplicate attribute type for {self.product}.")
+            raise
 
 
 class ProductLineAttributeValue(models.Model):
@@ -121,25 +219,39 @@ class ProductLineAttributeValue(models.Model):
     product_line = models.ForeignKey(
         "ProductLine", on_delete=models.CASCADE, related_name="product_line_attribute_value_pl"
     )
+    attribute = models.ForeignKey(Attribute, on_delete=models.CASCADE, editable=False, related_name="+")
+
+    objects = AttributeAssignmentQueryset.as_manager()
 
     class Meta:
         """The two values should be unique together"""
         unique_together = ("attribute_value", "product_line")
+        constraints = [
+            models.UniqueConstraint(fields=["product_line", "attribute"], name="unique_product_line_attribute"),
+        ]
+
+    def attribute_taken(self):
+        return ProductLineAttributeValue.objects.filter(
+            product_line_id=self.product_line_id, attribute_id=self.attribute_id).exclude(pk=self.pk).exists()
 
     def clean(self):
         """Validation Check: Ensure that each attribute type is unique per product line."""
-        if ProductLineAttributeValue.objects.filter(
-            product_line=self.product_line,
-            attribute_value__attribute=self.attribute_value.attribute
-        ).exclude(id=self.id).exists(): 
-            #exclude , excludes the current instance of ProductLineAttributeValue (intermediate table), 
-            # so the current instance isn't flaggged as a duplicate
+        if self.attribute_value_id is None:
+            return
+        self.attribute_id = self.attribute_value.attribute_id
+        if self.attribute_taken():
             raise ValidationError(f"Duplicate attribute type for {self.product_line}.")
 
     def save(self, *args, **kwargs):
         """To ensure the clean method is called."""
-        self.full_clean()
-        super(ProductLineAttributeValue, self).save(*args, **kwargs)
+        self.full_clean(validate_constraints=False)
+        try:
+            with transaction.atomic():
+                super(ProductLineAttributeValue, self).save(*args, **kwargs)
+        except IntegrityError:
+            if self.attribute_taken():
+                raise ValidationError(f"Duplicate attribute type for {self.product_line}.")
+            raise
 
 
 class ProductLine(models.Model):
@@ -150,7 +262,7 @@ class ProductLine(models.Model):
         Product, on_delete=models.PROTECT, related_name="product_line" #used for reverse relationships in serializers.py
         )
     is_active = models.BooleanField(default=False)
-    order = OrderField(unique_for_field="product" , blank=True)
+    order = OrderField(unique_for_field="product", counter="product.OrderCounter", blank=True)
     weight = models.FloatField()
 
     attribute_value = models.ManyToManyField(to=AttributeValue, 
@@ -158,22 +270,42 @@ class ProductLine(models.Model):
                                              related_name="product_line_attribute_value") 
     #attribute_value is just a reference, and not an actual value stored in the database
     created_at = models.DateField(auto_now_add=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True, editable=False) #Also touched when an image or attribute changes
     product_type = models.ForeignKey("ProductType", on_delete=models.PROTECT, related_name="product_line_type")
 
     objects = IsActiveQueryset.as_manager() #There is at least one Model manager for each model, default is objects, we have customized the default
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["sku"]), #Supplier feeds and the import match product lines by sku
+        ]
+        constraints = [
+            # The database enforces it, clean() only turns it into a friendly error beforehand
+            models.UniqueConstraint(fields=["product", "order"], name="unique_product_line_order"),
+        ]
+
+    def order_taken(self):
+        """One indexed lookup on (product, order), whatever the number of product lines"""
+        return self.order is not None and ProductLine.objects.filter(
+            product_id=self.product_id, order=self.order).exclude(pk=self.pk).exists()
+
     def clean(self):
         """This filters for duplicate order number. #order"""
-        # super().clean_fields(exclude=exclude)
-        qs = ProductLine.objects.filter(product=self.product)
-        for obj in qs:
-            if self.id != obj.id and self.order == obj.order:
-                raise ValidationError("Duplicate value.")
+        if self.order_taken():
+            raise ValidationError("Duplicate value.")
             
     def save(self, *arg, **kwargs):
-        """To make sure the clean() method above is always called. #order"""
-        self.full_clean()
-        return super(ProductLine, self).save(*arg, **kwargs)
+        """To make sure the clean() method above is always called. #order
+        validate_constraints=False, clean() already checked the order constraint. A concurrent save
+        can still take the order in between, the IntegrityError is then reported like clean() does"""
+        self.full_clean(validate_constraints=False)
+        try:
+            with transaction.atomic(): #savepoint, the outer transaction stays usable
+                return super(ProductLine, self).save(*arg, **kwargs)
+        except IntegrityError:
+            if self.order_taken():
+                raise ValidationError("Duplicate value.")
+            raise
 
     def __str__(self):
         return str(self.sku)
@@ -185,19 +317,33 @@ class ProductImage(models.Model):
     product_line = models.ForeignKey(
         ProductLine, on_delete=models.CASCADE, related_name="product_image" #used for reverse relationships in serializers.py
         )
-    order = OrderField(unique_for_field="product_line" , blank=True)
+    order = OrderField(unique_for_field="product_line", counter="product.OrderCounter", blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["product_line", "order"], name="unique_product_image_order"),
+        ]
+
+    def order_taken(self):
+        return self.order is not None and ProductImage.objects.filter(
+            product_line_id=self.product_line_id, order=self.order).exclude(pk=self.pk).exists()
 
     def clean(self):
         """This filters for duplicate order number. #order"""
-        qs = ProductImage.objects.filter(product_line=self.product_line)
-        for obj in qs:
-            if self.id != obj.id and self.order == obj.order:
-                raise ValidationError("Duplicate value.")
+        if self.order_taken():
+            raise ValidationError("Duplicate value.")
             
     def save(self, *arg, **kwargs):
-        """To make sure the clean() method above is always called. #order"""
-        self.full_clean()
-        return super(ProductImage, self).save(*arg, **kwargs)
+        """To make sure the clean() method above is always called. #order
+        Same as ProductLine.save()"""
+        self.full_clean(validate_constraints=False)
+        try:
+            with transaction.atomic():
+                return super(ProductImage, self).save(*arg, **kwargs)
+        except IntegrityError:
+            if self.order_taken():
+                raise ValidationError("Duplicate value.")
+            raise
 
     def __str__(self):
         return f"{self.product_line.sku}_img" #using the foreign key to traverse to the ProductLine table to access the sku 
@@ -230,4 +376,110 @@ class ProductTypeAttribute(models.Model):
         unique_together = ("product_type", "attribute")
 
 
+class OrderCounter(models.Model):
+    """Last order value handed out by OrderField for one parent (a product's lines, a product line's images)"""
+    scope = models.CharField(max_length=100) #"product.productline"
+    parent_id = models.PositiveBigIntegerField()
+    value = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["scope", "parent_id"], name="unique_order_counter"),
+        ]
+
+    def __str__(self):
+        return f"{self.scope}:{self.parent_id}={self.value}"
+
+
+class ProductCard(models.Model):
+    """Denormalized read model for the products by category listing, one row per product.
+    Holds the first active product line's price and its primary image, so the listing is a scan
+    of this table without any prefetching. Kept up to date by read_models.refresh_product_cards()
+    from the Product, ProductLine, ProductImage and Category signals"""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name="card")
+    name = models.CharField(max_length=100)
+    slug = models.SlugField(max_length=255)
+    pid = models.CharField(max_length=10)
+    is_active = models.BooleanField(default=False)
+    created_at = models.DateTimeField() #copied from the product, used for ordering
+    category = TreeForeignKey("Category", on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    category_path = models.CharField(max_length=1000, blank=True) #"electronics/tvs/oled", slugs from the root
+    price = models.DecimalField(decimal_places=2, max_digits=6, null=True, blank=True) #null when there is no active line
+    image = models.ImageField(upload_to=None, blank=True)
+    image_alternative_text = models.CharField(max_length=100, blank=True)
+    image_order = models.PositiveIntegerField(null=True, blank=True)
+
+    objects = ProductQueryset.as_manager() #is_active() and in_category_subtree() work on the copied columns
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["created_at", "product"]), #Used by the cursor pagination
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+
+class ProductFacet(models.Model):
+    """Denormalized read model for the faceted category search, one row per active product line
+    (of an active product) and attribute value shown on it: the line's own values and its product's.
+    Price, stock and category are copied from the line and the product, so the facet counts are
+    grouped aggregates over this table alone. A line without attribute values has no row.
+    Kept up to date by read_models.refresh_product_facets() together with the product cards"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    product_line = models.ForeignKey(ProductLine, on_delete=models.CASCADE, related_name="+")
+    category = models.ForeignKey("Category", on_delete=models.CASCADE, null=True, related_name="+")
+    attribute = models.ForeignKey(Attribute, on_delete=models.CASCADE, related_name="+")
+    attribute_value = models.ForeignKey(AttributeValue, on_delete=models.CASCADE, related_name="+")
+    price = models.DecimalField(decimal_places=2, max_digits=6)
+    stock_qty = models.IntegerField()
+
+    class Meta:
+        indexes = [
+            # Counts per value over a category subtree, read from the index alone
+            models.Index(fields=["category", "attribute_value", "product", "price", "stock_qty"]),
+            # "this line has one of the selected values" (attribute filters)
+            models.Index(fields=["product_line", "attribute_value"]),
+        ]
+
+    def __str__(self):
+        return f"{self.product_line_id}:{self.attribute_value_id}"
+
+
+
+class ProductFacetCount(models.Model):
+    """Number of products of one category (its sub categories not included) showing an attribute value.
+    Every product has a single category, so the counts of a subtree without filters are a SUM over
+    its categories, a few hundred rows instead of every ProductFacet row of the subtree.
+    Moved by the difference between the old and new facet rows of the written products
+    (read_models.apply_facet_count_deltas()), recounted by read_models.refresh_facet_counts() on a rebuild"""
+    category = models.ForeignKey("Category", on_delete=models.CASCADE, related_name="+")
+    attribute = models.ForeignKey(Attribute, on_delete=models.CASCADE, related_name="+")
+    attribute_value = models.ForeignKey(AttributeValue, on_delete=models.CASCADE, related_name="+")
+    products = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["category", "attribute_value"], name="unique_product_facet_count"),
+        ]
+
+    def __str__(self):
+        return f"{self.category_id}:{self.attribute_value_id}={self.products}"
+
+
+
+class ProductSearchDocument(models.Model):
+    """The searchable text of an active product, one row per product: name, and in body the description,
+    pid, the product line skus and the attribute values. The full-text index is built on this table,
+    an FTS5 table kept in sync by triggers on SQLite, a GIN index on its tsvector on PostgreSQL (see search.py).
+    Kept up to date by read_models.refresh_search_documents() together with the product cards"""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name="search_document")
+    name = models.CharField(max_length=100)
+    body = models.TextField(blank=True)
+
+    def __str__(self):
+        return self.name
+
+
 # slug = asus-tuf-gaming-vg249
\ No newline at end of file
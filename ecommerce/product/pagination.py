@@ -0,0 +1,160 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Cursor (keyset) pagination on indexed columns.
+    The cursor holds the ordering values of the last row of a page, the next page is
+    'WHERE (key) > (cursor) ORDER BY key LIMIT n', so deep pages cost the same as page 1
+    and rows inserted while paging don't shift the pages like OFFSET does.
+    ordering must end with a unique column (e.g. "id") to make the order stable"""
+
+    ordering = ("id",)
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    invalid_cursor_message = "Invalid cursor"
+
+    def __init__(self):
+        self.page_size = getattr(settings, "PAGE_SIZE", 20)
+        self.max_page_size = getattr(settings, "MAX_PAGE_SIZE", 100)
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size) #configurable cap
+
+    def page_queryset(self, queryset, request):
+        """The rows of the requested page, plus one extra row that tells us if there is a next page"""
+        self.request = request
+        self.limit = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+
+        position = self.decode_cursor(request, queryset.model)
+        if position is not None:
+            queryset = queryset.filter(self.after(position))
+        return queryset[:self.limit + 1]
+
+    def get_page(self, rows):
+        self.has_next = len(rows) > self.limit
+        rows = rows[:self.limit]
+        self.next_position = self.get_position(rows[-1]) if self.has_next else None
+        return rows
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.get_page(list(self.page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request):
+        """paginate_queryset() for the async views, the page is read with the async ORM"""
+        return self.get_page([row async for row in self.page_queryset(queryset, request)])
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    @property
+    def fields(self):
+        return [name.lstrip("-") for name in self.ordering]
+
+    def get_position(self, instance):
+        if isinstance(instance, dict): #.values() rows
+            return [instance[name] for name in self.fields]
+        return [getattr(instance, name) for name in self.fields]
+
+    def after(self, position):
+        """Lexicographic '(a, b) > (x, y)' as (a > x) OR (a = x AND b > y), '-' fields use '<'"""
+        condition = Q()
+        equal = Q()
+        for name, value in zip(self.ordering, position):
+            field = name.lstrip("-")
+            lookup = "lt" if name.startswith("-") else "gt"
+            condition |= equal & Q(**{f"{field}__{lookup}": value})
+            equal &= Q(**{field: value})
+        return condition
+
+    def encode_cursor(self, position):
+        values = [value.isoformat() if hasattr(value, "isoformat") else value for value in position]
+        return urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def get_model_field(self, model, name):
+        return model._meta.pk if name == "pk" else model._meta.get_field(name)
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            values = json.loads(urlsafe_b64decode(encoded.encode()))
+            if not isinstance(values, list) or len(values) != len(self.fields):
+                raise ValueError
+            return [self.get_model_field(model, name).to_python(value) for name, value in zip(self.fields, values)]
+        except (BinasciiError, ValueError, TypeError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+
+class ProductCursorPagination(KeysetPagination):
+    """Newest products first"""
+    ordering = ("-created_at", "-id")
+
+
+class CategoryCursorPagination(KeysetPagination):
+    """Categories in tree order"""
+    ordering = ("tree_id", "lft")
+
+
+class ProductCardCursorPagination(KeysetPagination):
+    """Newest product cards first, the card's primary key is the product id"""
+    ordering = ("-created_at", "-pk")
+
+
+class SearchPagination(KeysetPagination):
+    """Page numbers for ranked search results, the rank is computed per query so there is no column
+    to seek on. Relevance falls quickly, max_page caps the OFFSET"""
+
+    page_query_param = "page"
+    max_page = 50
+
+    def paginate_search(self, search, request):
+        """search(limit, offset) returns the ranked ids"""
+        self.request = request
+        try:
+            self.page = int(request.query_params.get(self.page_query_param, 1))
+        except ValueError:
+            raise NotFound("Invalid page")
+        if not 1 <= self.page <= self.max_page:
+            raise NotFound("Invalid page")
+        page_size = self.get_page_size(request)
+        ids = search(page_size + 1, (self.page - 1) * page_size)
+        self.has_next = len(ids) > page_size and self.page < self.max_page
+        return ids[:page_size]
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.page_query_param, self.page + 1)
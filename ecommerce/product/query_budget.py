@@ -0,0 +1,195 @@
+"""Query budgets: the queries a request runs are recorded (count, SQL time, repeated statements) and checked
+against a budget per url name, to catch N+1 regressions before production does.
+- QueryRecorder: a context manager recording the queries run in its context. Every connection gets one
+  execute wrapper (record_query) that hands the query to the recorder of the current context, the context
+  follows sync_to_async, so the ORM calls of an async view are recorded whatever thread runs them
+- QueryBudgetMiddleware: records each request, checks it against QUERY_BUDGETS (or QUERY_BUDGET_DEFAULT)
+  and adds X-Query-Count/X-Query-Time headers. QUERY_BUDGET_MODE: None (off), "warn" (logged) or "raise".
+  Sync and async, an async view under ASGI stays async
+- query_budget(): a decorator giving one view its own budget, checked even without the middleware
+A budget is a dict: "queries" (most queries), "repeats" (most runs of the same statement with other
+parameters, an N+1 pattern) and "time" (most SQL time in ms), a missing key isn't checked.
+The tests check the budgets of every endpoint with the query_budget fixture (tests/conftest.py)"""
+import asyncio
+import logging
+import re
+from collections import Counter
+from contextvars import ContextVar
+from functools import wraps
+from time import perf_counter
+
+from asgiref.sync import markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+IN_LIST = re.compile(r"IN \((?:%s, )*%s\)")
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def fingerprint(sql):
+    """The statement without its parameters, IN lists of any length are the same statement"""
+    return IN_LIST.sub("IN (...)", sql)
+
+
+_recorder = ContextVar("query_recorder", default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    """Execute wrapper of every connection, a no-op outside of a QueryRecorder"""
+    recorder = _recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    start = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        recorder.add(sql, (perf_counter() - start) * 1000)
+
+
+def install_record_query(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+connection_created.connect(install_record_query) #every connection opened from now on, in any thread
+
+
+class QueryRecorder:
+    """with QueryRecorder() as recorder: ... then recorder.count, recorder.time (ms), recorder.repeats().
+    A recorder opened inside another one (a decorated view under the middleware) reports to both"""
+
+    def __init__(self):
+        self.queries = [] # (sql, ms)
+        self.parent = None
+
+    def __enter__(self):
+        for connection in connections.all(): #the connections this thread opened before the signal was connected
+            install_record_query(connection)
+        self.parent = _recorder.get()
+        self._token = _recorder.set(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _recorder.reset(self._token)
+
+    def add(self, sql, duration):
+        recorder = self
+        while recorder is not None:
+            recorder.queries.append((sql, duration))
+            recorder = recorder.parent
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def time(self):
+        return sum(duration for _, duration in self.queries)
+
+    def repeats(self):
+        """{fingerprint: runs} of the statements run more than once, most repeated first"""
+        counts = Counter(fingerprint(sql) for sql, _ in self.queries)
+        return {sql: runs for sql, runs in counts.most_common() if runs > 1}
+
+    def over_budget(self, budget):
+        """The budget keys exceeded, as messages"""
+        errors = []
+        if budget.get("queries") is not None and self.count > budget["queries"]:
+            errors.append(f"{self.count} queries, budget {budget['queries']}")
+        repeats = self.repeats()
+        if budget.get("repeats") is not None and repeats and max(repeats.values()) > budget["repeats"]:
+            sql, runs = next(iter(repeats.items()))
+            errors.append(f"{runs} runs of the same statement, budget {budget['repeats']}: {sql[:200]}")
+        if budget.get("time") is not None and self.time > budget["time"]:
+            errors.append(f"{self.time:.1f}ms of SQL, budget {budget['time']}ms")
+        return errors
+
+
+def get_budget(name):
+    """The budget of a url name, QUERY_BUDGET_DEFAULT for the names without one"""
+    return {**settings.QUERY_BUDGET_DEFAULT, **settings.QUERY_BUDGETS.get(name, {})}
+
+
+def check_budget(recorder, budget, label, mode):
+    errors = recorder.over_budget(budget)
+    if not errors:
+        return
+    message = f"{label} is over its query budget: " + "; ".join(errors)
+    if mode == "raise":
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+
+class QueryBudgetMiddleware:
+    """Checks every request against the budget of its url name, see the module docstring"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self) #the handler awaits this middleware instead of running it in a thread
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        mode = settings.QUERY_BUDGET_MODE
+        if mode is None:
+            return self.get_response(request)
+        with QueryRecorder() as recorder:
+            response = self.get_response(request) #a streamed body runs its queries later, they aren't counted
+        return self.check(request, response, recorder, mode)
+
+    async def __acall__(self, request):
+        mode = settings.QUERY_BUDGET_MODE
+        if mode is None:
+            return await self.get_response(request)
+        with QueryRecorder() as recorder:
+            response = await self.get_response(request)
+        return self.check(request, response, recorder, mode)
+
+    def check(self, request, response, recorder, mode):
+        response["X-Query-Count"] = recorder.count
+        response["X-Query-Time"] = f"{recorder.time:.1f}"
+        match = request.resolver_match
+        if match is not None and not getattr(request, "_query_budget_checked", False):
+            check_budget(recorder, get_budget(match.view_name), f"{request.method} {request.path}", mode)
+        return response
+
+
+def query_budget(queries=None, repeats=None, time=None):
+    """Budget of one view (a function, an async function or a viewset method), checked whatever
+    QUERY_BUDGET_MODE is (a log when it is off), the middleware leaves the request alone.
+    The budget is kept on the view as .query_budget for the tests"""
+    budget = {"queries": queries, "repeats": repeats, "time": time}
+
+    def checked(view, args, recorder):
+        request = next(arg for arg in args if hasattr(arg, "method")) #(request, ...) or (self, request, ...)
+        getattr(request, "_request", request)._query_budget_checked = True #the HttpRequest under DRF's Request
+        check_budget(recorder, budget, view.__qualname__, settings.QUERY_BUDGET_MODE or "warn")
+
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+            @wraps(view)
+            async def inner(*args, **kwargs):
+                with QueryRecorder() as recorder:
+                    response = await view(*args, **kwargs)
+                checked(view, args, recorder)
+                return response
+        else:
+            @wraps(view)
+            def inner(*args, **kwargs):
+                with QueryRecorder() as recorder:
+                    response = view(*args, **kwargs)
+                checked(view, args, recorder)
+                return response
+        inner.query_budget = budget
+        return inner
+    return decorator
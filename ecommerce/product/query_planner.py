@@ -0,0 +1,74 @@
+from django.db.models import Prefetch
+from rest_framework import serializers
+
+
+class QueryPlan:
+    """The select_related/Prefetch set a serializer tree needs for one model.
+    Forward ForeignKeys are joined (select_related), reverse and many-to-many
+    relations are prefetched, each with its own nested QueryPlan"""
+
+    def __init__(self, model):
+        self.model = model
+        self.select_related = []
+        self.prefetches = [] # list of (lookup, QueryPlan)
+
+    def apply(self, queryset, querysets=None, prefix=""):
+        """Adds the plan to a queryset.
+        querysets maps a lookup path ("product_line", "product_line__product_image")
+        to a base queryset, to keep custom ordering or filtering for that relation"""
+        querysets = querysets or {}
+        if self.select_related:
+            queryset = queryset.select_related(*self.select_related)
+        for lookup, plan in self.prefetches:
+            path = f"{prefix}{lookup}"
+            inner = querysets.get(path, plan.model._default_manager.order_by("pk")) #deterministic order of the nested lists
+            inner = plan.apply(inner, querysets, prefix=f"{path}__")
+            queryset = queryset.prefetch_related(Prefetch(lookup, queryset=inner))
+        return queryset
+
+
+def _nested_serializer(field):
+    if isinstance(field, serializers.ListSerializer):
+        return field.child, True
+    if isinstance(field, serializers.BaseSerializer):
+        return field, False
+    return None, False
+
+
+def build_plan(serializer, model=None):
+    """Walks serializer.fields and derives the QueryPlan for it.
+    Works on a serializer instance, so pruned field sets give a smaller plan"""
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+    model = model or serializer.Meta.model
+    plan = QueryPlan(model)
+    _walk(serializer, model, plan, prefix="")
+    return plan
+
+
+def _walk(serializer, model, plan, prefix):
+    for field in serializer.fields.values():
+        nested, many = _nested_serializer(field)
+        if nested is None or field.source == "*":
+            continue
+        source = "__".join(field.source_attrs)
+        related = model._meta.get_field(field.source_attrs[0]).related_model
+        is_forward_fk = not many and len(field.source_attrs) == 1 and not _is_multiple(model, field.source_attrs[0])
+        if is_forward_fk:
+            # Joined into the same query, nested relations are planned on the same level
+            plan.select_related.append(f"{prefix}{source}")
+            _walk(nested, related, plan, prefix=f"{prefix}{source}__")
+        else:
+            plan.prefetches.append((f"{prefix}{source}", build_plan(nested, related)))
+
+
+def _is_multiple(model, name):
+    model_field = model._meta.get_field(name)
+    return model_field.many_to_many or model_field.one_to_many
+
+
+def optimize_queryset(queryset, serializer, querysets=None):
+    """Shortcut: build the plan for a serializer (class or instance) and apply it"""
+    if isinstance(serializer, type):
+        serializer = serializer()
+    return build_plan(serializer).apply(queryset, querysets)
@@ -0,0 +1,239 @@
+from collections import Counter
+
+from django.db.models import Case, Count, Exists, F, OuterRef, Q, Value, When
+
+from .models import (Category, Product, ProductAttributeValue, ProductCard, ProductFacet, ProductFacetCount,
+                     ProductImage, ProductLine, ProductLineAttributeValue, ProductSearchDocument)
+
+# Column names (category_id, product_id), Django 4.1 puts upsert field names into the SQL as they are
+CARD_FIELDS = ["name", "slug", "pid", "is_active", "created_at", "category_id", "category_path",
+               "price", "image", "image_alternative_text", "image_order"]
+
+FACET_COUNT_BATCH = 150 #values per UPDATE, 6 parameters each, under SQLite's 999 variables
+
+
+def category_paths(category_ids):
+    """{category id: "root-slug/child-slug/..."}, one query per tree level instead of one per category"""
+    nodes = {} # id: (parent_id, slug)
+    missing = set(category_ids) - {None}
+    while missing:
+        rows = Category.objects.filter(pk__in=missing).values_list("id", "parent_id", "slug")
+        for pk, parent_id, slug in rows:
+            nodes[pk] = (parent_id, slug)
+        missing = {parent_id for parent_id, _ in nodes.values() if parent_id is not None} - set(nodes)
+
+    paths = {}
+    for pk in set(category_ids) - {None}:
+        slugs = []
+        node = pk
+        while node is not None and node in nodes:
+            parent_id, slug = nodes[node]
+            slugs.append(slug)
+            node = parent_id
+        paths[pk] = "/".join(reversed(slugs))
+    return paths
+
+
+def refresh_product_cards(product_ids):
+    """Recomputes the ProductCard rows of these products in a fixed number of queries
+    and writes them with one upsert. Cards of deleted products go away with the cascade"""
+    product_ids = {pk for pk in product_ids if pk is not None}
+    if not product_ids:
+        return
+
+    products = list(Product.objects.filter(pk__in=product_ids).values(
+        "id", "name", "slug", "pid", "is_active", "created_at", "category_id"))
+
+    first_lines = {} # product id: (line id, price)
+    lines = (ProductLine.objects.filter(product_id__in=product_ids, is_active=True)
+             .order_by("product_id", "order", "id").values_list("product_id", "id", "price"))
+    for product_id, line_id, price in lines:
+        first_lines.setdefault(product_id, (line_id, price))
+
+    images = {} # line id: (url, alternative_text, order)
+    rows = (ProductImage.objects.filter(product_line_id__in=[line for line, _ in first_lines.values()])
+            .order_by("product_line_id", "order", "id").values_list("product_line_id", "url", "alternative_text", "order"))
+    for line_id, url, alternative_text, order in rows:
+        images.setdefault(line_id, (url, alternative_text, order))
+
+    paths = category_paths({product["category_id"] for product in products})
+
+    cards = []
+    for product in products:
+        line_id, price = first_lines.get(product["id"], (None, None))
+        url, alternative_text, order = images.get(line_id, ("", "", None))
+        cards.append(ProductCard(
+            product_id=product["id"], name=product["name"], slug=product["slug"], pid=product["pid"],
+            is_active=product["is_active"], created_at=product["created_at"],
+            category_id=product["category_id"], category_path=paths.get(product["category_id"], ""),
+            price=price, image=url, image_alternative_text=alternative_text, image_order=order,
+        ))
+    ProductCard.objects.bulk_create(cards, update_conflicts=True, unique_fields=["product_id"], update_fields=CARD_FIELDS)
+
+
+def refresh_product_facets(product_ids, counts=True, product_line_ids=None):
+    """Rewrites the ProductFacet rows of these products in a fixed number of queries
+    (one delete, five reads and one bulk insert), then moves the ProductFacetCount rows by the difference
+    between their old and new rows (apply_facet_count_deltas()). counts=False leaves the counts alone,
+    rebuild_product_cards() recounts everything once.
+    product_line_ids (lines of these products): only the rows of these lines are rewritten, a line write
+    costs the same whatever the number of the product's other lines"""
+    product_ids = {pk for pk in product_ids if pk is not None}
+    previous = ProductFacet.objects.filter(product_id__in=product_ids)
+    lines = ProductLine.objects.filter(product_id__in=product_ids, is_active=True, product__is_active=True)
+    line_values = ProductLineAttributeValue.objects.filter(product_line__product_id__in=product_ids)
+    if product_line_ids is not None:
+        product_line_ids = set(product_line_ids)
+        previous = previous.filter(product_line_id__in=product_line_ids)
+        lines = lines.filter(pk__in=product_line_ids)
+        line_values = line_values.filter(product_line_id__in=product_line_ids)
+    if not product_ids or product_line_ids == set():
+        return
+    old = _delete_facets(previous)
+
+    values = {} # ("line" or "product", id): [(attribute id, value id)]
+    rows = line_values.values_list("product_line_id", "attribute_value__attribute_id", "attribute_value_id")
+    for line_id, attribute_id, value_id in rows:
+        values.setdefault(("line", line_id), []).append((attribute_id, value_id))
+    rows = (ProductAttributeValue.objects.filter(product_id__in=product_ids)
+            .values_list("product_id", "attribute_value__attribute_id", "attribute_value_id"))
+    for product_id, attribute_id, value_id in rows:
+        values.setdefault(("product", product_id), []).append((attribute_id, value_id))
+
+    facets = [
+        ProductFacet(product_id=product_id, product_line_id=line_id, category_id=category_id,
+                     attribute_id=attribute_id, attribute_value_id=value_id, price=price, stock_qty=stock_qty)
+        for line_id, product_id, category_id, price, stock_qty in
+        lines.values_list("id", "product_id", "product__category_id", "price", "stock_qty")
+        for attribute_id, value_id in values.get(("line", line_id), []) + values.get(("product", product_id), [])
+    ]
+    ProductFacet.objects.bulk_create(facets, batch_size=1000)
+    if counts:
+        new = {(facet.product_id, facet.category_id, facet.attribute_id, facet.attribute_value_id) for facet in facets}
+        apply_facet_count_deltas(_facet_deltas(old, new, product_line_ids))
+
+
+def _delete_facets(rows):
+    """Deletes these ProductFacet rows, returns their {(product id, category id, attribute id, value id)}"""
+    keys = set(rows.values_list("product_id", "category_id", "attribute_id", "attribute_value_id").distinct())
+    rows.delete()
+    return keys
+
+
+def _facet_deltas(old, new, product_line_ids=None):
+    """The counts to move: a product is taken off (or added to) a value when none of its rows
+    showed it after (or before) the write. When only the rows of product_line_ids were rewritten,
+    the rows of the product's other lines still show their values, one read of these values"""
+    kept = set()
+    if product_line_ids is not None and old | new:
+        kept = set(ProductFacet.objects.filter(
+            product_id__in={key[0] for key in old | new}, category_id__in={key[1] for key in old | new},
+            attribute_value_id__in={key[3] for key in old | new},
+        ).exclude(product_line_id__in=product_line_ids).values_list(
+            "product_id", "category_id", "attribute_id", "attribute_value_id").distinct())
+    deltas = Counter()
+    for _, category_id, attribute_id, value_id in old - new - kept:
+        deltas[(category_id, attribute_id, value_id)] -= 1
+    for _, category_id, attribute_id, value_id in new - old - kept:
+        deltas[(category_id, attribute_id, value_id)] += 1
+    return deltas
+
+
+def remove_product_facets(product_ids):
+    """Deletes the facet rows of products about to be deleted and takes them off the counts,
+    the delete cascades over the rows before the post_delete refresh could read them"""
+    old = _delete_facets(ProductFacet.objects.filter(product_id__in={pk for pk in product_ids if pk is not None}))
+    apply_facet_count_deltas(_facet_deltas(old, set()))
+
+
+def remove_product_line_facets(product_line_ids):
+    """The same for product lines about to be deleted, the product's other lines are left alone"""
+    product_line_ids = set(product_line_ids)
+    old = _delete_facets(ProductFacet.objects.filter(product_line_id__in=product_line_ids))
+    apply_facet_count_deltas(_facet_deltas(old, set(), product_line_ids))
+
+
+def apply_facet_count_deltas(deltas):
+    """deltas: {(category id, attribute id, value id): change in the number of products}.
+    The missing rows are inserted at 0, then one UPDATE ... products + CASE ... END per chunk of values
+    and one delete of the rows back to 0, a few queries whatever the size of the categories.
+    Concurrent writes of other products add up, an UPDATE is atomic per row"""
+    deltas = {key: delta for key, delta in deltas.items() if delta and key[0] is not None}
+    if not deltas:
+        return
+    ProductFacetCount.objects.bulk_create([
+        ProductFacetCount(category_id=category_id, attribute_id=attribute_id, attribute_value_id=value_id, products=0)
+        for (category_id, attribute_id, value_id), delta in deltas.items() if delta > 0
+    ], batch_size=1000, ignore_conflicts=True)
+    keys = list(deltas)
+    for start in range(0, len(keys), FACET_COUNT_BATCH):
+        batch = keys[start:start + FACET_COUNT_BATCH]
+        rows = Q()
+        for category_id, _, value_id in batch:
+            rows |= Q(category_id=category_id, attribute_value_id=value_id)
+        ProductFacetCount.objects.filter(rows).update(products=F("products") + Case(*[
+            When(category_id=category_id, attribute_value_id=value_id, then=Value(deltas[(category_id, attribute_id, value_id)]))
+            for category_id, attribute_id, value_id in batch
+        ], default=Value(0)))
+    ProductFacetCount.objects.filter(category_id__in={key[0] for key in keys}, products=0).delete()
+
+
+def refresh_facet_counts(category_ids):
+    """Recounts the ProductFacetCount rows of these categories from their ProductFacet rows,
+    one grouped query over the categories' own rows (not their subtrees), one upsert and one delete.
+    For the rebuild and to repair the counts, the writes apply deltas (apply_facet_count_deltas())"""
+    category_ids = {pk for pk in category_ids if pk is not None}
+    if not category_ids:
+        return
+    counts = [
+        ProductFacetCount(category_id=category_id, attribute_id=attribute_id, attribute_value_id=value_id,
+                          products=products)
+        for category_id, attribute_id, value_id, products in
+        ProductFacet.objects.filter(category_id__in=category_ids)
+        .values_list("category_id", "attribute_id", "attribute_value_id")
+        .annotate(Count("product_id", distinct=True)).order_by()
+    ]
+    ProductFacetCount.objects.bulk_create(counts, batch_size=1000, update_conflicts=True,
+                                          unique_fields=["category_id", "attribute_value_id"],
+                                          update_fields=["attribute_id", "products"])
+    ProductFacetCount.objects.filter(category_id__in=category_ids).exclude(Exists(ProductFacet.objects.filter(
+        category_id=OuterRef("category_id"), attribute_value_id=OuterRef("attribute_value_id")))).delete()
+
+
+def refresh_search_documents(product_ids):
+    """Rewrites the ProductSearchDocument rows of these products with one upsert, the documents of
+    inactive or deleted products are removed. The full-text index follows the table (search.py)"""
+    product_ids = {pk for pk in product_ids if pk is not None}
+    if not product_ids:
+        return
+    text = {} # product id: [pid, skus, attribute values]
+    products = list(Product.objects.filter(pk__in=product_ids, is_active=True)
+                    .values_list("id", "name", "description", "pid"))
+    for product_id, _, description, pid in products:
+        text[product_id] = [description, pid]
+    for product_id, sku in ProductLine.objects.filter(product_id__in=text, is_active=True).values_list("product_id", "sku"):
+        text[product_id].append(sku)
+    rows = ProductAttributeValue.objects.filter(product_id__in=text).values_list("product_id", "attribute_value__attribute_value")
+    lines = (ProductLineAttributeValue.objects.filter(product_line__product_id__in=text, product_line__is_active=True)
+             .values_list("product_line__product_id", "attribute_value__attribute_value"))
+    for product_id, value in list(rows) + list(lines):
+        text[product_id].append(value)
+
+    ProductSearchDocument.objects.exclude(product_id__in=text).filter(product_id__in=product_ids).delete()
+    ProductSearchDocument.objects.bulk_create([
+        ProductSearchDocument(product_id=product_id, name=name,
+                              body=" ".join(dict.fromkeys(filter(None, text[product_id])))) #repeated values once
+        for product_id, name, _, _ in products
+    ], batch_size=1000, update_conflicts=True, unique_fields=["product_id"], update_fields=["name", "body"])
+
+
+def rebuild_product_cards(batch_size=1000):
+    """Refreshes every card, the facet rows and the search documents, for the first deployment or after
+    bulk changes. Returns the count"""
+    ids = list(Product.objects.order_by("id").values_list("id", flat=True))
+    for start in range(0, len(ids), batch_size):
+        refresh_product_cards(ids[start:start + batch_size])
+        refresh_product_facets(ids[start:start + batch_size], counts=False)
+        refresh_search_documents(ids[start:start + batch_size])
+    refresh_facet_counts(Category.objects.values_list("id", flat=True)) #once, not per batch
+    return len(ids)
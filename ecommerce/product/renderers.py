@@ -0,0 +1,59 @@
+import decimal
+
+from rest_framework.utils import encoders
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson #optional, pip install orjson
+except ImportError:
+    orjson = None
+
+
+class DecimalEncoder(encoders.JSONEncoder):
+    """DRF's encoder turns a Decimal into a float, 10.10 can come out as 10.1 or 10.099999...
+    Prices are written as strings, like DecimalField does with COERCE_DECIMAL_TO_STRING"""
+
+    def default(self, obj):
+        if isinstance(obj, decimal.Decimal):
+            return str(obj)
+        return super().default(obj)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer with orjson when it is installed, the output is the same compact JSON.
+    Falls back to the json module (DRF's JSONRenderer) when orjson is missing, for indented
+    output (browsable API, ?indent=) and for values orjson refuses (ints over 64 bits ...)"""
+
+    encoder_class = DecimalEncoder
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if orjson is None or not self.compact or self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        encoder = self.encoder_class()
+        try:
+            ret = orjson.dumps(
+                data, default=encoder.default, #datetime, Decimal, UUID, lazy strings go through DRF's encoder
+                option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS,
+            )
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Same as JSONRenderer, the output stays a strict javascript subset
+        return ret.replace("\u2028".encode(), b"\\u2028").replace("\u2029".encode(), b"\\u2029")
+
+
+def stream_json_array(batches, renderer=None):
+    """Yields one JSON array, rendered one batch (a list of items) at a time.
+    Only the current batch is held in memory"""
+    renderer = renderer or FastJSONRenderer()
+    yield b"["
+    first = True
+    for batch in batches:
+        if not batch:
+            continue
+        chunk = renderer.render(list(batch))[1:-1] #the items without the surrounding []
+        yield chunk if first else b"," + chunk
+        first = False
+    yield b"]"
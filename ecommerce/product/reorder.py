@@ -0,0 +1,59 @@
+from django.core.exceptions import ValidationError
+from django.db import connections, router, transaction
+from django.db.models import F
+
+from .models import ProductImage, ProductLine
+from .signals import product_lines_changed, products_changed
+
+
+def reorder(model, parent_field, parent_id, ids):
+    """Gives the children of one parent the order 1..n following ids (all of the parent's children).
+    A fixed number of queries whatever the number of children (one more UPDATE per chunk on SQLite):
+    - the parent row is locked, then the children are read and locked (select_for_update): a child
+      inserted meanwhile waits for the parent (PostgreSQL) or the write lock (SQLite)
+    - every order is moved above the current and the new values (order + offset), so the
+      final update never collides with a value that is still in use: the (parent, order)
+      unique constraint is checked row by row on PostgreSQL, halfway through a permutation
+    - one UPDATE ... CASE id WHEN ... THEN ... ELSE order END writes the new values, in plain SQL: building
+      the same statement from Case(When(...)) expressions costs more than running it (~50ms for 500 rows).
+      Only the locked rows are updated, 3 parameters per row, chunked under the database's parameter limit
+    OrderField's counter catches up by itself, it takes the parent's highest order into account"""
+    ids = list(ids)
+    using = router.db_for_write(model)
+    parent_model = model._meta.get_field(parent_field).related_model
+    children = model.objects.using(using).filter(**{parent_field: parent_id})
+    with transaction.atomic(using=using):
+        list(parent_model._default_manager.using(using).select_for_update().filter(pk=parent_id).values_list("pk"))
+        current = dict(children.select_for_update().values_list("pk", "order"))
+        if len(set(ids)) != len(ids) or set(ids) != set(current):
+            raise ValidationError("The new order must list every item of the parent exactly once.")
+        if not ids:
+            return
+        offset = max(max(current.values()), len(ids))
+        children.update(order=F("order") + offset)
+
+        connection = connections[using]
+        quote = connection.ops.quote_name
+        meta = model._meta
+        order_column, pk_column = quote(meta.get_field("order").column), quote(meta.pk.column)
+        orders = list(enumerate(ids, 1))
+        chunk = (connection.features.max_query_params or 3 * len(ids)) // 3
+        with connection.cursor() as cursor:
+            for start in range(0, len(orders), chunk):
+                batch = orders[start:start + chunk]
+                cases = " ".join(["WHEN %s THEN %s"] * len(batch))
+                params = [value for order, pk in batch for value in (pk, order)]
+                cursor.execute(
+                    f"UPDATE {quote(meta.db_table)} SET {order_column} = CASE {pk_column} {cases} "
+                    f"ELSE {order_column} END WHERE {pk_column} IN ({', '.join(['%s'] * len(batch))})",
+                    params + [pk for _, pk in batch],
+                )
+
+def reorder_product_lines(product_id, ids):
+    reorder(ProductLine, "product_id", product_id, ids)
+    products_changed([product_id], product_line_ids=()) #update() sends no signals, the order isn't in the facets
+
+
+def reorder_product_images(product_line_id, ids):
+    reorder(ProductImage, "product_line_id", product_line_id, ids)
+    product_lines_changed([product_line_id], facets=False)
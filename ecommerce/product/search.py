@@ -0,0 +1,61 @@
+"""Full-text product search over ProductSearchDocument (name, description, pid, skus, attribute values).
+- SQLite: the FTS5 table product_search, ranked with bm25(), a match in the name counts 10 times more
+- PostgreSQL: the GIN index on POSTGRESQL_VECTOR, ranked with ts_rank(), the name has weight A
+- other databases: LIKE on every word, unranked (newest products first)
+Both index types are created by migration 0011. Every word of the query has to match, the last one
+as a prefix ("sams" finds "samsung") since the query is typed left to right"""
+import re
+
+from django.db import connections, router
+from django.db.models import Q
+
+from .models import ProductSearchDocument
+
+# Same expression as the GIN index in migration 0011, PostgreSQL only uses the index when they are equal
+POSTGRESQL_VECTOR = "(setweight(to_tsvector('simple', name), 'A') || setweight(to_tsvector('simple', body), 'B'))"
+
+WORD = re.compile(r"\w+")
+
+
+def search_words(query):
+    """The words of a query, punctuation and FTS operators dropped, so user input never reaches the
+    FTS query syntax: "ABC-123" is searched as abc and 123"""
+    return WORD.findall(query.lower())[:16]
+
+
+def _sqlite(cursor, words, limit, offset):
+    match = " ".join(f'"{word}"' for word in words) + "*" #"abc" "12"*
+    cursor.execute(
+        "SELECT rowid FROM product_search WHERE product_search MATCH %s "
+        "ORDER BY bm25(product_search, 10.0, 1.0), rowid LIMIT %s OFFSET %s",
+        [match, limit, offset],
+    )
+
+
+def _postgresql(cursor, words, limit, offset):
+    query = " & ".join(words) + ":*" #abc & 12:*
+    cursor.execute(
+        f"SELECT product_id FROM product_productsearchdocument WHERE {POSTGRESQL_VECTOR} @@ to_tsquery('simple', %s) "
+        f"ORDER BY ts_rank({POSTGRESQL_VECTOR}, to_tsquery('simple', %s)) DESC, product_id LIMIT %s OFFSET %s",
+        [query, query, limit, offset],
+    )
+
+
+BACKENDS = {"sqlite": _sqlite, "postgresql": _postgresql}
+
+
+def search_product_ids(query, limit, offset=0):
+    """Ids of the active products matching the query, best match first"""
+    words = search_words(query)
+    if not words:
+        return []
+    using = router.db_for_read(ProductSearchDocument)
+    backend = BACKENDS.get(connections[using].vendor)
+    if backend is None:
+        documents = ProductSearchDocument.objects.using(using)
+        for word in words:
+            documents = documents.filter(Q(name__icontains=word) | Q(body__icontains=word))
+        return list(documents.order_by("-product__created_at", "-pk").values_list("pk", flat=True)[offset:offset + limit])
+    with connections[using].cursor() as cursor:
+        backend(cursor, words, limit, offset)
+        return [pk for pk, in cursor.fetchall()]
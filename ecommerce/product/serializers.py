@@ -1,6 +1,52 @@
+from django.conf import settings
 from rest_framework import serializers
 
-from .models import Category, Product, ProductLine, ProductImage, Attribute, AttributeValue, ProductType
+from .models import Category, Product, ProductLine, ProductImage, Attribute, AttributeValue, ProductType, ProductCard
+
+
+def _split_paths(paths):
+    """["name", "product_line.price"] -> top level names {"name", "product_line"}
+    and the rest of the dotted paths per name {"product_line": ["price"]}"""
+    names, nested = set(), {}
+    for path in paths:
+        name, _, rest = path.partition(".")
+        names.add(name)
+        if rest:
+            nested.setdefault(name, []).append(rest)
+    return names, nested
+
+
+class SparseFieldsMixin:
+    """?fields= and ?expand= support, passed in as fields=[...] and expand=[...] (dotted paths)
+    Without both, the output is complete. With either of them:
+    - fields keeps only the listed fields, "product_line.price" selects inside a relation
+    - relations (nested serializers) are left out unless they are expanded, or named in fields
+    Fields are removed from the serializer itself, so the prefetch plan built from it
+    (query_planner.build_plan) never loads the relations that are not shown.
+    output_names maps the keys shown in the output to the serializer field names"""
+
+    output_names = {}
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None or expand is not None:
+            self.prune(fields or [], expand or [])
+
+    def prune(self, fields, expand):
+        field_names, nested_fields = _split_paths(fields)
+        expand_names, nested_expand = _split_paths(expand)
+        to_output = {field: output for output, field in self.output_names.items()}
+
+        for name, field in list(self.fields.items()):
+            output = to_output.get(name, name)
+            nested = field.child if isinstance(field, serializers.ListSerializer) else field
+            if isinstance(nested, serializers.BaseSerializer): #a relation
+                if output not in field_names and output not in expand_names:
+                    self.fields.pop(name)
+                elif isinstance(nested, SparseFieldsMixin):
+                    nested.prune(nested_fields.get(output, []), nested_expand.get(output, []))
+            elif field_names and output not in field_names:
+                self.fields.pop(name)
 
 
 class CategorySerializer(serializers.ModelSerializer):
@@ -33,7 +79,7 @@ class AttributeValueSerializer(serializers.ModelSerializer):
         fields = ["attribute", "attribute_value"]
 
 
-class ProductLineSerializer(serializers.ModelSerializer):
+class ProductLineSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     # product = ProductSerializer() #ForeignKey
     product_image = ProductImageSerializer(many=True) #reverse relationships
     attribute_value = AttributeValueSerializer(many=True)  # many-to-many ForeignKey
@@ -48,6 +94,8 @@ class ProductLineSerializer(serializers.ModelSerializer):
                    "product_image",
                    "attribute_value" ,#many-to-many reference # The attribute_value above overrides the value of this
                    ]
+
+    output_names = {"specification": "attribute_value"} #for ?fields=/?expand=
         
     def to_representation(self, instance):
         """To customize the serializer output, pop() and update() are dictionary methods
@@ -60,6 +108,8 @@ class ProductLineSerializer(serializers.ModelSerializer):
           "attribute_value": "IPS"},
           ]"""
         data = super().to_representation(instance) #data is a dictionary/OrderedDict # One record
+        if "attribute_value" not in data: #left out by ?fields=
+            return data
         attribute_value_data = data.pop("attribute_value") #pop has removed the attribute_value from the whole data, At this point
         attr_values_dict = {}
         for element in attribute_value_data:
@@ -77,7 +127,7 @@ class ProductTypeSerializer(serializers.ModelSerializer):
         fields = ["name", "attribute"]
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     # brand_name = BrandSerializer()  #To enable brand and category data related to a product to be returned with Products data
     # category_name = CategorySerializer(source="category.name") #Doesnt work
     # brand_name = serializers.CharField(source="brand.name") #source Mapping and Flatenning # Only works with serializers.Fields and not with the direct BrandSerializers
@@ -102,6 +152,8 @@ class ProductSerializer(serializers.ModelSerializer):
                   "product_line",
                   "attribute_value"] # first check output from this attribute_value
 
+    output_names = {"attribute": "attribute_value"} #for ?fields=/?expand=
+
     # def get_attribute(self, obj):
     #     """custom field: From the SerializerMethodField above, filter by related_name, Always use real tables, never intermediate tables
     #     This is just like running an SQl query on a joined table"""
@@ -113,6 +165,8 @@ class ProductSerializer(serializers.ModelSerializer):
         """To customize the serializer output, customizing the 'attribute' output
         attribute is also renamed to 'type specification' """
         data = super().to_representation(instance)
+        if "attribute_value" not in data: #left out by ?fields=
+            return data
         attribute_data = data.pop("attribute_value")
         attr_values_dict = {}
         for element in attribute_data:
@@ -121,42 +175,71 @@ class ProductSerializer(serializers.ModelSerializer):
         return data
     
 
-class ProductLineCategorySerializer(serializers.ModelSerializer):
-    """Another ProductLine serializer for a different Task"""
-    product_image = ProductImageSerializer(many=True) #reverse relationships
-
-    class Meta:
-        model = ProductLine
-        fields = ["price",
-                   "product_image",
-                   ]
-
 class ProductCategorySerializer(serializers.ModelSerializer):
-    """Another Product Serializer for a different Task"""
-    # category = serializers.CharField(source="category.name") #source Mapping and Flatenning
-    product_line = ProductLineCategorySerializer(many=True) # many=True Because one Product can have many product lines #product_line is a related_name #reverse relationships foreign key
+    """Another Product Serializer for a different Task
+    Reads the denormalized ProductCard, price and image of the first active product line are already on the row"""
+    image = serializers.SerializerMethodField()
 
     class Meta:
-        model = Product
+        model = ProductCard
         fields = ["name", 
                   "slug", 
                   "pid",
                 #   "category",
                   "created_at", 
-                  "product_line"]
+                  "price",
+                  "image"]
+
+    def get_image(self, obj):
+        """Same output as the old nested product_image list, the primary image or an empty list"""
+        if not obj.image:
+            return []
+        url = serializers.ImageField(read_only=True)
+        url.bind("url", self) #gives the field access to the request in the context, for absolute urls
+        return [{"alternative_text": obj.image_alternative_text,
+                 "url": url.to_representation(obj.image),
+                 "order": obj.image_order}]
 
     def to_representation(self, instance):
         """To customize the serializer output, customizing the 'Product Category' output"""
         data = super().to_representation(instance)
-        x = data.pop("product_line") #x is a list of Product lines, but we are taking only the first one x[0]
-        # print(x) #To inspect the data coming from 'list_product_by_category_slug' view
-        if x: #To avoid errors
-            first_product_line = x[0]
-            price = first_product_line["price"]
-            image = first_product_line["product_image"]
-            data.update({"price":price, "image":image})
-            # data.update({"image":image})
+        if instance.price is None: #No active product line, no price and no image like before
+            data.pop("price")
+            data.pop("image")
+        return data
+
+
+class ReorderSerializer(serializers.Serializer):
+    """Body of the reorder endpoints, the ids of all of the parent's items in their new order"""
+    parent = serializers.IntegerField()
+    order = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
+
+
+class ProductBatchSerializer(serializers.Serializer):
+    """Body of the batch endpoint, the slugs or the pids of the products in the order they are wanted"""
+    slugs = serializers.ListField(child=serializers.CharField(max_length=255), required=False, allow_empty=False)
+    pids = serializers.ListField(child=serializers.CharField(max_length=10), required=False, allow_empty=False)
+
+    def validate(self, data):
+        if len(data) != 1:
+            raise serializers.ValidationError("Give either slugs or pids.")
+        (field, values), = data.items()
+        if len(values) > settings.PRODUCT_BATCH_MAX_SIZE:
+            raise serializers.ValidationError({field: [f"At most {settings.PRODUCT_BATCH_MAX_SIZE} items."]})
         return data
 
 
-# serializers are very important in customizing the data output and manipulating the data
\ No newline at end of file
+# serializers are very important in customizing the data output and manipulating the data
+
+class FacetFilterSerializer(serializers.Serializer):
+    """Query parameters of the faceted category search"""
+    values = serializers.CharField(required=False, help_text="Comma separated attribute value ids")
+    price_min = serializers.DecimalField(decimal_places=2, max_digits=6, required=False)
+    price_max = serializers.DecimalField(decimal_places=2, max_digits=6, required=False)
+    in_stock = serializers.BooleanField(required=False, default=False)
+
+    def validate_values(self, value):
+        try:
+            return [int(pk) for pk in value.split(",") if pk]
+        except ValueError:
+            raise serializers.ValidationError("Comma separated attribute value ids.")
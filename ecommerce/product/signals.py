@@ -0,0 +1,202 @@
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .cache import bump_product_versions, categories_changed, invalidate_category_tree, log_autocomplete_changes
+from .read_models import (refresh_product_cards, refresh_product_facets, refresh_search_documents,
+                          remove_product_facets, remove_product_line_facets)
+from .models import (Attribute, AttributeValue, Category, Product, ProductAttributeValue, ProductImage,
+                     ProductLine, ProductLineAttributeValue)
+
+CATEGORY_CARDS_BATCH = 1000 #cards refreshed per upsert when a category is moved or renamed
+
+
+def products_changed(product_ids, extra_slugs=(), touch=True, product_line_ids=None):
+    """Everything that depends on a product's data is refreshed from here.
+    updated_at is touched for ETag/Last-Modified (touch=False when the product row itself was saved),
+    the product cards, facet rows and search documents are recomputed, the cache versions are bumped right away and again
+    after the commit, so a response cached by a reader that still saw the old rows is dropped as well.
+    product_line_ids: only the facet rows of these lines changed (an empty list: none of them)"""
+    product_ids = {pk for pk in product_ids if pk is not None}
+    slugs = set(extra_slugs)
+    if product_ids:
+        if touch:
+            Product.objects.filter(pk__in=product_ids).update(updated_at=timezone.now()) #no signals, no recursion
+        slugs.update(Product.objects.filter(pk__in=product_ids).values_list("slug", flat=True))
+        refresh_product_cards(product_ids)
+        refresh_product_facets(product_ids, product_line_ids=product_line_ids)
+        refresh_search_documents(product_ids)
+        transaction.on_commit(lambda: log_autocomplete_changes(product_ids)) #every worker's in-memory index
+    if not slugs:
+        return
+    bump_product_versions(slugs)
+    transaction.on_commit(lambda: bump_product_versions(slugs))
+
+
+def product_lines_changed(product_line_ids, facets=True):
+    """An image (facets=False, the facet rows don't show images) or a specification of a product line changed"""
+    product_line_ids = set(product_line_ids)
+    ProductLine.objects.filter(pk__in=product_line_ids).update(updated_at=timezone.now())
+    products_changed(ProductLine.objects.filter(pk__in=product_line_ids).values_list("product_id", flat=True),
+                     product_line_ids=product_line_ids if facets else ())
+
+
+def products_using(attribute_values):
+    """Ids of the products showing any of these attribute values, on the product or on a product line"""
+    return set(Product.objects.filter(
+        Q(attribute_value__in=attribute_values) | Q(product_line__attribute_value__in=attribute_values)
+    ).values_list("id", flat=True).distinct())
+
+
+@receiver(pre_save, sender=Product)
+def remember_previous_product(sender, instance, **kwargs):
+    """A changed slug has to invalidate the response cached under the old slug too,
+    the facet rows of every line only follow a new category or is_active"""
+    if instance.pk:
+        instance._previous = Product.objects.filter(pk=instance.pk).values_list(
+            "slug", "category_id", "is_active").first()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_saved(sender, instance, signal, **kwargs):
+    previous = getattr(instance, "_previous", None)
+    extra_slugs = {instance.slug} | ({previous[0]} if previous is not None else set())
+    facets = previous is not None and previous[1:] != (instance.category_id, instance.is_active)
+    deleted = signal is post_delete #the row is gone, only the slugs are left
+    products_changed([] if deleted else [instance.pk], extra_slugs=extra_slugs, touch=False,
+                     product_line_ids=None if facets else ()) #a new product has no lines yet
+    if deleted:
+        pk = instance.pk
+        transaction.on_commit(lambda: log_autocomplete_changes([pk]))
+    invalidate_category_tree() #product counts
+    transaction.on_commit(invalidate_category_tree)
+
+
+@receiver(pre_delete, sender=Product)
+@receiver(pre_delete, sender=ProductLine)
+def product_deleting(sender, instance, **kwargs):
+    """The facet counts are moved by the old and new facet rows, take the rows off before the delete cascades
+    over them"""
+    if sender is Product:
+        remove_product_facets([instance.pk])
+    else:
+        remove_product_line_facets([instance.pk])
+
+
+@receiver(post_save, sender=ProductLine)
+@receiver(post_delete, sender=ProductLine)
+def product_line_saved(sender, instance, signal, origin=None, **kwargs):
+    if isinstance(origin, Product):
+        return #cascade of a product delete, the rewritten card would point to the deleted product
+    products_changed([instance.product_id], product_line_ids=() if signal is post_delete else [instance.pk])
+
+
+@receiver(post_save, sender=ProductAttributeValue)
+@receiver(post_delete, sender=ProductAttributeValue)
+def product_child_saved(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Product):
+        return
+    products_changed([instance.product_id])
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=ProductLineAttributeValue)
+@receiver(post_delete, sender=ProductLineAttributeValue)
+def product_line_child_saved(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, (Product, ProductLine)):
+        return #cascade of a delete, refreshed by the product line's own signal
+    product_lines_changed([instance.product_line_id], facets=sender is ProductLineAttributeValue)
+
+
+@receiver(m2m_changed, sender=ProductAttributeValue)
+@receiver(m2m_changed, sender=ProductLineAttributeValue)
+def check_assignment_attributes(sender, instance, action, reverse, pk_set, **kwargs):
+    """.add() inserts the through rows with bulk_create, without save()/clean(): a second value of an
+    attribute is rejected here with one query, before any row is written (the (parent, attribute)
+    constraint covers a concurrent assignment). Inside a transaction that goes on after the error,
+    run .add() in its own atomic() block, like any other failing write"""
+    if action != "pre_add" or not pk_set:
+        return
+    parent = "product_id" if sender is ProductAttributeValue else "product_line_id"
+    if reverse: #instance is the AttributeValue, pk_set the parents
+        taken = sender.objects.filter(**{f"{parent}__in": pk_set, "attribute_id": instance.attribute_id}).exclude(
+            attribute_value=instance).values_list(parent, flat=True)
+        errors = [f"Duplicate attribute type for {parent[:-3].replace('_', ' ')} {pk}." for pk in sorted(taken)]
+    else:
+        _, errors = sender.objects.plan(parent, instance.pk, pk_set)
+    if errors:
+        raise ValidationError(errors)
+
+
+@receiver(m2m_changed, sender=ProductAttributeValue)
+def product_attribute_values_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Product.attribute_value.add()/remove()/clear() skip the through model's save()"""
+    if not reverse:
+        if action.startswith("post_"):
+            products_changed([instance.pk])
+    elif action == "pre_clear": #attribute_value.product_attribute_value.clear(), the ids are gone afterwards
+        instance._cleared_ids = set(ProductAttributeValue.objects.filter(
+            attribute_value=instance).values_list("product_id", flat=True))
+    elif action == "post_clear":
+        products_changed(instance._cleared_ids)
+    elif action.startswith("post_"):
+        products_changed(pk_set)
+
+
+@receiver(m2m_changed, sender=ProductLineAttributeValue)
+def product_line_attribute_values_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith("post_"):
+            product_lines_changed([instance.pk])
+    elif action == "pre_clear":
+        instance._cleared_ids = set(ProductLineAttributeValue.objects.filter(
+            attribute_value=instance).values_list("product_line_id", flat=True))
+    elif action == "post_clear":
+        product_lines_changed(instance._cleared_ids)
+    elif action.startswith("post_"):
+        product_lines_changed(pk_set)
+
+
+@receiver(post_save, sender=AttributeValue)
+@receiver(pre_delete, sender=AttributeValue)
+def attribute_value_saved(sender, instance, signal, **kwargs):
+    """pre_delete, the assignments are deleted together with the value"""
+    if signal is post_save: #a value moved to another attribute, the assignments' copy follows
+        for model in (ProductAttributeValue, ProductLineAttributeValue):
+            model.objects.filter(attribute_value=instance).exclude(
+                attribute_id=instance.attribute_id).update(attribute_id=instance.attribute_id)
+    products_changed(products_using([instance]))
+
+
+@receiver(post_save, sender=Attribute)
+@receiver(pre_delete, sender=Attribute)
+def attribute_saved(sender, instance, **kwargs):
+    products_changed(products_using(AttributeValue.objects.filter(attribute=instance)))
+
+
+@receiver(pre_save, sender=Category)
+def remember_previous_category_path(sender, instance, **kwargs):
+    """The cards' category path only changes with the slug or the parent, every move goes through save()
+    (mptt's node_moved is also sent for saves that don't move the node)"""
+    if instance.pk:
+        instance._previous_path = Category.objects.filter(pk=instance.pk).values_list("slug", "parent_id").first()
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_saved(sender, instance, signal, created=False, **kwargs):
+    """The list cache is per process and keyed on the ETag state, the other workers miss it on their own.
+    The tree is in the shared cache. A moved category or a new slug changes the category path of the cards
+    of its subtree, they are refreshed in batches (a new category has no products, a delete is PROTECTed)"""
+    previous = getattr(instance, "_previous_path", None)
+    if signal is post_save and not created and previous != (instance.slug, instance.parent_id):
+        instance.refresh_from_db(fields=["tree_id", "lft", "rght"]) #a move renumbers the tree
+        ids = list(Product.objects.in_category_subtree(instance).order_by("id").values_list("id", flat=True))
+        for start in range(0, len(ids), CATEGORY_CARDS_BATCH):
+            refresh_product_cards(ids[start:start + CATEGORY_CARDS_BATCH])
+    categories_changed()
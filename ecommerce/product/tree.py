@@ -0,0 +1,68 @@
+from django.db.models import Count
+
+from .cache import get_category_tree, set_category_tree
+from .models import Category, Product
+
+
+def build_category_tree():
+    """The nested active category tree, with breadcrumbs and product counts.
+    One scan of the active categories in (tree_id, lft) order and one grouped count of the
+    active products per category, the nesting is done with a stack: in MPTT order every node
+    comes right after its parent, and a node is closed once a node outside its lft/rght range starts.
+    A category under an inactive parent is left out with its whole subtree.
+    product_count includes the products of the sub categories, like the products by category endpoint"""
+    counts = dict(
+        Product.objects.is_active().filter(category__isnull=False)
+        .values_list("category_id").annotate(Count("id")).order_by()
+    )
+    rows = (
+        Category.objects.is_active().order_by("tree_id", "lft")
+        .values_list("id", "parent_id", "name", "slug", "tree_id", "lft", "rght")
+    )
+
+    roots = []
+    stack = [] # open nodes, from the root down to the last added node
+
+    def close(node):
+        if stack:
+            stack[-1]["product_count"] += node["product_count"]
+
+    for pk, parent_id, name, slug, tree_id, lft, rght in rows:
+        while stack and (stack[-1]["_tree_id"] != tree_id or stack[-1]["_rght"] < lft):
+            close(stack.pop())
+
+        if parent_id is not None and (not stack or stack[-1]["_id"] != parent_id):
+            continue #an ancestor is inactive
+
+        breadcrumbs = stack[-1]["breadcrumbs"] if stack else []
+        node = {
+            "category": name,
+            "slug": slug,
+            "product_count": counts.get(pk, 0),
+            "breadcrumbs": breadcrumbs + [{"category": name, "slug": slug}],
+            "children": [],
+            "_id": pk, "_tree_id": tree_id, "_rght": rght,
+        }
+        (stack[-1]["children"] if stack else roots).append(node)
+        stack.append(node)
+
+    while stack:
+        close(stack.pop())
+
+    _strip_private(roots)
+    return roots
+
+
+def _strip_private(nodes):
+    for node in nodes:
+        del node["_id"], node["_tree_id"], node["_rght"]
+        _strip_private(node["children"])
+
+
+def category_tree():
+    """Cached build_category_tree(), invalidated by the Category and Product signals"""
+    tree = get_category_tree()
+    if tree is None:
+        tree = build_category_tree()
+        set_category_tree(tree)
+    return tree
@@ -0,0 +1,95 @@
+"""Variant resolution for the product page: which product line matches the attribute values a shopper
+selected (size=11, colour=blue), and which values can still be picked with a partial selection.
+Each slug gets an index, built from two queries and kept in the shared cache under the product's
+version, so every write that invalidates the detail response (product lines, their attribute values,
+attribute renames ...) invalidates the index too. It is rebuilt on the first read after a write.
+The index maps sorted value id keys ("3,7,12") to:
+- lines: the product line with exactly these values
+- available: for every subset of a line's values, the values found on the lines that contain it.
+  A line with k values adds 2**k keys, k is the number of attributes of a variant (a handful)
+Resolving a selection is then one dict lookup per attribute, whatever the number of lines"""
+from itertools import combinations
+
+from django.core.exceptions import ValidationError
+
+from .cache import get_variant_index, set_variant_index
+from .fast_serializers import LINE_KEYS, _row, compile_fields
+from .models import ProductLine, ProductLineAttributeValue
+from .serializers import ProductLineSerializer
+
+
+def variant_key(value_ids):
+    return ",".join(map(str, sorted(value_ids)))
+
+
+def build_variant_index(slug):
+    """The index of the active product lines of the active product(s) with this slug"""
+    line_fields = compile_fields(ProductLineSerializer, tuple(LINE_KEYS))
+    lines = ProductLine.objects.filter(product__slug=slug, product__is_active=True, is_active=True)
+
+    values = {} # line id: {value id: (attribute name, value)}
+    rows = (ProductLineAttributeValue.objects.filter(product_line__in=lines).order_by("attribute_value_id")
+            .values_list("product_line_id", "attribute_value_id", "attribute_value__attribute__name",
+                         "attribute_value__attribute_value"))
+    for line_id, value_id, name, value in rows:
+        values.setdefault(line_id, {})[value_id] = (name, value)
+
+    index = {"lines": {}, "available": {}, "attributes": {}, "value_attribute": {}}
+    for line_id, *row in lines.order_by("product_id", "order", "pk").values_list("id", *LINE_KEYS):
+        line_values = values.get(line_id, {})
+        key = variant_key(line_values)
+        if key in index["lines"]: #two lines with the same values, the first one is shown
+            continue
+        line = {"id": line_id, **_row(row, line_fields)}
+        line["specification"] = {name: value for name, value in line_values.values()}
+        index["lines"][key] = line
+
+        for value_id, (name, value) in line_values.items():
+            index["attributes"].setdefault(name, {})[value_id] = value
+            index["value_attribute"][value_id] = name
+        ids = sorted(line_values)
+        for size in range(len(ids) + 1):
+            for subset in combinations(ids, size):
+                index["available"].setdefault(variant_key(subset), set()).update(ids)
+    return index
+
+
+def variant_index(slug):
+    """Cached build_variant_index()"""
+    index = get_variant_index(slug)
+    if index is None:
+        index = build_variant_index(slug)
+        set_variant_index(slug, index)
+    return index
+
+
+def resolve_variant(index, selected):
+    """selected: attribute value ids, at most one per attribute.
+    Returns the matching line (None until the selection is complete) and, for every attribute,
+    its values with the ones that still lead to a line when picked instead of the current choice"""
+    selected = set(selected)
+    unknown = selected - index["value_attribute"].keys()
+    if unknown:
+        raise ValidationError(f"Unknown attribute values for this product: {variant_key(unknown)}.")
+    chosen = {} # attribute name: value id
+    for value_id in selected:
+        name = index["value_attribute"][value_id]
+        if name in chosen:
+            raise ValidationError(f"More than one value selected for {name}.")
+        chosen[name] = value_id
+
+    options = []
+    for name in sorted(index["attributes"]):
+        others = [value_id for attribute, value_id in chosen.items() if attribute != name]
+        available = index["available"].get(variant_key(others), ())
+        options.append({
+            "attribute": name,
+            "values": [{"id": value_id, "value": value, "selected": value_id in selected,
+                        "available": value_id in available}
+                       for value_id, value in index["attributes"][name].items()],
+        })
+    return {
+        "selected": sorted(selected),
+        "product_line": index["lines"].get(variant_key(selected)),
+        "options": options,
+    }
@@ -1,18 +1,55 @@
-from django.shortcuts import render
-from drf_spectacular.utils import extend_schema
+from itertools import islice
+
+from django.conf import settings
+from django.core.exceptions import ValidationError as ModelValidationError
+from django.http import StreamingHttpResponse
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import OpenApiParameter, extend_schema
 from rest_framework import viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
-from django.db.models import Prefetch
-from django.db import connection
 
-from pygments import highlight # Not necessary
-from pygments.formatters import TerminalFormatter
-from pygments.lexers.sql import SqlLexer #depends on the database you are using #PostgresLexer for Postgres db
-from sqlparse import format
+from .models import Category, Product, ProductCard
+from .serializers import (CategorySerializer, FacetFilterSerializer, ProductBatchSerializer, ProductSerializer, ProductCategorySerializer,
+                          ReorderSerializer)
+from .query_planner import optimize_queryset
+from .pagination import CategoryCursorPagination, ProductCardCursorPagination, ProductCursorPagination, SearchPagination
+from .cache import category_list_cache, get_product_detail, set_product_detail
+from .conditional import category_list_conditional, category_list_state, product_detail_conditional
+from .tree import category_tree
+from .fast_serializers import CARD_COLUMNS, PRODUCT_COLUMNS, serialize_product_cards, serialize_products
+from .renderers import stream_json_array
+from .export import EXPORT_FORMATS, export_rows
+from .reorder import reorder_product_images, reorder_product_lines
+from .variants import resolve_variant, variant_index
+from .facets import facet_counts, facet_products, selected_values
+from .search import search_product_ids
+from .autocomplete import autocomplete_index
+from .query_budget import query_budget
+
+SPARSE_FIELDS_PARAMETER = OpenApiParameter(
+    "fields", str, description="Comma separated fields to keep, dotted for nested ones: name,slug,product_line.price")
+EXPAND_PARAMETER = OpenApiParameter(
+    "expand", str, description="Comma separated relations to include: product_line,product_line.product_image,attribute")
+STREAM_PARAMETER = OpenApiParameter(
+    "stream", bool, description="Return every active product as one unpaginated JSON array, written in chunks")
+
+VALUES_PARAMETER = OpenApiParameter(
+    "values", str, description="Comma separated ids of the selected attribute values (see options[].values[].id)")
+SEARCH_PARAMETER = OpenApiParameter(
+    "q", str, required=True, description="Words to find in the name, description, pid, skus or attribute values")
+PAGE_PARAMETER = OpenApiParameter("page", int, description="Result page, from 1")
+AUTOCOMPLETE_PARAMETER = OpenApiParameter("q", str, required=True, description="The text typed so far")
+LIMIT_PARAMETER = OpenApiParameter("limit", int, description="Completions to return, 10 by default, 50 at most")
+OUTPUT_PARAMETER = OpenApiParameter("output", str, enum=sorted(EXPORT_FORMATS), default="jsonl")
 
-from .models import Category, Product, ProductLineAttributeValue, ProductLine, ProductImage #ProductLine, ProductImage used for ordering and filtering
-from .serializers import CategorySerializer, ProductSerializer, ProductCategorySerializer
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
 
 
 class CategoryView(viewsets.ViewSet):
@@ -20,13 +57,44 @@ class CategoryView(viewsets.ViewSet):
     A simple Viewset for viewing all categories
     """
 
-    queryset = Category.objects.all().is_active()
+    queryset = Category.objects.all().is_active() #Never evaluated, see get_queryset()
     serializer_class = CategorySerializer
 
+    pagination_class = CategoryCursorPagination
+
+    def get_queryset(self):
+        """A new queryset for every request, like GenericAPIView.get_queryset
+        Iterating the class level queryset would fill its result cache once and serve it to every request"""
+        return self.queryset.all()
+
     @extend_schema(responses=CategorySerializer, tags=['category']) #Docs
+    @category_list_conditional #ETag/Last-Modified, If-None-Match gets a 304 without serializing
     def list(self, request):
-        serializer = CategorySerializer(self.queryset, many=True)
-        return Response(serializer.data)
+        #one entry per page (the next link depends on the host) and per ETag state, so a worker never answers
+        #a new ETag with a body cached before another worker's write
+        key = (request.build_absolute_uri(), *category_list_state(request))
+        data = category_list_cache.get(key)
+        if data is None:
+            paginator = self.pagination_class()
+            page = paginator.paginate_queryset(self.get_queryset(), request, view=self)
+            serializer = CategorySerializer(page, many=True)
+            data = paginator.get_paginated_response(list(serializer.data)).data #plain list, no serializer reference kept
+            category_list_cache.set(key, data)
+        return Response(data)
+
+    @extend_schema(tags=['category']) #Docs
+    @action(methods=["get"], detail=False, url_path="tree")
+    def tree(self, request):
+        """
+        An endpoint to return the nested active category tree, with breadcrumbs and product counts
+        """
+        return Response(category_tree())
+
+    @extend_schema(exclude=True)
+    @action(methods=["get"], detail=False, url_path="cache-stats", permission_classes=[IsAdminUser])
+    def cache_stats(self, request):
+        """Hit/miss counters of the category list cache, to tune its size and ttl"""
+        return Response(category_list_cache.stats())
     
 
 @extend_schema(responses=ProductSerializer, tags=['product']) #Docs
@@ -35,58 +103,236 @@ class ProductView(viewsets.ViewSet):
     A simple Viewset for viewing all products
     """
 
-    queryset = Product.objects.all().is_active() #Product.objects.all() #Product.isactive.all() 
+    queryset = Product.objects.all().is_active() #Product.objects.all() #Product.isactive.all() #Never evaluated, see get_queryset()
     serializer_class = ProductSerializer
 
+    pagination_class = ProductCursorPagination
+
     lookup_field = "slug"
 
+    def get_queryset(self):
+        """A new queryset for every request"""
+        return self.queryset.all()
+
+    def get_sparse_fields(self):
+        """?fields=name,slug,product_line.price and ?expand=product_line.product_image as serializer kwargs,
+        empty when neither is given (full output)"""
+        kwargs = {}
+        for param in ("fields", "expand"):
+            if param in self.request.query_params:
+                kwargs[param] = [path for path in self.request.query_params[param].split(",") if path]
+        return kwargs
+
+    def serialize(self, queryset, sparse):
+        """[(product, data)] with the retrieve payload of every product of the queryset, the product being its
+        .values() row or its instance. One prefetch plan (or 4 fast path queries) whatever the number of products"""
+        if settings.FAST_READ_SERIALIZERS and not sparse:
+            products = list(queryset.values(*PRODUCT_COLUMNS))
+            return list(zip(products, serialize_products(products)))
+        products = list(optimize_queryset(queryset, ProductSerializer(**sparse))) #prefetch plan derived from the (pruned) serializer tree
+        return list(zip(products, ProductSerializer(products, many=True, **sparse).data)) #select_related does all the table joins for us
+
+    @extend_schema(parameters=[SPARSE_FIELDS_PARAMETER, EXPAND_PARAMETER])
+    @product_detail_conditional #ETag/Last-Modified, If-None-Match gets a 304 without serializing
     def retrieve(self, request, slug=None): #default lookup field is pk i.e  pk=None
         """
         An endpoint to return a product by name
         """
-        serializer = ProductSerializer( #self.queryset.filter()
-            self.queryset.filter(slug=slug)
-            .prefetch_related(Prefetch("attribute_value__attribute")) #For performance
-            .prefetch_related(Prefetch("product_line__product_image")) #For performance
-            .prefetch_related(Prefetch("product_line__attribute_value__attribute")) #For performance
-            ,
-              #traversing(joining) 3 tables using their related_name  #Prefetch(related_name1)
-            many=True) #many=True to avoid errors #slug field isnt unique yet #select_related does all the table joins for us
-        data = Response(serializer.data)
-
-        # Not so Neccessary
-        # q = list(connection.queries)
-        # print(len(q)) #Amount of queries
-        # for qs in q:
-        #     sqlformatted = format(str(qs['sql']), reindent=True)
-        #     print(highlight(sqlformatted, SqlLexer(), TerminalFormatter()))
-
-        return data
+        sparse = self.get_sparse_fields()
+        cached = None if sparse else get_product_detail(slug) #hot products are served from the versioned cache
+        if cached is not None:
+            return Response(cached)
+
+        products = [data for _, data in self.serialize(self.get_queryset().filter(slug=slug), sparse)] #a list, slug field isnt unique yet
+        if not sparse: #only the full payload is cached
+            set_product_detail(slug, list(products)) #plain list, ReturnList keeps a reference to the serializer
+        return Response(products) #query count and SQL time: X-Query-Count/X-Query-Time, see query_budget.py
     
 
+    @extend_schema(parameters=[SPARSE_FIELDS_PARAMETER, EXPAND_PARAMETER], request=ProductBatchSerializer,
+                   responses=OpenApiTypes.OBJECT)
+    @action(methods=["post"], detail=False, url_path="batch")
+    @query_budget(queries=5, repeats=1) #one prefetch plan whatever the number of slugs/pids
+    def batch(self, request):
+        """
+        An endpoint to return many products at once (cart, wishlist ...): {"slugs": [...]} or {"pids": [...]}.
+        One result per slug/pid in the same order, with the retrieve payload or a not found marker
+        """
+        serializer = ProductBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        (field, keys), = serializer.validated_data.items()
+        key = field[:-1] #slug or pid
+        found = {}
+        for product, data in self.serialize(self.get_queryset().filter(**{f"{key}__in": set(keys)}), self.get_sparse_fields()):
+            value = product[key] if isinstance(product, dict) else getattr(product, key)
+            found.setdefault(value, []).append(data)
+        return Response({"results": [{key: value, "products": found[value]} if value in found
+                                     else {key: value, "detail": "Not found."} for value in keys]})
+
+    @extend_schema(parameters=[VALUES_PARAMETER], responses=OpenApiTypes.OBJECT)
+    @action(methods=["get"], detail=True, url_path="variant")
+    def variant(self, request, slug=None):
+        """
+        An endpoint to find the product line matching the selected attribute values,
+        with the values that can still be picked for every attribute
+        """
+        try:
+            selected = [int(pk) for pk in request.query_params.get("values", "").split(",") if pk]
+        except ValueError:
+            raise ValidationError({"values": ["Comma separated attribute value ids."]})
+        index = variant_index(slug)
+        if not index["lines"]: #no active product, or no active product line
+            raise NotFound()
+        try:
+            return Response(resolve_variant(index, selected))
+        except ModelValidationError as e:
+            raise ValidationError({"values": e.messages})
+
+    def stream(self, sparse):
+        """The whole catalogue as a JSON array, STREAM_CHUNK_SIZE products at a time:
+        the rows are read with a chunked iterator (prefetches run per chunk), memory stays flat"""
+        chunk_size = settings.STREAM_CHUNK_SIZE
+        queryset = self.get_queryset().order_by("-created_at", "-id") #same order as the pages
+        if settings.FAST_READ_SERIALIZERS and not sparse:
+            rows = queryset.values(*PRODUCT_COLUMNS).iterator(chunk_size=chunk_size)
+            batches = (serialize_products(batch) for batch in batched(rows, chunk_size))
+        else:
+            rows = optimize_queryset(queryset, ProductSerializer(**sparse)).iterator(chunk_size=chunk_size)
+            batches = (ProductSerializer(batch, many=True, **sparse).data for batch in batched(rows, chunk_size))
+        return StreamingHttpResponse(stream_json_array(batches), content_type="application/json")
+
+    @extend_schema(parameters=[SPARSE_FIELDS_PARAMETER, EXPAND_PARAMETER, STREAM_PARAMETER])
     def list(self, request):
-        serializer = ProductSerializer(self.queryset, many=True)
-        return Response(serializer.data)
+        """
+        An endpoint to return all active products, served in a fixed number of queries
+        """
+        sparse = self.get_sparse_fields()
+        if request.query_params.get("stream", "").lower() in ("1", "true"):
+            return self.stream(sparse)
+        paginator = self.pagination_class()
+        if settings.FAST_READ_SERIALIZERS and not sparse:
+            page = paginator.paginate_queryset(self.get_queryset().values(*PRODUCT_COLUMNS), request, view=self)
+            return paginator.get_paginated_response(serialize_products(page))
+        page = paginator.paginate_queryset(optimize_queryset(self.get_queryset(), ProductSerializer(**sparse)), request, view=self)
+        serializer = ProductSerializer(page, many=True, **sparse)
+        return paginator.get_paginated_response(serializer.data)
     
 
-    @action(methods=["get"], detail=False, 
-            url_path=r"category/(?P<slug>[\w-]+)",) #when our url_path is dynamic
-    def list_product_by_category_slug(self, request, slug=None): #category=None @category name is changed to category slug
+    @extend_schema(parameters=[SEARCH_PARAMETER, PAGE_PARAMETER], responses=ProductCategorySerializer(many=True))
+    @action(methods=["get"], detail=False, url_path="search")
+    def search(self, request):
         """
-        An endpoint to return products by category
+        An endpoint to search the active products through the full-text index, best matches first
         """
-        # serializer = ProductSerializer(self.queryset.filter(category__slug=slug), many=True) #category__name => Traversing between tables
-        serializer = ProductCategorySerializer(
-            self.queryset.filter(category__slug=slug)
-            .prefetch_related(Prefetch("product_line", queryset=ProductLine.objects.order_by("order"))) 
-            .prefetch_related(Prefetch("product_line__product_image", queryset=ProductImage.objects.filter(order=1))) #.order_by("order"))) , This can also work, Serializer will change a bit image = first_product_line["product_image"][0]
-            , #The queryset inside, extends the queryset outside
-            many=True) 
-        #category__name => Traversing between tables
+        query = request.query_params.get("q", "")
+        paginator = SearchPagination()
+        ids = paginator.paginate_search(lambda limit, offset: search_product_ids(query, limit, offset), request)
+        cards = ProductCard.objects.is_active().filter(pk__in=ids)
+        if settings.FAST_READ_SERIALIZERS:
+            rows = {card["pk"]: card for card in cards.values(*CARD_COLUMNS)}
+            data = serialize_product_cards([rows[pk] for pk in ids if pk in rows]) #in rank order
+        else:
+            rows = {card.pk: card for card in cards}
+            data = ProductCategorySerializer([rows[pk] for pk in ids if pk in rows], many=True).data
+        return paginator.get_paginated_response(data)
+
+    @extend_schema(parameters=[AUTOCOMPLETE_PARAMETER, LIMIT_PARAMETER], responses=OpenApiTypes.OBJECT)
+    @action(methods=["get"], detail=False, url_path="autocomplete")
+    def autocomplete(self, request):
+        """
+        An endpoint to complete the search box: active products whose name (any word of it), pid or sku
+        starts with the text typed so far, answered from memory
+        """
+        try:
+            limit = min(max(int(request.query_params.get("limit", 10)), 1), 50)
+        except ValueError:
+            limit = 10
+        completions = autocomplete_index.complete(request.query_params.get("q", ""), limit)
+        return Response({"results": [{"name": name, "slug": slug, "pid": pid} for _, name, slug, pid in completions]})
 
-        data = Response(serializer.data)
-        return data
+    @extend_schema(exclude=True)
+    @action(methods=["get"], detail=False, url_path="autocomplete-stats", permission_classes=[IsAdminUser])
+    def autocomplete_stats(self, request):
+        """Size of this worker's autocomplete index, to check its memory budget"""
+        return Response(autocomplete_index.stats())
 
+    @extend_schema(parameters=[OUTPUT_PARAMETER], responses={(200, "*/*"): str})
+    @action(methods=["get"], detail=False, url_path="export", permission_classes=[IsAdminUser])
+    def export(self, request):
+        """
+        The active catalogue, one row per active product line, streamed as JSONL or CSV
+        """
+        output = request.query_params.get("output", "jsonl")
+        if output not in EXPORT_FORMATS:
+            raise ValidationError({"output": [f"Choose one of {', '.join(sorted(EXPORT_FORMATS))}"]})
+        write_rows, content_type, extension = EXPORT_FORMATS[output]
+        response = StreamingHttpResponse(write_rows(export_rows(settings.EXPORT_CHUNK_SIZE)), content_type=content_type)
+        response["Content-Disposition"] = f'attachment; filename="catalogue.{extension}"'
+        return response
 
+    def reorder(self, request, service):
+        serializer = ReorderSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            service(serializer.validated_data["parent"], serializer.validated_data["order"])
+        except ModelValidationError as e:
+            raise ValidationError({"order": e.messages})
+        return Response(status=204)
 
+    @extend_schema(request=ReorderSerializer, responses={204: None})
+    @action(methods=["post"], detail=False, url_path="reorder-lines", permission_classes=[IsAdminUser])
+    def reorder_lines(self, request):
+        """
+        Sets the order of all the product lines of a product: {"parent": product id, "order": [product line ids]}
+        """
+        return self.reorder(request, reorder_product_lines)
 
+    @extend_schema(request=ReorderSerializer, responses={204: None})
+    @action(methods=["post"], detail=False, url_path="reorder-images", permission_classes=[IsAdminUser])
+    def reorder_images(self, request):
+        """
+        Sets the order of all the images of a product line: {"parent": product line id, "order": [image ids]}
+        """
+        return self.reorder(request, reorder_product_images)
+
+    @action(methods=["get"], detail=False, 
+            url_path=r"category/(?P<slug>[\w-]+)",) #when our url_path is dynamic
+    def list_product_by_category_slug(self, request, slug=None): #category=None @category name is changed to category slug
+        """
+        An endpoint to return products by category, including the products of its sub categories
+        """
+        # serializer = ProductSerializer(self.queryset.filter(category__slug=slug), many=True) #category__name => Traversing between tables
+        category = Category.objects.filter(slug=slug).first()
+        cards = ProductCard.objects.is_active() #Denormalized, one row per product, no prefetching
+        cards = cards.in_category_subtree(category) if category else cards.none()
+        paginator = ProductCardCursorPagination()
+        if settings.FAST_READ_SERIALIZERS:
+            page = paginator.paginate_queryset(cards.values(*CARD_COLUMNS), request, view=self)
+            return paginator.get_paginated_response(serialize_product_cards(page))
+        page = paginator.paginate_queryset(cards, request, view=self)
+        serializer = ProductCategorySerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @extend_schema(parameters=[FacetFilterSerializer], responses=ProductCategorySerializer(many=True))
+    @action(methods=["get"], detail=False, url_path=r"category/(?P<slug>[\w-]+)/facets")
+    def facets(self, request, slug=None):
+        """
+        An endpoint to filter the products of a category subtree on attribute values, price and stock,
+        with the number of matching products for every attribute value
+        """
+        params = FacetFilterSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        filters = dict(params.validated_data)
+        category = Category.objects.filter(slug=slug).first()
+        if category is None:
+            raise NotFound()
+        filters["groups"] = selected_values(filters.pop("values", []))
+        cards = facet_products(category, **filters)
+        paginator = ProductCardCursorPagination()
+        if settings.FAST_READ_SERIALIZERS:
+            data = serialize_product_cards(paginator.paginate_queryset(cards.values(*CARD_COLUMNS), request, view=self))
+        else:
+            data = ProductCategorySerializer(paginator.paginate_queryset(cards, request, view=self), many=True).data
+        response = paginator.get_paginated_response(data)
+        response.data["facets"] = facet_counts(category, **filters)
+        return response
@@ -30,6 +30,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "ecommerce.product.query_budget.QueryBudgetMiddleware", #first, to count the queries of the other middleware too
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -66,6 +67,39 @@ WSGI_APPLICATION = "ecommerce.wsgi.application"
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 # Sent to local.py
 
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# Local-memory by default, fine for one process. With several workers the cache must be shared by them
+# (redis, memcached), the autocomplete change log relies on it (check product.W001)
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "ecommerce",
+    }
+}
+
+# Seconds a product detail response stays cached, changes are invalidated by signals anyway
+PRODUCT_DETAIL_CACHE_TIMEOUT = 60 * 60
+# Seconds a product's cache version is kept, longer than the responses stored under it
+PRODUCT_VERSION_CACHE_TIMEOUT = 24 * 60 * 60
+
+# In-process cache of the category list pages: max pages kept and seconds before they expire
+CATEGORY_LIST_CACHE_SIZE = 128
+CATEGORY_LIST_CACHE_TTL = 60
+
+# Seconds the nested category tree stays cached, it is invalidated by signals anyway
+CATEGORY_TREE_CACHE_TIMEOUT = 60 * 60
+
+# In-memory autocomplete index (ecommerce/product/autocomplete.py): built when a worker starts,
+# seconds between two checks of the shared change log, seconds a change stays in the log,
+# seconds a missing change is waited for before the index is rebuilt (in a background thread)
+AUTOCOMPLETE_PRELOAD = True
+AUTOCOMPLETE_SYNC_INTERVAL = 1
+AUTOCOMPLETE_CHANGE_LOG_TIMEOUT = 60 * 60
+AUTOCOMPLETE_CHANGE_LOG_GRACE = 5
+AUTOCOMPLETE_BACKGROUND_REBUILD = True
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -115,9 +149,48 @@ REST_FRAMEWORK = {
     # "DEFAULT_AUTHENTICATION_CLASSES": [
     #     "dj_rest_auth.jwt_auth.JWTCookieAuthentication",
     # ],
-    # "DEFAULT_RENDERER_CLASSES": [
-    #     "rest_framework.renderers.JSONRenderer",
-    # ],
+    "DEFAULT_RENDERER_CLASSES": [
+        "ecommerce.product.renderers.FastJSONRenderer", #orjson when installed, Decimal as string
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+}
+
+# Cursor paginated listings, default page size and upper limit for the ?page_size= query parameter
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# Products read and rendered per chunk by /api/product/?stream=true
+STREAM_CHUNK_SIZE = 500
+
+# Upper limit for the slugs/pids of one /api/product/batch/ request
+PRODUCT_BATCH_MAX_SIZE = 500
+
+# Product lines read per chunk by the catalogue export (/api/product/export/, manage.py export_catalogue)
+EXPORT_CHUNK_SIZE = 2000
+
+# Serve product/category listings through the compiled fast path (ecommerce/product/fast_serializers.py)
+# instead of the DRF serializers, the JSON output is the same
+FAST_READ_SERIALIZERS = False
+
+# Query budgets per url name (ecommerce/product/query_budget.py): "queries" (most queries), "repeats" (most
+# runs of one statement, N+1) and "time" (most SQL ms). QUERY_BUDGET_MODE: None (off), "warn" or "raise"
+QUERY_BUDGET_MODE = "warn" if DEBUG else None
+QUERY_BUDGET_DEFAULT = {"queries": 20, "repeats": 3}
+QUERY_BUDGETS = {
+    "product-list": {"queries": 5},
+    "product-detail": {"queries": 6}, #ETag state, products, 4 prefetches
+    "product-variant": {"queries": 2},
+    "product-reorder-lines": {"queries": 40}, #admin, the read models of the product are refreshed
+    "product-reorder-images": {"queries": 40},
+    "product-list-product-by-category-slug": {"queries": 2},
+    "product-facets": {"queries": 8}, #2 + one count per selected attribute
+    "product-search": {"queries": 2},
+    "product-autocomplete": {"queries": 2}, #the index is loaded on the first lookup
+    "category-list": {"queries": 2},
+    "category-tree": {"queries": 2},
+    "async-product-list": {"queries": 5},
+    "async-product-detail": {"queries": 6},
+    "async-product-category": {"queries": 2},
 }
 
 # Additional Meta data
@@ -1,3 +1,5 @@
+import os
+
 from .base import *
 
 
@@ -6,4 +8,16 @@ DATABASES = {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
     }
-}
\ No newline at end of file
+}
+
+# A local PostgreSQL (e.g. docker run -e POSTGRES_PASSWORD=... -p 5432:5432 postgres) instead of SQLite,
+# when POSTGRES_DB is set in the environment/.env. The concurrency tests run against it as well
+if os.environ.get("POSTGRES_DB"):
+    DATABASES["default"] = {
+        "ENGINE": "django.db.backends.postgresql",
+        "NAME": os.environ["POSTGRES_DB"],
+        "USER": os.environ.get("POSTGRES_USER", "postgres"),
+        "PASSWORD": os.environ.get("POSTGRES_PASSWORD", ""),
+        "HOST": os.environ.get("POSTGRES_HOST", "localhost"),
+        "PORT": os.environ.get("POSTGRES_PORT", "5432"),
+    }
@@ -1,3 +1,12 @@
+import os
+
 from .base import *
 
-ALLOWED_HOSTS = ['*']
\ No newline at end of file
+ALLOWED_HOSTS = ['*']
+
+# A cache shared by the workers, e.g. REDIS_URL=redis://localhost:6379/0 (needs the redis package)
+if os.environ.get("REDIS_URL"):
+    CACHES["default"] = {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.environ["REDIS_URL"],
+    }
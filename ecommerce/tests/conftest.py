@@ -1,5 +1,10 @@
 # The conftest file is read first, before the tests starts
+from contextlib import contextmanager
+
 import pytest
+from django.core.cache import cache
+from ecommerce.product.cache import category_list_cache
+from ecommerce.product.query_budget import QueryRecorder, get_budget
 from pytest_factoryboy import register
 from rest_framework.test import APIClient
 
@@ -25,5 +30,47 @@ def api_client():
     return APIClient
 
 
+@pytest.fixture
+def full_product(product_factory, product_line_factory, product_image_factory, attribute_value_factory):
+    """full_product(**product fields): a product with 2 product lines, each with an image and a specification"""
+    def make(**kwargs):
+        product = product_factory(attribute_value=(attribute_value_factory(), ), **kwargs)
+        for _ in range(2):
+            line = product_line_factory(product=product, attribute_value=(attribute_value_factory(), ))
+            product_image_factory(product_line=line)
+        return product
+    return make
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    """Cached responses must not leak from one test into another"""
+    cache.clear()
+    category_list_cache.clear()
+    yield
+    cache.clear()
+    category_list_cache.clear()
+
+
 
 
+
+
+@pytest.fixture(autouse=True)
+def query_budget_mode(settings):
+    """Every request made by a test fails when it is over its query budget"""
+    settings.QUERY_BUDGET_MODE = "raise"
+
+
+@pytest.fixture
+def query_budget():
+    """with query_budget("product-list") as recorder: ... fails the test when the queries of the block are over
+    the budget of that url name (settings.QUERY_BUDGETS), keyword arguments override the budget"""
+    @contextmanager
+    def check(name, **budget):
+        with QueryRecorder() as recorder:
+            yield recorder
+        errors = recorder.over_budget({**get_budget(name), **budget})
+        assert not errors, f"{name} is over its query budget: {'; '.join(errors)}\n" + "\n".join(
+            f"{runs}x {sql}" for sql, runs in recorder.repeats().items())
+    return check
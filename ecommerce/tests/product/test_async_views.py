@@ -0,0 +1,62 @@
+import pytest
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from .test_fast_serializers import catalogue # noqa: F401 #fixture
+
+pytestmark = pytest.mark.django_db
+
+
+def request(async_client, url, method="get", **headers):
+    """Runs an AsyncClient request from a sync test, on this thread's database connection"""
+    async def send():
+        return await getattr(async_client, method)(url, **headers)
+    return async_to_sync(send)()
+
+
+def get_both(api_client, async_client, url):
+    """The sync (DRF) and the async response to the same request, the detail cache is cleared in between"""
+    cache.clear()
+    sync = api_client().get(url)
+    cache.clear()
+    return sync, request(async_client, url.replace("/api/", "/api/async/"))
+
+
+class TestAsyncViews:
+
+    @pytest.mark.parametrize("url", ["/api/product/", "/api/product/?page_size=1", "/api/product/tv-0/",
+                                     "/api/product/category/tvs/?page_size=2", "/api/product/category/missing/"])
+    def test_identical(self, api_client, async_client, catalogue, url):
+        sync, response = get_both(api_client, async_client, url)
+        assert response.status_code == 200
+        assert response.content == sync.content.replace(b"/api/product/", b"/api/async/product/")
+
+    def test_next_page(self, api_client, async_client, catalogue):
+        first = request(async_client, "/api/async/product/?page_size=2").json()
+        second = request(async_client, first["next"]).json()
+        assert [product["slug"] for product in first["results"] + second["results"]] == \
+            [product["slug"] for product in api_client().get("/api/product/").json()["results"]]
+
+    def test_invalid_cursor(self, async_client, catalogue):
+        response = request(async_client, "/api/async/product/?cursor=x")
+        assert response.status_code == 404
+        assert response.json() == {"detail": "Invalid cursor"}
+
+    def test_get_only(self, async_client, catalogue):
+        assert request(async_client, "/api/async/product/", method="post").status_code == 405
+
+    def test_detail_etag(self, async_client, catalogue):
+        response = request(async_client, "/api/async/product/tv-0/")
+        etag = response.headers["ETag"]
+        again = request(async_client, "/api/async/product/tv-0/", **{"If-None-Match": etag})
+        assert again.status_code == 304
+
+    def test_detail_query_count(self, async_client, catalogue):
+        with CaptureQueriesContext(connection) as queries:
+            request(async_client, "/api/async/product/tv-0/")
+        assert len(queries) == 6 #ETag state, product rows, 4 related queries
+        with CaptureQueriesContext(connection) as queries:
+            request(async_client, "/api/async/product/tv-0/")
+        assert len(queries) == 1 #ETag state, the payload comes from the cache
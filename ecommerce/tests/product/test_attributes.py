@@ -0,0 +1,121 @@
+import pytest
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from ecommerce.product.attributes import assign_product_attribute_values, assign_product_line_attribute_values
+from ecommerce.product.models import ProductAttributeValue, ProductLineAttributeValue
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def values(attribute_factory, attribute_value_factory):
+    """make(n): one value for each of n new attributes"""
+    def make(count):
+        return [attribute_value_factory(attribute=attribute_factory(name=f"attr-{i}")) for i in range(count)]
+    return make
+
+
+class TestAssignAttributeValues:
+
+    def test_query_count_does_not_grow_with_values(self, product_line_factory, values):
+        def queries(count):
+            line = product_line_factory()
+            batch = values(count)
+            with CaptureQueriesContext(connection) as ctx:
+                assert assign_product_line_attribute_values(line.pk, batch) == count
+            assert line.attribute_value.count() == count
+            return len(ctx.captured_queries)
+
+        assert queries(2) == queries(20)
+
+    def test_attribute_copied(self, product_factory, values):
+        product = product_factory()
+        value, = values(1)
+        assign_product_attribute_values(product.pk, [value.pk])
+        assert ProductAttributeValue.objects.get(product=product).attribute_id == value.attribute_id
+
+    def test_already_assigned_values_are_skipped(self, product_line_factory, values):
+        line = product_line_factory()
+        batch = values(3)
+        assign_product_line_attribute_values(line.pk, batch[:2])
+        assert assign_product_line_attribute_values(line.pk, batch) == 1
+
+    def test_two_values_of_one_attribute(self, product_line_factory, attribute_value_factory, attribute_factory):
+        attribute = attribute_factory()
+        red, blue = attribute_value_factory(attribute=attribute), attribute_value_factory(attribute=attribute)
+        line = product_line_factory()
+        with pytest.raises(ValidationError):
+            assign_product_line_attribute_values(line.pk, [red, blue])
+        assign_product_line_attribute_values(line.pk, [red])
+        with pytest.raises(ValidationError):
+            assign_product_line_attribute_values(line.pk, [blue]) #the line already has a colour
+        assert list(line.attribute_value.all()) == [red]
+
+    def test_unknown_value(self, product_factory):
+        with pytest.raises(ValidationError):
+            assign_product_attribute_values(product_factory().pk, [999])
+
+
+class TestAttributeConstraint:
+
+    def test_database_rejects_second_value(self, product_line_factory, attribute_value_factory):
+        line = product_line_factory()
+        first = attribute_value_factory()
+        second = attribute_value_factory(attribute=first.attribute)
+        ProductLineAttributeValue.objects.create(product_line=line, attribute_value=first)
+        with pytest.raises(IntegrityError), transaction.atomic():
+            ProductLineAttributeValue.objects.bulk_create([ProductLineAttributeValue(
+                product_line=line, attribute_value=second, attribute=first.attribute)])
+
+    def test_m2m_add_fills_attribute(self, product_factory, attribute_value_factory):
+        product = product_factory()
+        value = attribute_value_factory()
+        product.attribute_value.add(value)
+        assert ProductAttributeValue.objects.get(product=product).attribute_id == value.attribute_id
+
+    def test_m2m_add_second_value_rejected(self, product_line_factory, attribute_value_factory):
+        line = product_line_factory()
+        first = attribute_value_factory()
+        line.attribute_value.add(first)
+        with pytest.raises(ValidationError), transaction.atomic():
+            line.attribute_value.add(attribute_value_factory(attribute=first.attribute))
+        assert list(line.attribute_value.all()) == [first]
+
+    def test_m2m_add_rejected_before_writing(self, product_factory, attribute_value_factory):
+        product = product_factory()
+        first = attribute_value_factory()
+        second = attribute_value_factory(attribute=first.attribute)
+        with CaptureQueriesContext(connection) as ctx, pytest.raises(ValidationError), transaction.atomic():
+            product.attribute_value.add(first, second)
+        assert not [query for query in ctx.captured_queries if query["sql"].startswith("INSERT")]
+        assert not ProductAttributeValue.objects.exists()
+
+    def test_reverse_m2m_add_second_value_rejected(self, product_line_factory, attribute_value_factory):
+        line = product_line_factory()
+        first = attribute_value_factory()
+        line.attribute_value.add(first)
+        with pytest.raises(ValidationError), transaction.atomic():
+            attribute_value_factory(attribute=first.attribute).product_line_attribute_value.add(line)
+        assert list(line.attribute_value.all()) == [first]
+
+    def test_bulk_create_fills_attribute(self, product_factory, attribute_value_factory):
+        product = product_factory()
+        value = attribute_value_factory()
+        ProductAttributeValue.objects.bulk_create([ProductAttributeValue(product=product, attribute_value=value)])
+        assert ProductAttributeValue.objects.get(product=product).attribute_id == value.attribute_id
+
+    def test_reverse_m2m_add(self, product_line_factory, attribute_value_factory):
+        value = attribute_value_factory()
+        line = product_line_factory()
+        value.product_line_attribute_value.add(line)
+        assert ProductLineAttributeValue.objects.get(product_line=line).attribute_id == value.attribute_id
+
+    def test_value_moved_to_other_attribute(self, product_factory, attribute_value_factory, attribute_factory):
+        product = product_factory()
+        value = attribute_value_factory()
+        product.attribute_value.add(value)
+        value.attribute = attribute_factory(name="other")
+        value.save()
+        assert ProductAttributeValue.objects.get(product=product).attribute_id == value.attribute_id
@@ -0,0 +1,196 @@
+import json
+import threading
+
+import pytest
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from ecommerce.product.autocomplete import PrefixIndex, autocomplete_index, check_shared_cache, product_keys
+from ecommerce.product.models import ProductLine
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture(autouse=True)
+def fresh_index(settings):
+    """Every test starts with an index that isn't loaded yet and syncs on every lookup,
+    a gap rebuilds it right away in the test's thread (its connection sees the test's rows)"""
+    settings.AUTOCOMPLETE_SYNC_INTERVAL = 0
+    settings.AUTOCOMPLETE_CHANGE_LOG_GRACE = 0
+    settings.AUTOCOMPLETE_BACKGROUND_REBUILD = False
+    autocomplete_index.generation = None
+    yield
+    autocomplete_index.generation = None
+
+
+@pytest.fixture
+def catalogue(product_factory, product_line_factory):
+    tv = product_factory(name="Samsung OLED TV", slug="samsung-oled", pid="TV001")
+    product_line_factory(product=tv, sku="QE55S90C")
+    phone = product_factory(name="Samsung Galaxy phone", slug="galaxy", pid="PH002")
+    product_line_factory(product=phone, sku="SM-S911B")
+    return tv, phone
+
+
+def slugs(prefix, limit=10):
+    return [slug for _, _, slug, _ in autocomplete_index.complete(prefix, limit)]
+
+
+def test_product_keys():
+    assert product_keys("Samsung  OLED TV", "TV001", ["QE55"]) == ["oled tv", "qe55", "samsung oled tv", "tv", "tv001"]
+
+
+class TestPrefixIndex:
+
+    @pytest.mark.parametrize("prefix, expected", [("sam", ["galaxy", "samsung-oled"]), ("OLED t", ["samsung-oled"]),
+                                                  ("gal", ["galaxy"]), ("tv0", ["samsung-oled"]),
+                                                  ("qe55", ["samsung-oled"]), ("sm-s9", ["galaxy"]),
+                                                  ("amsung", []), ("", [])])
+    def test_prefixes(self, catalogue, prefix, expected):
+        assert sorted(slugs(prefix)) == expected
+
+    def test_one_result_per_product(self, catalogue):
+        assert slugs("t") == ["samsung-oled"] #"tv" and "tv001"
+
+    def test_limit(self, catalogue):
+        assert len(slugs("samsung", limit=1)) == 1
+
+    def test_lookups_skip_the_database(self, catalogue):
+        autocomplete_index.load()
+        cache.set("autocomplete:generation", autocomplete_index.generation) #nothing changed
+        with CaptureQueriesContext(connection) as queries:
+            slugs("sam")
+        assert len(queries) == 0
+
+    def test_inactive_products_and_lines(self, product_factory, product_line_factory):
+        product_factory(name="Hidden lamp", slug="hidden", is_active=False)
+        lamp = product_factory(name="Desk lamp", slug="lamp")
+        product_line_factory(product=lamp, sku="OLD-1", is_active=False)
+        assert slugs("hidden") == []
+        assert slugs("old-1") == []
+        assert slugs("desk") == ["lamp"]
+
+    def test_update(self):
+        index = PrefixIndex()
+        index.generation = 0 #loaded, nothing logged
+        index.update([1, 2], {1: ("Blue lamp", "blue", "P1", []), 2: ("Blue chair", "chair", "P2", [])})
+        index.update([1], {1: ("Red lamp", "red", "P1", [])})
+        assert [slug for _, _, slug, _ in index.complete("blue")] == ["chair"]
+        assert index.keys == sorted(index.keys)
+        index.update([2], {})
+        assert index.complete("blue") == []
+        assert index.stats()["products"] == 1
+
+
+class TestSync:
+
+    def test_saved_product(self, catalogue, django_capture_on_commit_callbacks):
+        tv, _ = catalogue
+        assert slugs("samsung oled") == ["samsung-oled"]
+        tv.name = "LG OLED TV"
+        with django_capture_on_commit_callbacks(execute=True):
+            tv.save()
+        assert slugs("samsung oled") == []
+        assert slugs("lg") == ["samsung-oled"]
+
+    def test_new_line(self, catalogue, product_line_factory, django_capture_on_commit_callbacks):
+        slugs("sam")
+        with django_capture_on_commit_callbacks(execute=True):
+            product_line_factory(product=catalogue[1], sku="SM-S918B")
+        assert slugs("sm-s918") == ["galaxy"]
+
+    @pytest.mark.parametrize("change", ["deactivate", "delete"])
+    def test_removed_product(self, catalogue, django_capture_on_commit_callbacks, change):
+        _, phone = catalogue
+        slugs("sam")
+        with django_capture_on_commit_callbacks(execute=True):
+            if change == "delete":
+                ProductLine.objects.filter(product=phone).delete() #protected
+                phone.delete()
+            else:
+                phone.is_active = False
+                phone.save()
+        assert slugs("sam") == ["samsung-oled"]
+
+    def test_gap_in_the_log_reloads(self, catalogue, django_capture_on_commit_callbacks):
+        tv, _ = catalogue
+        slugs("sam")
+        tv.name = "LG OLED TV"
+        with django_capture_on_commit_callbacks(execute=True):
+            tv.save()
+        cache.delete(f"autocomplete:changes:{autocomplete_index.generation + 1}") #expired
+        assert slugs("lg") == ["samsung-oled"]
+
+    def test_change_not_logged_yet(self, settings, catalogue, monkeypatch):
+        """A lookup between the writer's incr and set waits for the ids instead of rebuilding"""
+        settings.AUTOCOMPLETE_CHANGE_LOG_GRACE = 60
+        tv, _ = catalogue
+        slugs("sam")
+        monkeypatch.setattr(autocomplete_index, "load", lambda: pytest.fail("rebuilt"))
+        generation = autocomplete_index.generation + 1
+        cache.set("autocomplete:generation", generation) #the writer's incr
+        assert slugs("sam") == ["galaxy", "samsung-oled"]
+        tv.name = "LG OLED TV"
+        tv.save()
+        cache.set(f"autocomplete:changes:{generation}", [tv.pk]) #the writer's set
+        assert slugs("lg") == ["samsung-oled"]
+        assert autocomplete_index.generation == generation
+
+    def test_background_rebuild_serves_the_old_entries(self, settings, catalogue, monkeypatch):
+        settings.AUTOCOMPLETE_BACKGROUND_REBUILD = True
+        slugs("sam")
+        started, release = threading.Event(), threading.Event()
+
+        def load():
+            started.set()
+            release.wait(5)
+
+        monkeypatch.setattr(autocomplete_index, "load", load)
+        cache.set("autocomplete:generation", autocomplete_index.generation + 1) #its ids are gone
+        assert slugs("sam") == ["galaxy", "samsung-oled"]
+        assert started.wait(5) and autocomplete_index.stats()["rebuilding"]
+        release.set()
+        autocomplete_index._rebuild.join()
+
+    def test_sync_interval(self, settings, catalogue, django_capture_on_commit_callbacks):
+        tv, _ = catalogue
+        slugs("sam")
+        settings.AUTOCOMPLETE_SYNC_INTERVAL = 60
+        tv.name = "LG OLED TV"
+        with django_capture_on_commit_callbacks(execute=True):
+            tv.save()
+        assert slugs("lg") == [] #not checked yet
+
+
+@pytest.mark.parametrize("debug, backend, warned", [
+    (False, "django.core.cache.backends.locmem.LocMemCache", True),
+    (True, "django.core.cache.backends.locmem.LocMemCache", False),
+    (False, "django.core.cache.backends.filebased.FileBasedCache", False),
+])
+def test_check_shared_cache(settings, tmp_path, debug, backend, warned):
+    settings.DEBUG = debug
+    settings.CACHES = {"default": {"BACKEND": backend, "LOCATION": str(tmp_path)}}
+    assert [warning.id for warning in check_shared_cache()] == (["product.W001"] if warned else [])
+
+
+class TestEndpoints:
+
+    def test_autocomplete(self, api_client, catalogue):
+        response = api_client().get("/api/product/autocomplete/", {"q": "samsung o", "limit": "x"})
+        assert response.status_code == 200
+        assert json.loads(response.content) == {
+            "results": [{"name": "Samsung OLED TV", "slug": "samsung-oled", "pid": "TV001"}]}
+
+    def test_limit(self, api_client, catalogue):
+        response = api_client().get("/api/product/autocomplete/", {"q": "samsung", "limit": 1})
+        assert len(json.loads(response.content)["results"]) == 1
+
+    def test_stats_admin_only(self, api_client, admin_user, catalogue):
+        assert api_client().get("/api/product/autocomplete-stats/").status_code in (401, 403)
+        client = api_client()
+        client.force_authenticate(admin_user)
+        slugs("sam")
+        stats = json.loads(client.get("/api/product/autocomplete-stats/").content)
+        assert stats["products"] == 2
+        assert stats["entries"] == 10
@@ -0,0 +1,67 @@
+import json
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+pytestmark = pytest.mark.django_db
+
+endpoint = "/api/product/batch/"
+
+
+def batch(api_client, body, query=""):
+    response = api_client().post(endpoint + query, body, format="json")
+    return response.status_code, json.loads(response.content)
+
+
+class TestProductBatch:
+
+    @pytest.mark.parametrize("fast", [False, True])
+    def test_same_payload_as_retrieve(self, api_client, settings, full_product, fast):
+        settings.FAST_READ_SERIALIZERS = fast
+        for i in range(2):
+            full_product(slug=f"product-{i}", pid=f"P{i}")
+        status, data = batch(api_client, {"slugs": ["product-1", "product-0"]})
+        assert status == 200
+        assert [item["slug"] for item in data["results"]] == ["product-1", "product-0"]
+        for item in data["results"]:
+            assert item["products"] == json.loads(api_client().get(f"/api/product/{item['slug']}/").content)
+
+    def test_pids_order_and_not_found(self, api_client, full_product, product_factory):
+        for i in range(2):
+            full_product(slug=f"product-{i}", pid=f"P{i}")
+        product_factory(slug="hidden", pid="HIDDEN", is_active=False)
+        status, data = batch(api_client, {"pids": ["P1", "missing", "HIDDEN", "P0", "P1"]})
+        assert status == 200
+        assert [(item["pid"], "products" in item) for item in data["results"]] == [
+            ("P1", True), ("missing", False), ("HIDDEN", False), ("P0", True), ("P1", True)]
+        assert data["results"][1] == {"pid": "missing", "detail": "Not found."}
+        assert data["results"][0]["products"][0]["slug"] == "product-1"
+
+    def test_sparse_fields(self, api_client, full_product):
+        full_product(slug="product-0", pid="P0")
+        _, data = batch(api_client, {"slugs": ["product-0"]}, "?fields=name")
+        assert list(data["results"][0]["products"][0]) == ["name"]
+
+    @pytest.mark.parametrize("fast", [False, True])
+    def test_query_count_does_not_grow_with_items(self, api_client, settings, full_product, fast):
+        settings.FAST_READ_SERIALIZERS = fast
+        for i in range(6):
+            full_product(slug=f"product-{i}", pid=f"P{i}")
+        counts = []
+        for slugs in (["product-0"], [f"product-{i}" for i in range(6)]):
+            with CaptureQueriesContext(connection) as queries:
+                status, _ = batch(api_client, {"slugs": slugs})
+            assert status == 200
+            counts.append(len(queries))
+        assert counts[0] == counts[1]
+
+    @pytest.mark.parametrize("body", [{}, {"slugs": ["a"], "pids": ["b"]}, {"slugs": []}, {"slugs": "a"}])
+    def test_invalid_body(self, api_client, body):
+        assert batch(api_client, body)[0] == 400
+
+    def test_max_size(self, api_client, settings):
+        settings.PRODUCT_BATCH_MAX_SIZE = 2
+        status, data = batch(api_client, {"slugs": ["a", "b", "c"]})
+        assert status == 400
+        assert data == {"slugs": ["At most 2 items."]}
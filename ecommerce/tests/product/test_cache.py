@@ -0,0 +1,205 @@
+import json
+import time
+from datetime import timedelta
+from unittest import mock
+
+import pytest
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from ecommerce.product.cache import TTLCache, category_list_cache, get_product_detail, get_product_version
+from ecommerce.product.models import Category
+from ecommerce.product.views import CategoryView, ProductView
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture(params=["locmem", "file"])
+def cache_backend(request, settings, tmp_path):
+    """Runs every test against the local-memory and the file based cache backends"""
+    if request.param == "file":
+        settings.CACHES = {"default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": str(tmp_path),
+        }}
+    cache.clear()
+    return request.param
+
+
+class TestProductDetailCache:
+
+    endpoint = "/api/product/"
+
+    def get(self, api_client, slug):
+        with CaptureQueriesContext(connection) as ctx:
+            response = api_client().get(f"{self.endpoint}{slug}/")
+        assert response.status_code == 200
+        return json.loads(response.content), len(ctx.captured_queries)
+
+    def test_second_hit_served_from_cache(self, cache_backend, api_client, product_factory, product_line_factory):
+        product_line_factory(product=product_factory(slug="tv"))
+        first, first_queries = self.get(api_client, "tv")
+        second, second_queries = self.get(api_client, "tv")
+        assert first == second
+        assert first_queries > 1
+        assert second_queries == 1 #only the ETag/Last-Modified lookup
+
+    def test_product_save_invalidates(self, cache_backend, api_client, product_factory):
+        obj = product_factory(slug="tv", name="old")
+        self.get(api_client, "tv")
+        obj.name = "new"
+        obj.save()
+        data, _ = self.get(api_client, "tv")
+        assert data[0]["name"] == "new"
+
+    def test_slug_change_invalidates_old_slug(self, cache_backend, api_client, product_factory):
+        obj = product_factory(slug="tv")
+        self.get(api_client, "tv")
+        obj.slug = "television"
+        obj.save()
+        data, _ = self.get(api_client, "tv")
+        assert data == []
+
+    def test_product_line_save_invalidates(self, cache_backend, api_client, product_factory, product_line_factory):
+        line = product_line_factory(product=product_factory(slug="tv"), stock_qty=1)
+        self.get(api_client, "tv")
+        line.stock_qty = 5
+        line.save()
+        data, _ = self.get(api_client, "tv")
+        assert data[0]["product_line"][0]["stock_qty"] == 5
+
+    def test_product_image_delete_invalidates(self, cache_backend, api_client, product_factory,
+                                              product_line_factory, product_image_factory):
+        line = product_line_factory(product=product_factory(slug="tv"))
+        image = product_image_factory(product_line=line)
+        self.get(api_client, "tv")
+        image.delete()
+        data, _ = self.get(api_client, "tv")
+        assert data[0]["product_line"][0]["product_image"] == []
+
+    def test_m2m_add_invalidates(self, cache_backend, api_client, product_factory,
+                                 product_line_factory, attribute_value_factory):
+        product = product_factory(slug="tv")
+        line = product_line_factory(product=product)
+        self.get(api_client, "tv")
+        product.attribute_value.add(attribute_value_factory(attribute_value="OLED"))
+        line.attribute_value.add(attribute_value_factory(attribute_value="55"))
+        data, _ = self.get(api_client, "tv")
+        assert list(data[0]["attribute"].values()) == ["OLED"]
+        assert list(data[0]["product_line"][0]["specification"].values()) == ["55"]
+
+    def test_product_line_attribute_value_save_invalidates(
+            self, cache_backend, api_client, product_factory, product_line_factory,
+            attribute_value_factory, product_line_attribute_value_factory):
+        line = product_line_factory(product=product_factory(slug="tv"))
+        self.get(api_client, "tv")
+        product_line_attribute_value_factory(product_line=line, attribute_value=attribute_value_factory(attribute_value="55"))
+        data, _ = self.get(api_client, "tv")
+        assert list(data[0]["product_line"][0]["specification"].values()) == ["55"]
+
+    def test_attribute_rename_invalidates(self, cache_backend, api_client, product_factory, attribute_value_factory):
+        value = attribute_value_factory(attribute_value="OLED")
+        product_factory(slug="tv", attribute_value=(value, ))
+        self.get(api_client, "tv")
+        value.attribute.name = "panel"
+        value.attribute.save()
+        data, _ = self.get(api_client, "tv")
+        assert data[0]["attribute"] == {"panel": "OLED"}
+
+    def test_other_products_stay_cached(self, cache_backend, api_client, product_factory):
+        product_factory(slug="tv")
+        radio = product_factory(slug="radio")
+        self.get(api_client, "tv")
+        radio.save()
+        _, queries = self.get(api_client, "tv")
+        assert queries == 1
+
+    def test_unknown_slug_leaves_nothing_cached(self, cache_backend, api_client):
+        data, _ = self.get(api_client, "missing")
+        assert data == []
+        assert get_product_version("missing", create=False) is None #no version key
+        assert get_product_detail("missing") is None
+
+    def test_versions_expire(self, cache_backend, settings, api_client, product_factory):
+        product_factory(slug="tv")
+        self.get(api_client, "tv")
+        assert get_product_version("tv", create=False) is not None
+        later = time.time() + settings.PRODUCT_VERSION_CACHE_TIMEOUT + 1
+        with mock.patch("time.time", return_value=later):
+            assert get_product_version("tv", create=False) is None
+
+
+class TestTTLCache:
+
+    def test_hit_and_miss_counters(self):
+        obj = TTLCache(maxsize=2, ttl=60)
+        assert obj.get("a") is None
+        obj.set("a", 1)
+        assert obj.get("a") == 1
+        assert obj.stats()["hits"] == 1 and obj.stats()["misses"] == 1
+
+    def test_entries_expire(self):
+        obj = TTLCache(maxsize=2, ttl=10)
+        with mock.patch("ecommerce.product.cache.time.monotonic", return_value=100):
+            obj.set("a", 1)
+        with mock.patch("ecommerce.product.cache.time.monotonic", return_value=111):
+            assert obj.get("a") is None
+        assert obj.stats()["size"] == 0
+
+    def test_least_recently_used_evicted(self):
+        obj = TTLCache(maxsize=2, ttl=60)
+        obj.set("a", 1)
+        obj.set("b", 2)
+        obj.get("a")
+        obj.set("c", 3)
+        assert obj.get("b") is None
+        assert obj.get("a") == 1 and obj.get("c") == 3
+
+
+class TestCategoryListCache:
+
+    endpoint = "/api/category/"
+
+    def test_class_level_querysets_are_never_evaluated(self, api_client, category_factory, product_factory):
+        category_factory(is_active=True)
+        product_factory()
+        api_client().get(self.endpoint)
+        api_client().get("/api/product/")
+        assert CategoryView.queryset._result_cache is None
+        assert ProductView.queryset._result_cache is None
+
+    def test_second_request_served_from_cache(self, api_client, category_factory):
+        category_factory.create_batch(2, is_active=True)
+        first = json.loads(api_client().get(self.endpoint).content)
+        with CaptureQueriesContext(connection) as ctx:
+            second = json.loads(api_client().get(self.endpoint).content)
+        assert first == second
+        assert len(ctx.captured_queries) == 1 #only the ETag/Last-Modified lookup
+        assert category_list_cache.stats()["hits"] >= 1
+
+    def test_category_save_clears_cache(self, api_client, category_factory):
+        obj = category_factory(is_active=True, name="old")
+        api_client().get(self.endpoint)
+        obj.name = "new"
+        obj.save()
+        data = json.loads(api_client().get(self.endpoint).content)
+        assert data["results"][0]["category"] == "new"
+
+    def test_write_from_another_process(self, api_client, category_factory):
+        """A write that doesn't clear this process' cache (another worker) still gets the new body and ETag"""
+        obj = category_factory(is_active=True, name="old")
+        first = api_client().get(self.endpoint)
+        Category.objects.filter(pk=obj.pk).update(name="new", updated_at=obj.updated_at + timedelta(seconds=1))
+        second = api_client().get(self.endpoint, HTTP_IF_NONE_MATCH=first["ETag"])
+        assert second.status_code == 200
+        assert json.loads(second.content)["results"][0]["category"] == "new"
+        assert second["ETag"] != first["ETag"]
+
+    def test_cache_stats_admin_only(self, api_client, admin_user):
+        assert api_client().get(f"{self.endpoint}cache-stats/").status_code in (401, 403)
+        client = api_client()
+        client.force_authenticate(admin_user)
+        response = client.get(f"{self.endpoint}cache-stats/")
+        assert response.status_code == 200
+        assert set(json.loads(response.content)) >= {"hits", "misses", "size", "maxsize", "ttl"}
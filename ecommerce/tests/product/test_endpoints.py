@@ -1,5 +1,7 @@
 import pytest
 import json
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from ecommerce.product.models import Category
 
 pytestmark = pytest.mark.django_db #Available globally, no need to design each funtion,
@@ -15,7 +17,7 @@ class TestCategoryEndpoints:
         response = api_client().get(self.endpoint)
         assert response.status_code == 200
         # print(json.loads(response.content))
-        assert len(json.loads(response.content)) == 4
+        assert len(json.loads(response.content)["results"]) == 4
 
 
 class TestProductEndpoints:
@@ -34,8 +36,284 @@ class TestProductEndpoints:
         product_factory(category=obj)
         response = api_client().get(f"{self.endpoint}category/{obj.slug}/")
         assert response.status_code == 200
-        assert len(json.loads(response.content)) == 1
+        assert len(json.loads(response.content)["results"]) == 1
 
+    def test_products_by_category_slug_output(self, product_factory, product_line_factory,
+                                              product_image_factory, api_client, category_factory):
+        obj = category_factory(slug="tvs")
+        line = product_line_factory(product=product_factory(category=obj, pid="tv1"), price="10.00")
+        product_image_factory(product_line=line, alternative_text="front", url="tv.jpg")
+        product_factory(category=obj, pid="tv2") #no product line
+        response = api_client().get(f"{self.endpoint}category/tvs/")
+        results = {item["pid"]: item for item in json.loads(response.content)["results"]}
+        assert results["tv1"]["price"] == "10.00"
+        assert results["tv1"]["image"] == [{"alternative_text": "front", "url": "/tv.jpg", "order": 1}]
+        assert "price" not in results["tv2"] and "image" not in results["tv2"]
 
+    def test_products_by_category_slug_query_count(self, product_factory, product_line_factory,
+                                                   api_client, category_factory):
+        obj = category_factory(slug="tvs")
+        for _ in range(5):
+            product_line_factory(product=product_factory(category=obj))
+        with CaptureQueriesContext(connection) as ctx:
+            api_client().get(f"{self.endpoint}category/tvs/")
+        assert len(ctx.captured_queries) == 2 #the category and one page of product cards
 
-        
\ No newline at end of file
+    def test_products_by_category_slug_include_sub_categories(self, product_factory, api_client, category_factory):
+        electronics = category_factory(slug="electronics")
+        tvs = category_factory(slug="tvs", parent=electronics)
+        oled = category_factory(slug="oled", parent=tvs)
+        other = category_factory(slug="garden")
+        product_factory(category=electronics)
+        product_factory(category=tvs)
+        product_factory(category=oled)
+        product_factory(category=other)
+
+        def count(slug):
+            response = api_client().get(f"{self.endpoint}category/{slug}/")
+            return len(json.loads(response.content)["results"])
+
+        assert count("electronics") == 3
+        assert count("tvs") == 2
+        assert count("oled") == 1
+        assert count("garden") == 1
+        assert count("missing") == 0
+
+
+class TestProductListQueries:
+
+    endpoint = "/api/product/"
+
+    def count_queries(self, api_client):
+        with CaptureQueriesContext(connection) as ctx:
+            response = api_client().get(self.endpoint)
+        assert response.status_code == 200
+        return len(ctx.captured_queries), json.loads(response.content)["results"]
+
+    def test_list_query_count_does_not_grow_with_rows(self, api_client, full_product):
+        full_product()
+        small_count, small_data = self.count_queries(api_client)
+
+        for _ in range(5):
+            full_product()
+        large_count, large_data = self.count_queries(api_client)
+
+        assert len(small_data) == 1 and len(large_data) == 6
+        assert small_count == large_count
+
+    def test_list_output_shape(self, api_client, full_product):
+        full_product()
+        _, data = self.count_queries(api_client)
+        product = data[0]
+        assert len(product["product_line"]) == 2
+        assert len(product["product_line"][0]["product_image"]) == 1
+        assert product["product_line"][0]["specification"] == {"attribute name test": "attr value test"}
+        assert product["attribute"] == {"attribute name test": "attr value test"}
+
+
+class TestCursorPagination:
+
+    def walk_pages(self, api_client, url):
+        """Follows the next links, returns every page"""
+        pages = []
+        while url:
+            response = api_client().get(url)
+            assert response.status_code == 200
+            data = json.loads(response.content)
+            pages.append(data["results"])
+            url = data["next"]
+        return pages
+
+    def test_product_pages_cover_all_rows_once(self, api_client, product_factory):
+        product_factory.create_batch(7)
+        pages = self.walk_pages(api_client, "/api/product/?page_size=3")
+        assert [len(page) for page in pages] == [3, 3, 1]
+        pids = [product["pid"] for page in pages for product in page]
+        assert len(set(pids)) == 7
+
+    def test_product_pages_are_newest_first(self, api_client, product_factory):
+        products = product_factory.create_batch(3)
+        pages = self.walk_pages(api_client, "/api/product/?page_size=2")
+        pids = [product["pid"] for page in pages for product in page]
+        assert pids == [obj.pid for obj in reversed(products)]
+
+    def test_category_pages_in_tree_order(self, api_client, category_factory):
+        root = category_factory(name="b_root", is_active=True)
+        category_factory(name="a_child", parent=root, is_active=True)
+        category_factory(name="a_root", is_active=True)
+        pages = self.walk_pages(api_client, "/api/category/?page_size=1")
+        assert [page[0]["category"] for page in pages] == ["a_root", "b_root", "a_child"] #roots sorted by name (order_insertion_by)
+
+    def test_insert_during_paging_does_not_shift_pages(self, api_client, product_factory):
+        product_factory.create_batch(4)
+        first = json.loads(api_client().get("/api/product/?page_size=2").content)
+        product_factory() #newer than everything already listed
+        second = json.loads(api_client().get(first["next"]).content)
+        seen = [p["pid"] for p in first["results"] + second["results"]]
+        assert len(set(seen)) == 4
+
+    def test_page_size_is_capped(self, api_client, product_factory, settings):
+        settings.MAX_PAGE_SIZE = 2
+        product_factory.create_batch(3)
+        response = api_client().get("/api/product/?page_size=50")
+        assert len(json.loads(response.content)["results"]) == 2
+
+    def test_invalid_cursor(self, api_client):
+        response = api_client().get("/api/product/?cursor=not-a-cursor")
+        assert response.status_code == 404
+
+    def test_deep_page_query_count_same_as_first(self, api_client, product_factory):
+        product_factory.create_batch(6)
+        first = json.loads(api_client().get("/api/product/?page_size=2").content)
+        second = json.loads(api_client().get(first["next"]).content)
+        with CaptureQueriesContext(connection) as first_ctx:
+            api_client().get("/api/product/?page_size=2")
+        with CaptureQueriesContext(connection) as deep_ctx:
+            api_client().get(second["next"])
+        assert len(first_ctx.captured_queries) == len(deep_ctx.captured_queries)
+
+
+class TestConditionalGet:
+
+    def test_product_detail_not_modified(self, api_client, product_factory):
+        product_factory(slug="tv")
+        response = api_client().get("/api/product/tv/")
+        etag = response["ETag"]
+        assert response.has_header("Last-Modified")
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = api_client().get("/api/product/tv/", HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+        assert len(ctx.captured_queries) == 1
+
+    def test_product_detail_etag_changes_with_related_objects(
+            self, api_client, product_factory, product_line_factory, product_image_factory):
+        line = product_line_factory(product=product_factory(slug="tv"))
+        etag = api_client().get("/api/product/tv/")["ETag"]
+        product_image_factory(product_line=line)
+        response = api_client().get("/api/product/tv/", HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response["ETag"] != etag
+
+    def test_product_detail_etag_changes_on_deactivate(self, api_client, product_factory):
+        obj = product_factory(slug="tv")
+        etag = api_client().get("/api/product/tv/")["ETag"]
+        obj.is_active = False
+        obj.save()
+        response = api_client().get("/api/product/tv/", HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+
+    def test_category_list_not_modified_until_changed(self, api_client, category_factory):
+        obj = category_factory(is_active=True)
+        etag = api_client().get("/api/category/")["ETag"]
+        assert api_client().get("/api/category/", HTTP_IF_NONE_MATCH=etag).status_code == 304
+        obj.name = "renamed"
+        obj.save()
+        assert api_client().get("/api/category/", HTTP_IF_NONE_MATCH=etag).status_code == 200
+
+    def test_category_list_etag_differs_per_page(self, api_client, category_factory):
+        category_factory.create_batch(3, is_active=True)
+        first = api_client().get("/api/category/?page_size=1")["ETag"]
+        second = api_client().get("/api/category/?page_size=2")["ETag"]
+        assert first != second
+
+
+class TestCategoryTree:
+
+    endpoint = "/api/category/tree/"
+
+    def test_nested_tree_with_counts_and_breadcrumbs(self, api_client, category_factory, product_factory):
+        electronics = category_factory(name="electronics", slug="electronics", is_active=True)
+        tvs = category_factory(name="tvs", slug="tvs", parent=electronics, is_active=True)
+        category_factory(name="radios", slug="radios", parent=electronics, is_active=True)
+        category_factory(name="garden", slug="garden", is_active=True)
+        product_factory(category=electronics)
+        product_factory.create_batch(2, category=tvs)
+        product_factory(category=tvs, is_active=False)
+
+        with CaptureQueriesContext(connection) as ctx:
+            tree = json.loads(api_client().get(self.endpoint).content)
+        assert len(ctx.captured_queries) == 2
+
+        assert [node["slug"] for node in tree] == ["electronics", "garden"]
+        electronics_node = tree[0]
+        assert electronics_node["product_count"] == 3
+        assert [node["slug"] for node in electronics_node["children"]] == ["radios", "tvs"]
+        tvs_node = electronics_node["children"][1]
+        assert tvs_node["product_count"] == 2
+        assert [crumb["slug"] for crumb in tvs_node["breadcrumbs"]] == ["electronics", "tvs"]
+
+    def test_inactive_subtree_left_out(self, api_client, category_factory):
+        root = category_factory(slug="root", is_active=True)
+        hidden = category_factory(slug="hidden", parent=root, is_active=False)
+        category_factory(slug="under-hidden", parent=hidden, is_active=True)
+        tree = json.loads(api_client().get(self.endpoint).content)
+        assert tree[0]["children"] == []
+
+    def test_tree_cached_and_invalidated(self, api_client, category_factory):
+        root = category_factory(slug="root", is_active=True)
+        api_client().get(self.endpoint)
+        with CaptureQueriesContext(connection) as ctx:
+            api_client().get(self.endpoint)
+        assert len(ctx.captured_queries) == 0
+
+        category_factory(slug="child", parent=root, is_active=True)
+        tree = json.loads(api_client().get(self.endpoint).content)
+        assert [node["slug"] for node in tree[0]["children"]] == ["child"]
+
+    @pytest.mark.parametrize("rebuild", ["rebuild", "partial_rebuild"])
+    def test_tree_rebuild_invalidates(self, api_client, category_factory, rebuild):
+        root = category_factory(slug="root", is_active=True)
+        first = category_factory(slug="first", parent=root, is_active=True)
+        category_factory(slug="second", parent=root, is_active=True)
+        api_client().get(self.endpoint)
+        Category.objects.filter(slug="second").update(parent=first) #no signals, the rebuild renumbers the tree
+        if rebuild == "rebuild":
+            Category.tree.rebuild()
+        else:
+            Category.tree.partial_rebuild(root.tree_id)
+        tree = json.loads(api_client().get(self.endpoint).content)
+        assert [node["slug"] for node in tree[0]["children"][0]["children"]] == ["second"]
+
+
+class TestSparseFields:
+    """Output keys, query count and payload size for each ?fields=/?expand= combination"""
+
+    endpoint = "/api/product/"
+
+    @pytest.fixture
+    def full_payload_size(self, api_client, full_product):
+        for _ in range(3):
+            full_product()
+        return len(api_client().get(self.endpoint).content)
+
+    @pytest.mark.parametrize("query, product_keys, line_keys, queries", [
+        ("fields=name,slug", {"name", "slug"}, None, 1),
+        ("fields=name,slug,product_line.price", {"name", "slug", "product_line"}, {"price"}, 2),
+        ("expand=product_line", {"name", "slug", "pid", "description", "product_line"},
+         {"price", "sku", "stock_qty", "order"}, 2),
+        ("fields=pid&expand=product_line.product_image", {"pid", "product_line"},
+         {"price", "sku", "stock_qty", "order", "product_image"}, 3),
+        ("fields=name,product_line.sku,product_line.specification", {"name", "product_line"},
+         {"sku", "specification"}, 3),
+        ("fields=name,attribute", {"name", "attribute"}, None, 2),
+        ("", {"name", "slug", "pid", "description", "product_line", "attribute"},
+         {"price", "sku", "stock_qty", "order", "product_image", "specification"}, 5),
+    ])
+    def test_combinations(self, api_client, full_payload_size, query, product_keys, line_keys, queries):
+        with CaptureQueriesContext(connection) as ctx:
+            response = api_client().get(f"{self.endpoint}?{query}")
+        results = json.loads(response.content)["results"]
+        assert set(results[0]) == product_keys
+        if line_keys is not None:
+            assert set(results[0]["product_line"][0]) == line_keys
+        assert len(ctx.captured_queries) == queries #unrequested relations are never loaded
+        if query:
+            assert len(response.content) < full_payload_size
+
+    def test_detail_sparse_fields_not_cached_as_full(self, api_client, product_factory, product_line_factory):
+        product_line_factory(product=product_factory(slug="tv"))
+        sparse = json.loads(api_client().get(f"{self.endpoint}tv/?fields=name").content)
+        full = json.loads(api_client().get(f"{self.endpoint}tv/").content)
+        assert set(sparse[0]) == {"name"}
+        assert "product_line" in full[0]
@@ -0,0 +1,85 @@
+import csv
+import io
+import json
+
+import pytest
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from ecommerce.product.export import EXPORT_COLUMNS, export_rows
+
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def catalogue(full_product):
+    """3 active products with 2 product lines each, and one inactive product"""
+    for i in range(3):
+        full_product(slug=f"p{i}")
+    full_product(slug="hidden", is_active=False)
+
+
+@pytest.fixture
+def admin_client(api_client):
+    client = api_client()
+    client.force_authenticate(User.objects.create_superuser("admin", "admin@example.com", "pass"))
+    return client
+
+
+class TestExportRows:
+
+    def test_one_row_per_active_line(self, catalogue):
+        rows = list(export_rows())
+        assert len(rows) == 6
+        assert {row["slug"] for row in rows} == {"p0", "p1", "p2"}
+        assert list(rows[0]) == EXPORT_COLUMNS
+        assert rows[0]["price"] == "10.00"
+        assert rows[0]["specification"] == {"attribute name test": "attr value test"}
+        assert rows[0]["images"] == ["/test.jpg"]
+
+    def test_queries_per_chunk_not_per_row(self, catalogue):
+        with CaptureQueriesContext(connection) as ctx:
+            list(export_rows(chunk_size=100))
+        one_chunk = len(ctx.captured_queries)
+        with CaptureQueriesContext(connection) as ctx:
+            list(export_rows(chunk_size=3))
+        assert one_chunk == 4 #product lines, images, specifications, product attributes
+        assert len(ctx.captured_queries) == one_chunk + 3 #one cursor, the 3 prefetches again for the second chunk
+
+
+class TestExportEndpoint:
+
+    endpoint = "/api/product/export/"
+
+    def test_admin_only(self, api_client):
+        assert api_client().get(self.endpoint).status_code == 403
+
+    def test_jsonl(self, admin_client, catalogue):
+        response = admin_client.get(self.endpoint)
+        assert response.streaming and response["Content-Type"] == "application/x-ndjson"
+        lines = b"".join(response.streaming_content).splitlines()
+        assert [json.loads(line) for line in lines] == json.loads(json.dumps(list(export_rows())))
+
+    def test_csv(self, admin_client, catalogue):
+        response = admin_client.get(f"{self.endpoint}?output=csv")
+        assert response["Content-Disposition"] == 'attachment; filename="catalogue.csv"'
+        rows = list(csv.DictReader(io.StringIO(b"".join(response.streaming_content).decode())))
+        assert len(rows) == 6
+        assert json.loads(rows[0]["images"]) == ["/test.jpg"]
+
+    def test_unknown_output(self, admin_client):
+        assert admin_client.get(f"{self.endpoint}?output=xml").status_code == 400
+
+
+def test_export_catalogue_command(catalogue, tmp_path):
+    out, err = io.StringIO(), io.StringIO()
+    call_command("export_catalogue", "--output", "csv", stdout=out, stderr=err)
+    assert len(out.getvalue().splitlines()) == 7 #header and 6 rows
+    assert "Exported 6 rows" in err.getvalue() and "rows/s" in err.getvalue()
+
+    destination = tmp_path / "catalogue.jsonl"
+    call_command("export_catalogue", "--file", str(destination), stdout=out, stderr=err)
+    assert len(destination.read_bytes().splitlines()) == 6
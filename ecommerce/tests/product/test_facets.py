@@ -0,0 +1,188 @@
+import json
+from decimal import Decimal
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from ecommerce.product.models import Category, ProductFacet, ProductFacetCount
+from ecommerce.product.read_models import refresh_facet_counts
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def catalogue(category_factory, product_factory, product_line_factory, attribute_factory, attribute_value_factory):
+    """tvs > oled, three tvs with a brand and one line each (screen size, price, stock)"""
+    tvs = category_factory(slug="tvs", is_active=True)
+    oled = category_factory(slug="oled", parent=tvs, is_active=True)
+    tvs.refresh_from_db()
+    size, brand = attribute_factory(name="screen size"), attribute_factory(name="brand")
+    values = {value: attribute_value_factory(attribute=attribute, attribute_value=value)
+              for attribute, value in [(size, "32"), (size, "40"), (brand, "acme"), (brand, "zeta")]}
+    products = {}
+    for name, category, screen, make, price, stock in [("a", tvs, "32", "acme", "150.00", 3),
+                                                        ("b", oled, "40", "acme", "250.00", 0),
+                                                        ("c", oled, "40", "zeta", "500.00", 1)]:
+        product = product_factory(name=name, slug=name, category=category)
+        product.attribute_value.add(values[make])
+        line = product_line_factory(product=product, price=price, stock_qty=stock)
+        line.attribute_value.add(values[screen])
+        products[name] = product
+    return values, products
+
+
+def search(api_client, slug="tvs", **params):
+    if "values" in params:
+        params["values"] = ",".join(str(value.pk) for value in params["values"])
+    response = api_client().get(f"/api/product/category/{slug}/facets/", params)
+    assert response.status_code == 200
+    return json.loads(response.content)
+
+
+def names(data):
+    return sorted(card["name"] for card in data["results"])
+
+
+def counts(data):
+    return {(facet["attribute"], value["value"]): value["count"]
+            for facet in data["facets"] for value in facet["values"]}
+
+
+class TestFacetEndpoint:
+
+    def test_no_filter(self, api_client, catalogue):
+        data = search(api_client)
+        assert names(data) == ["a", "b", "c"]
+        assert counts(data) == {("brand", "acme"): 2, ("brand", "zeta"): 1,
+                                ("screen size", "32"): 1, ("screen size", "40"): 2}
+
+    def test_sub_category(self, api_client, catalogue):
+        data = search(api_client, slug="oled")
+        assert names(data) == ["b", "c"]
+        assert counts(data)[("brand", "acme")] == 1
+
+    def test_values_of_one_attribute_are_or(self, api_client, catalogue):
+        values, _ = catalogue
+        data = search(api_client, values=[values["32"], values["40"]])
+        assert names(data) == ["a", "b", "c"]
+
+    def test_selected_attribute_keeps_its_other_counts(self, api_client, catalogue):
+        values, _ = catalogue
+        data = search(api_client, values=[values["40"], values["acme"]])
+        assert names(data) == ["b"]
+        assert counts(data) == {("brand", "acme"): 1, ("brand", "zeta"): 1, #among the 40" tvs
+                                ("screen size", "32"): 1, ("screen size", "40"): 1} #among the acme tvs
+
+    def test_price_and_stock(self, api_client, catalogue):
+        data = search(api_client, price_min="100", price_max="300")
+        assert names(data) == ["a", "b"]
+        assert counts(data) == {("brand", "acme"): 2, ("screen size", "32"): 1, ("screen size", "40"): 1}
+        assert names(search(api_client, price_min="100", price_max="300", in_stock="true")) == ["a"]
+
+    def test_query_count_does_not_grow_with_selected_values(self, api_client, catalogue):
+        values, _ = catalogue
+        with CaptureQueriesContext(connection) as ctx:
+            search(api_client, values=[values["40"]])
+        one = len(ctx.captured_queries)
+        with CaptureQueriesContext(connection) as ctx:
+            search(api_client, values=[values["32"], values["40"]])
+        assert len(ctx.captured_queries) == one
+
+    def test_invalid_parameters(self, api_client, catalogue):
+        assert api_client().get("/api/product/category/tvs/facets/?values=x").status_code == 400
+        assert api_client().get("/api/product/category/tvs/facets/?price_min=x").status_code == 400
+        assert api_client().get("/api/product/category/missing/facets/").status_code == 404
+
+    def test_fast_serializers(self, api_client, settings, catalogue):
+        expected = search(api_client)
+        settings.FAST_READ_SERIALIZERS = True
+        assert search(api_client) == expected
+
+
+class TestFacetRows:
+
+    def test_line_and_product_values(self, catalogue):
+        values, products = catalogue
+        assert set(ProductFacet.objects.filter(product=products["a"]).values_list("attribute_value", flat=True)) == {
+            values["32"].pk, values["acme"].pk}
+
+    def test_follow_writes(self, catalogue):
+        values, products = catalogue
+        line = products["c"].product_line.get()
+        line.price = "99.00"
+        line.save()
+        assert set(ProductFacet.objects.filter(product=products["c"]).values_list("price", flat=True)) == {
+            Decimal("99.00")}
+
+        products["c"].is_active = False
+        products["c"].save()
+        assert not ProductFacet.objects.filter(product=products["c"]).exists()
+
+    def test_counts_follow_writes(self, catalogue):
+        values, products = catalogue
+        category = products["c"].category_id
+        def count(value):
+            return ProductFacetCount.objects.filter(category_id=category, attribute_value=value).values_list(
+                "products", flat=True).first()
+
+        assert (count(values["40"]), count(values["zeta"])) == (2, 1)
+        products["c"].product_line.get().delete()
+        assert (count(values["40"]), count(values["zeta"])) == (1, None)
+
+    def test_counts_match_a_recount(self, catalogue, category_factory):
+        values, products = catalogue
+        products["a"].category = products["b"].category #moved
+        products["a"].save()
+        products["b"].attribute_value.remove(values["acme"])
+        products["b"].attribute_value.add(values["zeta"])
+        line = products["c"].product_line.get()
+        line.delete()
+        products["c"].delete()
+        counts = set(ProductFacetCount.objects.values_list("category_id", "attribute_value_id", "products"))
+        refresh_facet_counts(Category.objects.values_list("id", flat=True))
+        assert counts == set(ProductFacetCount.objects.values_list("category_id", "attribute_value_id", "products"))
+
+    def test_writes_do_not_recount_the_category(self, catalogue):
+        _, products = catalogue
+        line = products["a"].product_line.get()
+        line.price = "120.00"
+        with CaptureQueriesContext(connection) as ctx:
+            line.save()
+        assert not [query for query in ctx.captured_queries if "COUNT(DISTINCT" in query["sql"]]
+
+
+    def test_line_writes_keep_the_values_of_other_lines(self, catalogue, product_line_factory):
+        values, products = catalogue
+        category = products["c"].category_id
+        other = product_line_factory(product=products["c"], price="300.00", stock_qty=2)
+        other.attribute_value.add(values["40"])
+        line = products["c"].product_line.get(pk__lt=other.pk)
+        line.attribute_value.remove(values["40"]) #the other line still shows it
+        assert ProductFacetCount.objects.get(category_id=category, attribute_value=values["40"]).products == 2
+        other.delete()
+        assert ProductFacetCount.objects.get(category_id=category, attribute_value=values["40"]).products == 1
+        counts = set(ProductFacetCount.objects.values_list("category_id", "attribute_value_id", "products"))
+        refresh_facet_counts(Category.objects.values_list("id", flat=True))
+        assert counts == set(ProductFacetCount.objects.values_list("category_id", "attribute_value_id", "products"))
+
+    def test_line_write_only_rewrites_its_rows(self, catalogue, product_line_factory):
+        values, products = catalogue
+        for _ in range(3):
+            product_line_factory(product=products["c"]).attribute_value.add(values["40"])
+        line = products["c"].product_line.first()
+        others = ProductFacet.objects.filter(product=products["c"]).exclude(product_line=line)
+        before = set(others.values_list("id", flat=True))
+        line.price = "99.00"
+        line.save()
+        assert set(others.values_list("id", flat=True)) == before #not deleted and inserted again
+        assert set(ProductFacet.objects.filter(product_line=line).values_list("price", flat=True)) == {Decimal("99.00")}
+
+    def test_image_and_product_writes_skip_the_facets(self, catalogue, product_image_factory):
+        _, products = catalogue
+        line = products["c"].product_line.get()
+        products["c"].name = "renamed"
+        for write in (lambda: product_image_factory(product_line=line), products["c"].save):
+            with CaptureQueriesContext(connection) as ctx:
+                write()
+            assert not [query for query in ctx.captured_queries if "productfacet" in query["sql"]]
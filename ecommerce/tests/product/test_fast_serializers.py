@@ -0,0 +1,60 @@
+import pytest
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from ecommerce.product.fast_serializers import PRODUCT_COLUMNS, serialize_products
+from ecommerce.product.models import Product
+
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def catalogue(category_factory, product_factory, full_product):
+    """Two full products and one without product lines, all in the "tvs" category"""
+    category = category_factory(slug="tvs")
+    for i in range(2):
+        full_product(category=category, slug=f"tv-{i}")
+    return [*Product.objects.all(), product_factory(category=category)]
+
+
+def get_both(api_client, settings, url):
+    """The response body with the DRF serializers and with the fast path"""
+    contents = []
+    for fast in (False, True):
+        settings.FAST_READ_SERIALIZERS = fast
+        cache.clear() #the detail cache would hand back the first response
+        response = api_client().get(url)
+        assert response.status_code == 200
+        contents.append(response.content)
+    return contents
+
+
+class TestFastSerializers:
+
+    def test_product_list_identical(self, api_client, settings, catalogue):
+        drf, fast = get_both(api_client, settings, "/api/product/")
+        assert drf == fast
+
+    def test_product_list_next_page_identical(self, api_client, settings, catalogue):
+        drf, fast = get_both(api_client, settings, "/api/product/?page_size=1")
+        assert drf == fast and b'"next":null' not in fast
+
+    def test_product_detail_identical(self, api_client, settings, catalogue):
+        drf, fast = get_both(api_client, settings, f"/api/product/{catalogue[0].slug}/")
+        assert drf == fast
+
+    def test_products_by_category_identical(self, api_client, settings, catalogue):
+        drf, fast = get_both(api_client, settings, "/api/product/category/tvs/?page_size=2")
+        assert drf == fast
+
+    def test_sparse_fields_use_drf(self, api_client, settings, catalogue):
+        drf, fast = get_both(api_client, settings, "/api/product/?fields=name")
+        assert drf == fast
+
+    def test_query_count_does_not_grow_with_rows(self, catalogue):
+        with CaptureQueriesContext(connection) as ctx:
+            data = serialize_products(Product.objects.values(*PRODUCT_COLUMNS))
+        assert len(data) == 3
+        assert len(ctx.captured_queries) == 5 #the products and 4 related queries
@@ -0,0 +1,138 @@
+import random
+import threading
+import time
+
+import pytest
+from django.db import OperationalError, connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from ecommerce.product.fields import allocate_orders
+from ecommerce.product.models import OrderCounter, ProductImage, ProductLine
+
+
+def new_line(product, **kwargs):
+    return ProductLine(product=product, price=1, sku="x", stock_qty=1, weight=1,
+                       product_type=product.product_type, **kwargs)
+
+
+@pytest.mark.django_db
+class TestOrderField:
+
+    def test_orders_are_consecutive_per_parent(self, product_factory):
+        first, second = product_factory(), product_factory()
+        lines = [new_line(first), new_line(first), new_line(second)]
+        for line in lines:
+            line.save()
+        assert [line.order for line in lines] == [1, 2, 1] #set on the instance by pre_save
+
+    def test_counter_stays_ahead_of_explicit_orders(self, product_factory):
+        product = product_factory()
+        new_line(product).save()
+        new_line(product, order=10).save() #e.g. from the admin or the bulk import
+        line = new_line(product)
+        line.save()
+        assert line.order == 11
+
+    def test_counter_starts_after_existing_rows(self, product_line_factory):
+        obj = product_line_factory(order=5)
+        OrderCounter.objects.all().delete() #rows from before the counter table existed
+        image = ProductImage(product_line=obj, alternative_text="x")
+        image.save()
+        line = new_line(obj.product)
+        line.save()
+        assert (line.order, image.order) == (6, 1)
+
+    def test_bulk_allocation_is_one_round_trip_per_parent(self, product_factory):
+        product = product_factory()
+        new_line(product).save()
+        lines = [new_line(product) for _ in range(50)]
+        with CaptureQueriesContext(connection) as ctx:
+            allocate_orders(lines)
+        queries = [query for query in ctx.captured_queries if "SAVEPOINT" not in query["sql"]]
+        assert len(queries) == 2 #the counter update and reading it back
+        ProductLine.objects.bulk_create(lines)
+        assert [line.order for line in lines] == list(range(2, 52))
+        next_line = new_line(product)
+        next_line.save()
+        assert next_line.order == 52
+
+    def test_bulk_allocation_over_many_parents(self, product_factory):
+        products = [product_factory() for _ in range(3)]
+        new_line(products[0]).save()
+        lines = [new_line(product) for product in products for _ in range(2)]
+        with CaptureQueriesContext(connection) as ctx:
+            allocate_orders(lines)
+        queries = [query for query in ctx.captured_queries if "SAVEPOINT" not in query["sql"]]
+        assert len(queries) == 3 #missing counters, one UPDATE, reading them back
+        assert [line.order for line in lines] == [2, 3, 1, 2, 1, 2]
+        ProductLine.objects.bulk_create(lines)
+        next_line = new_line(products[1])
+        next_line.save()
+        assert next_line.order == 3
+
+    def test_counter_model_is_required(self):
+        field = ProductLine._meta.get_field("order")
+        field.counter, counter = None, field.counter
+        try:
+            assert [error.msg for error in field.check()] == ["OrderField must define a 'counter' model"]
+        finally:
+            field.counter = counter
+
+
+def run_concurrently(threads, per_thread, allocate):
+    """Calls allocate() per_thread times in every thread, each thread on its own connection and
+    every call in its own transaction. Returns the values. SQLite allows one writer at a time,
+    a locked database is retried"""
+    values, errors = [], []
+
+    def worker():
+        try:
+            for _ in range(per_thread):
+                for _ in range(400):
+                    try:
+                        with transaction.atomic():
+                            value = allocate()
+                        values.append(value)
+                        break
+                    except OperationalError as e: #database is locked
+                        last = e
+                        time.sleep(random.uniform(0, 0.005)) #jitter, or the threads keep colliding
+                else:
+                    errors.append(repr(last))
+        except Exception as e: #reported in the main thread
+            errors.append(repr(e))
+        finally:
+            connection.close()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    assert not errors, errors
+    return values
+
+
+@pytest.mark.django_db(transaction=True)
+def test_concurrent_allocations_are_unique(product_factory):
+    """Before the counter, two writers could both read the same latest() order"""
+    product = product_factory()
+    field = ProductLine._meta.get_field("order")
+    orders = run_concurrently(8, 25, lambda: field.allocate(product.pk))
+    assert sorted(orders) == list(range(1, 201))
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.skipif(connection.vendor != "postgresql", reason="needs POSTGRES_DB, see settings/local.py")
+def test_concurrent_saves_postgresql(product_factory):
+    """Complete saves (signals included), the counter row lock is held until each commit"""
+    product = product_factory()
+
+    def save():
+        line = new_line(product)
+        line.save()
+        return line.order
+
+    orders = run_concurrently(32, 10, save)
+    assert sorted(orders) == list(range(1, 321))
+    assert sorted(ProductLine.objects.values_list("order", flat=True)) == list(range(1, 321))
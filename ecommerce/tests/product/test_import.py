@@ -0,0 +1,170 @@
+import decimal
+import io
+import json
+
+import pytest
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from ecommerce.product.cache import get_product_version
+from ecommerce.product.importer import import_catalogue, read_csv, read_jsonl, row_digest, sync_catalogue
+from ecommerce.product.models import Product, ProductCard, ProductImage, ProductLine
+
+pytestmark = pytest.mark.django_db
+
+
+def row(pid, sku, **kwargs):
+    return {"pid": pid, "name": f"product {pid}", "category": "tvs", "product_type": "tv",
+            "sku": sku, "price": "10.00", "stock_qty": 5, "weight": 1.5,
+            "specification": {"colour": "black"}, "attribute": {"brand": "acme"}, "images": ["tv.jpg"], **kwargs}
+
+
+def run(*rows, **kwargs):
+    stream = io.StringIO("".join(json.dumps(r) + "\n" for r in rows))
+    return import_catalogue(read_jsonl(stream), **kwargs)
+
+
+@pytest.fixture(autouse=True)
+def lookups(category_factory, product_type_factory):
+    category_factory(slug="tvs")
+    product_type_factory(name="tv")
+
+
+class TestImportCatalogue:
+
+    def test_creates_products_lines_images_and_specifications(self):
+        result = run(row("p1", "a"), row("p1", "b", price="12.50"), row("p2", "c"))
+        assert result["products_created"] == 2 and result["lines_created"] == 3 and not result["errors"]
+        lines = ProductLine.objects.filter(product__pid="p1").order_by("order")
+        assert [(line.sku, line.order, str(line.price)) for line in lines] == [("a", 1, "10.00"), ("b", 2, "12.50")]
+        assert ProductImage.objects.get(product_line=lines[0]).order == 1
+        assert dict(lines[0].attribute_value.values_list("attribute__name", "attribute_value")) == {"colour": "black"}
+        product = Product.objects.get(pid="p1")
+        assert dict(product.attribute_value.values_list("attribute__name", "attribute_value")) == {"brand": "acme"}
+        assert ProductCard.objects.get(product=product).price == lines[0].price #cards refreshed
+
+    def test_reimport_updates_and_appends(self):
+        run(row("p1", "a"))
+        result = run(row("p1", "a", price="9.00", specification={"colour": "white"}), row("p1", "b"))
+        assert result["products_updated"] == 1 and result["lines_updated"] == 1 and result["lines_created"] == 1
+        lines = ProductLine.objects.order_by("order")
+        assert [(line.sku, line.order) for line in lines] == [("a", 1), ("b", 2)]
+        assert str(lines[0].price) == "9.00"
+        assert list(lines[0].attribute_value.values_list("attribute_value", flat=True)) == ["white"] #replaced
+        assert ProductImage.objects.filter(product_line=lines[0]).count() == 1 #same url not added twice
+
+    def test_orders_come_from_the_counter(self):
+        run(row("p1", "a"))
+        product = Product.objects.get(pid="p1")
+        line = ProductLine(product=product, sku="admin", price=1, stock_qty=1, weight=1,
+                           product_type=product.product_type)
+        line.save() #e.g. from the admin, OrderField.pre_save takes order 2 from the counter
+        run(row("p1", "b", images=["b1.jpg", "b2.jpg"]), row("p2", "c"))
+        assert list(ProductLine.objects.filter(product=product).order_by("order").values_list("sku", "order")) == [
+            ("a", 1), ("admin", 2), ("b", 3)]
+        assert list(ProductImage.objects.filter(product_line__sku="b").order_by("order")
+                    .values_list("url", "order")) == [("b1.jpg", 1), ("b2.jpg", 2)]
+
+    def test_invalid_rows_are_reported_and_skipped(self):
+        result = run(row("p1", "a", price="123456.00"), row("p2", "b", category="missing"),
+                     row("p3", "c"), row("p3", "c"), row("p4", "d", stock_qty="many"))
+        assert [number for number, _ in result["errors"]] == [1, 5, 2, 4]
+        assert "price" in result["errors"][0][1]
+        assert list(Product.objects.values_list("pid", flat=True)) == ["p3"]
+
+    def test_query_count_does_not_grow_with_rows(self):
+        run(row("p0", "a")) #creates the attributes and values
+        with CaptureQueriesContext(connection) as ctx:
+            run(row("p1", "a"), row("p2", "b"))
+        small = len(ctx.captured_queries)
+        with CaptureQueriesContext(connection) as ctx:
+            run(*[row(f"q{i}", f"s{i}") for i in range(20)])
+        assert len(ctx.captured_queries) == small
+
+    def test_inactive_first_variant_keeps_the_product_active(self):
+        run(row("p1", "a", is_active=False), row("p1", "b"))
+        assert Product.objects.get(pid="p1").is_active
+        assert dict(ProductLine.objects.values_list("sku", "is_active")) == {"a": False, "b": True}
+
+    def test_product_and_line_flags(self):
+        run(row("p1", "a", is_active=False), row("p2", "b", product_is_active=False, line_is_active=True))
+        assert dict(Product.objects.values_list("pid", "is_active")) == {"p1": False, "p2": False}
+        assert ProductLine.objects.get(sku="b").is_active
+
+    def test_rename_drops_the_detail_cached_under_the_old_slug(self, api_client):
+        def detail(slug):
+            return json.loads(api_client().get(f"/api/product/{slug}/").content)
+
+        run(row("p1", "a", slug="old-slug"))
+        assert len(detail("old-slug")) == 1 #cached
+        run(row("p1", "a", slug="new-slug"))
+        assert detail("old-slug") == []
+        assert [product["slug"] for product in detail("new-slug")] == ["new-slug"]
+
+    def test_batches(self):
+        result = run(*[row(f"p{i}", "a") for i in range(5)], batch_size=2)
+        assert result["rows"] == 5 and result["products_created"] == 5
+
+    def test_csv(self):
+        stream = io.StringIO(
+            "pid,name,category,product_type,sku,price,stock_qty,weight,specification\n"
+            'p1,tv,tvs,tv,a,10.00,1,2.0,"{""colour"": ""black""}"\n')
+        result = import_catalogue(read_csv(stream))
+        assert result["lines_created"] == 1 and not result["errors"]
+
+
+class TestSyncCatalogue:
+
+    def sync(self, *rows):
+        stream = io.StringIO("".join(json.dumps(r) + "\n" for r in rows))
+        return sync_catalogue(read_jsonl(stream))
+
+    def test_only_changed_lines_are_written(self):
+        run(row("p1", "a", slug="p1"), row("p2", "b", slug="p2"))
+        before = {product.pid: product.updated_at for product in Product.objects.all()}
+        versions = {slug: get_product_version(slug) for slug in ("p1", "p2")}
+        result = self.sync({"sku": "a", "price": "11.00", "stock_qty": 5},
+                           {"sku": "b", "price": "10", "stock_qty": "5"}, #same values, other formatting
+                           {"sku": "zzz", "price": "1.00", "stock_qty": 1})
+        assert (result["changed"], result["unchanged"], result["unknown"]) == (1, 1, 1)
+        assert result["products"] == {Product.objects.get(pid="p1").pk}
+        assert str(ProductLine.objects.get(sku="a").price) == "11.00"
+        assert ProductCard.objects.get(product__pid="p1").price == ProductLine.objects.get(sku="a").price
+        after = {product.pid: product.updated_at for product in Product.objects.all()}
+        assert after["p1"] > before["p1"] and after["p2"] == before["p2"]
+        assert get_product_version("p1") != versions["p1"] and get_product_version("p2") == versions["p2"]
+
+    def test_unchanged_snapshot_writes_nothing(self):
+        run(row("p1", "a"))
+        with CaptureQueriesContext(connection) as ctx:
+            result = self.sync({"sku": "a", "price": "10.00", "stock_qty": 5})
+        assert result["unchanged"] == 1 and len(ctx.captured_queries) == 1 #the current values only
+
+    def test_invalid_and_duplicate_rows(self):
+        run(row("p1", "a"))
+        result = self.sync({"sku": "a", "price": "x", "stock_qty": 1}, {"sku": "a", "price": "1.00", "stock_qty": 1},
+                           {"sku": "a", "price": "2.00", "stock_qty": 1})
+        assert [number for number, _ in result["errors"]] == [1, 3]
+        assert result["changed"] == 1
+
+    def test_digest_ignores_formatting(self):
+        assert row_digest("10", 5) == row_digest(decimal.Decimal("10.00"), "5") != row_digest("10.01", 5)
+
+
+def test_import_catalogue_command(tmp_path):
+    source = tmp_path / "catalogue.jsonl"
+    source.write_text("\n".join(json.dumps(row(f"p{i}", "a", product_type=None)) for i in range(3)))
+    out, err = io.StringIO(), io.StringIO()
+    call_command("import_catalogue", str(source), "--product-type", "tv", stdout=out, stderr=err)
+    assert "3 products created" in out.getvalue() and "rows/s" in out.getvalue()
+    assert Product.objects.count() == 3
+
+
+def test_import_catalogue_sync_command(tmp_path):
+    run(row("p1", "a"))
+    source = tmp_path / "feed.csv"
+    source.write_text("sku,price,stock_qty\na,12.00,3\n")
+    out = io.StringIO()
+    call_command("import_catalogue", str(source), "--sync", stdout=out)
+    assert "1 product lines changed, 0 unchanged" in out.getvalue()
@@ -1,13 +1,36 @@
 import pytest
 from django.core.exceptions import ValidationError
+from django.db import connection
 from django.db.utils import IntegrityError
+from django.test.utils import CaptureQueriesContext
 from ecommerce.product.models import ProductTypeAttribute #Not neccessary
-from ecommerce.product.models import Category, Product, ProductLine
+from ecommerce.product.models import (Category, Product, ProductLine, ProductCard, ProductFacet, ProductImage,
+                                      ProductLineAttributeValue)
+from ecommerce.product.read_models import refresh_product_facets
 
 #Gives us access to the db
 pytestmark = pytest.mark.django_db #Available globally, no need to design each funtion, 
 
 
+def save_cost(save):
+    """(queries, facet rows deleted or inserted) of one save, the rows show an O(siblings) rewrite
+    that runs in a fixed number of queries"""
+    before = set(ProductFacet.objects.values_list("id", flat=True))
+    with CaptureQueriesContext(connection) as ctx:
+        save()
+    return len(ctx.captured_queries), len(before ^ set(ProductFacet.objects.values_list("id", flat=True)))
+
+
+def add_sibling_lines(product_line, attribute_value, orders):
+    """Lines of the same product showing attribute_value, with their facet rows (bulk_create sends no signals)"""
+    lines = ProductLine.objects.bulk_create([
+        ProductLine(product=product_line.product, order=order, price=1, sku="x", stock_qty=1, weight=1,
+                    product_type=product_line.product_type, is_active=True) for order in orders])
+    ProductLineAttributeValue.objects.bulk_create([
+        ProductLineAttributeValue(product_line=line, attribute_value=attribute_value) for line in lines])
+    refresh_product_facets([product_line.product_id])
+
+
 class TestCategoryModel:
     def test_str_method(self, category_factory):
         # Arrange
@@ -118,6 +141,24 @@ class TestProductModel:
         qs = Product.objects.count()
         assert qs == 2
 
+    def test_updated_at_touched_by_product_line(self, product_factory, product_line_factory):
+        obj = product_factory()
+        before = obj.updated_at
+        product_line_factory(product=obj)
+        obj.refresh_from_db()
+        assert obj.updated_at > before
+
+    def test_in_category_subtree(self, category_factory, product_factory):
+        root = category_factory()
+        child = category_factory(parent=root)
+        category_factory(parent=root) #empty sibling
+        product_factory(category=root)
+        product_factory(category=child)
+        product_factory(category=category_factory()) #another tree
+        root.refresh_from_db() #rght changed when the children were inserted
+        assert Product.objects.in_category_subtree(root).count() == 2
+        assert Product.objects.in_category_subtree(child).count() == 1
+
 
 class TestProductLineModel:
     def test_duplicate_attribute_inserts(
@@ -153,6 +194,35 @@ class TestProductLineModel:
             # same as the line above, and calling the clean() method in addition
             product_line_factory(order=1, product=obj).clean()
 
+    def test_duplicate_order_rejected_by_database(self, product_line_factory, product_factory):
+        obj = product_line_factory(order=1)
+        with pytest.raises(IntegrityError): #bulk_create skips save() and clean()
+            ProductLine.objects.bulk_create([ProductLine(
+                product=obj.product, order=1, price=1, sku="x", stock_qty=1, weight=1, product_type=obj.product_type)])
+
+    def test_concurrent_duplicate_order_is_validation_error(self, product_line_factory, product_factory, monkeypatch):
+        obj = product_factory()
+        product_line_factory(order=1, product=obj)
+        monkeypatch.setattr(ProductLine, "clean", lambda self: None) #the other row wasn't there when clean() ran
+        with pytest.raises(ValidationError):
+            product_line_factory(order=1, product=obj)
+
+    def test_save_query_count_does_not_grow_with_lines(self, product_line_factory, attribute_value_factory):
+        size = attribute_value_factory()
+        obj = product_line_factory(order=1, attribute_value=(size, ))
+        obj.product.attribute_value.add(attribute_value_factory()) #on the facet rows of every line
+
+        def cost(order):
+            line = ProductLine(product=obj.product, order=order, price=1, sku="x", stock_qty=1, weight=1,
+                               product_type=obj.product_type, is_active=True)
+            return save_cost(line.save)
+
+        few = cost(2)
+        add_sibling_lines(obj, size, range(3, 500))
+        assert ProductFacet.objects.filter(product=obj.product).count() > 900
+        assert cost(500) == few
+        assert few[1] == 1 #the new line's row of the product's value
+
     def test_field_decimal_places(self, product_line_factory):
         price = 1.001 #3 decimal places, the ValidationError should catch this, without throwing an error
         with pytest.raises(ValidationError):
@@ -208,6 +278,28 @@ class TestProductImageModel:
             # same as the line above, and calling the clean() method in addition
             product_image_factory(order=1, product_line=obj).clean()
 
+    def test_concurrent_duplicate_order_is_validation_error(self, product_image_factory, product_line_factory,
+                                                            monkeypatch):
+        obj = product_line_factory()
+        product_image_factory(order=1, product_line=obj)
+        monkeypatch.setattr(ProductImage, "clean", lambda self: None)
+        with pytest.raises(ValidationError):
+            product_image_factory(order=1, product_line=obj)
+
+    def test_save_query_count_does_not_grow_with_images(self, product_line_factory, attribute_value_factory):
+        size = attribute_value_factory()
+        obj = product_line_factory(order=1, attribute_value=(size, ))
+
+        def cost(order):
+            return save_cost(ProductImage(product_line=obj, order=order, alternative_text="x").save)
+
+        few = cost(1)
+        ProductImage.objects.bulk_create([ProductImage(product_line=obj, order=order, alternative_text="x")
+                                          for order in range(2, 500)])
+        add_sibling_lines(obj, size, range(2, 500))
+        assert cost(500) == few
+        assert few[1] == 0 #images aren't on the facet rows
+
 
 class TestProductTypeModel:
     def test_str_method(self, product_type_factory, attribute_factory):
@@ -249,3 +341,62 @@ class TestAttributeValueModel:
             obj.full_clean()
 
 
+class TestProductCardModel:
+    def test_card_created_with_product(self, product_factory):
+        obj = product_factory(name="tv")
+        card = ProductCard.objects.get(product=obj)
+        assert card.name == "tv"
+        assert card.price is None
+
+    def test_first_active_line_and_primary_image(self, product_factory, product_line_factory, product_image_factory):
+        obj = product_factory()
+        product_line_factory(product=obj, price="5.00", is_active=False)
+        line = product_line_factory(product=obj, price="7.50")
+        product_line_factory(product=obj, price="9.00")
+        product_image_factory(product_line=line, url="second.jpg", order=2)
+        product_image_factory(product_line=line, url="first.jpg", order=1)
+        card = ProductCard.objects.get(product=obj)
+        assert str(card.price) == "7.50"
+        assert card.image.name == "first.jpg"
+        assert card.image_order == 1
+
+    def test_card_follows_price_change(self, product_factory, product_line_factory):
+        line = product_line_factory(product=product_factory(), price="5.00")
+        line.price = "6.00"
+        line.save()
+        assert str(ProductCard.objects.get(product=line.product).price) == "6.00"
+
+    def test_category_path_follows_rename(self, category_factory, product_factory):
+        root = category_factory(slug="electronics")
+        child = category_factory(slug="tvs", parent=root)
+        obj = product_factory(category=child)
+        assert ProductCard.objects.get(product=obj).category_path == "electronics/tvs"
+        root.slug = "tech"
+        root.save()
+        assert ProductCard.objects.get(product=obj).category_path == "tech/tvs"
+
+    @pytest.mark.parametrize("move", ["save", "move_to"])
+    def test_category_path_follows_move(self, category_factory, product_factory, move):
+        root, other = category_factory(slug="electronics"), category_factory(slug="tech")
+        child = category_factory(slug="tvs", parent=root)
+        obj = product_factory(category=child)
+        if move == "save":
+            child.parent = other
+            child.save()
+        else:
+            child.move_to(other)
+        assert ProductCard.objects.get(product=obj).category_path == "tech/tvs"
+
+    def test_category_save_without_path_change(self, category_factory, product_factory):
+        child = category_factory(slug="tvs", parent=category_factory(slug="electronics"))
+        product_factory(category=child)
+        child.name = "Televisions"
+        child.is_active = not child.is_active
+        with CaptureQueriesContext(connection) as ctx:
+            child.save()
+        assert not [query for query in ctx.captured_queries if "product_productcard" in query["sql"]]
+
+    def test_card_deleted_with_product(self, product_factory):
+        obj = product_factory()
+        obj.delete()
+        assert ProductCard.objects.count() == 0
@@ -0,0 +1,139 @@
+import asyncio
+
+import pytest
+from asgiref.sync import async_to_sync
+
+from ecommerce.product.autocomplete import autocomplete_index
+from ecommerce.product.models import Product
+from ecommerce.product.query_budget import QueryBudgetExceeded, QueryBudgetMiddleware, fingerprint
+from ecommerce.product.query_budget import query_budget as view_query_budget #query_budget is the fixture
+from ecommerce.product.views import ProductView
+
+from .test_async_views import request
+
+pytestmark = pytest.mark.django_db
+
+# url name, path: the read endpoints, their budgets are in settings.QUERY_BUDGETS
+ENDPOINTS = [
+    ("product-list", "/api/product/"),
+    ("product-list", "/api/product/?fields=name,product_line.price&expand=product_line.product_image"),
+    ("product-detail", "/api/product/product-0/"),
+    ("product-variant", "/api/product/product-0/variant/"),
+    ("product-list-product-by-category-slug", "/api/product/category/root/"),
+    ("product-facets", "/api/product/category/root/facets/?price_min=1"),
+    ("product-search", "/api/product/search/?q=test"),
+    ("product-autocomplete", "/api/product/autocomplete/?q=test"),
+    ("category-list", "/api/category/"),
+    ("category-tree", "/api/category/tree/"),
+    ("async-product-list", "/api/async/product/"),
+    ("async-product-detail", "/api/async/product/product-0/"),
+    ("async-product-category", "/api/async/product/category/root/"),
+]
+# the endpoints with a DRF serializer and a fast path (FAST_READ_SERIALIZERS)
+SERIALIZED = {"product-list", "product-detail", "product-list-product-by-category-slug"}
+
+
+@pytest.fixture(params=[1, 5], ids=["small", "large"])
+def catalogue(request, category_factory, full_product):
+    """1 or 5 full products (2 product lines, images, attribute values) over a category and its child.
+    A query run per product or per line shows up in the large one, over the count or the repeats budget"""
+    root = category_factory(slug="root", is_active=True)
+    categories = [root, category_factory(parent=root, is_active=True)]
+    for i in range(request.param):
+        full_product(slug=f"product-{i}", category=categories[i % 2])
+    autocomplete_index.generation = None #loaded by the request
+    return list(Product.objects.all())
+
+
+@pytest.mark.parametrize("name, path", ENDPOINTS)
+def test_budget(api_client, query_budget, catalogue, name, path):
+    with query_budget(name):
+        response = api_client().get(path)
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize("name, path", [(name, path) for name, path in ENDPOINTS if name in SERIALIZED])
+def test_fast_serializers_budget(api_client, settings, query_budget, catalogue, name, path):
+    settings.FAST_READ_SERIALIZERS = True
+    with query_budget(name):
+        response = api_client().get(path)
+    assert response.status_code == 200
+
+
+def test_batch_budget(api_client, query_budget, catalogue):
+    slugs = [product.slug for product in catalogue]
+    with query_budget("product-batch", **ProductView.batch.query_budget): #set on the view with @query_budget
+        response = api_client().post("/api/product/batch/", {"slugs": slugs}, format="json")
+    assert response.status_code == 200
+
+
+class TestQueryBudget:
+
+    def test_over_budget(self, api_client, query_budget, catalogue):
+        with pytest.raises(AssertionError, match="product-list is over its query budget: 5 queries, budget 4"):
+            with query_budget("product-list", queries=4):
+                api_client().get("/api/product/")
+
+    def test_repeats(self, product_factory, query_budget):
+        products = [product_factory(slug=f"p-{i}") for i in range(3)]
+        with pytest.raises(AssertionError, match="3 runs of the same statement, budget 2"):
+            with query_budget("product-list", repeats=2) as recorder:
+                for product in products: #N+1
+                    Product.objects.filter(pk=product.pk).exists()
+        assert recorder.count == 3
+
+    def test_middleware_raises(self, api_client, settings, catalogue):
+        settings.QUERY_BUDGETS = {"product-list": {"queries": 1}}
+        with pytest.raises(QueryBudgetExceeded):
+            api_client().get("/api/product/")
+
+    def test_middleware_warns(self, api_client, settings, caplog, catalogue):
+        settings.QUERY_BUDGET_MODE = "warn"
+        settings.QUERY_BUDGETS = {"product-list": {"queries": 1}}
+        response = api_client().get("/api/product/")
+        assert response.status_code == 200
+        assert response["X-Query-Count"] == "5"
+        assert "GET /api/product/ is over its query budget: 5 queries, budget 1" in caplog.text
+
+    def test_middleware_off(self, api_client, settings, catalogue):
+        settings.QUERY_BUDGET_MODE = None
+        settings.QUERY_BUDGETS = {"product-list": {"queries": 1}}
+        assert "X-Query-Count" not in api_client().get("/api/product/")
+
+    def test_decorator(self, rf, settings, caplog, catalogue):
+        settings.QUERY_BUDGET_MODE = None #the decorator still warns
+
+        @view_query_budget(queries=1)
+        def view(request):
+            return list(Product.objects.all()) + list(Product.objects.all())
+
+        view(rf.get("/"))
+        assert "view is over its query budget: 2 queries, budget 1" in caplog.text
+        settings.QUERY_BUDGET_MODE = "raise"
+        with pytest.raises(QueryBudgetExceeded):
+            view(rf.get("/"))
+
+    def test_async_view_recorded(self, async_client, catalogue):
+        """The middleware stays async under ASGI and still records the ORM calls of the async views"""
+        response = request(async_client, "/api/async/product/")
+        assert response.status_code == 200
+        assert response["X-Query-Count"] == "5"
+
+    def test_async_decorator(self, rf, settings, caplog, catalogue):
+        settings.QUERY_BUDGET_MODE = None
+
+        @view_query_budget(queries=1)
+        async def view(request):
+            return [product async for product in Product.objects.all()] + [product async for product in Product.objects.all()]
+
+        async_to_sync(view)(rf.get("/"))
+        assert "view is over its query budget: 2 queries, budget 1" in caplog.text
+
+    def test_middleware_is_async_capable(self):
+        async def get_response(request):
+            pass
+        assert asyncio.iscoroutinefunction(QueryBudgetMiddleware(get_response))
+        assert not asyncio.iscoroutinefunction(QueryBudgetMiddleware(lambda request: None))
+
+    def test_fingerprint(self):
+        assert fingerprint('SELECT 1 WHERE "id" IN (%s, %s, %s)') == fingerprint('SELECT 1 WHERE "id" IN (%s)')
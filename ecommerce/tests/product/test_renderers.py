@@ -0,0 +1,67 @@
+import datetime
+import decimal
+import json
+
+import pytest
+from rest_framework.renderers import JSONRenderer
+
+from ecommerce.product import renderers
+from ecommerce.product.renderers import FastJSONRenderer, stream_json_array
+
+
+DATA = {
+    "name": "télé   line separator",
+    "created_at": datetime.datetime(2023, 1, 2, 3, 4, 5, 600000, tzinfo=datetime.timezone.utc),
+    "nested": [{"order": 1, "active": True, "weight": 1.5, "missing": None}],
+}
+
+
+@pytest.fixture(params=["orjson", "json"])
+def encoder(request, monkeypatch):
+    """Runs a test with orjson and with the json module fallback"""
+    if request.param == "json":
+        monkeypatch.setattr(renderers, "orjson", None)
+    return request.param
+
+
+class TestFastJSONRenderer:
+
+    def test_same_output_as_drf(self, encoder):
+        assert FastJSONRenderer().render(DATA) == JSONRenderer().render(DATA)
+
+    def test_decimal_as_string(self, encoder):
+        assert FastJSONRenderer().render({"price": decimal.Decimal("10.10")}) == b'{"price":"10.10"}'
+
+    def test_indent_uses_json_module(self):
+        assert FastJSONRenderer().render(DATA, "application/json; indent=4") == JSONRenderer().render(
+            DATA, "application/json; indent=4")
+
+    def test_unsupported_value_falls_back(self):
+        assert FastJSONRenderer().render({"big": 2 ** 70}) == b'{"big":1180591620717411303424}'
+
+    def test_stream_json_array(self):
+        chunks = list(stream_json_array([[1, 2], [], [3]]))
+        assert json.loads(b"".join(chunks)) == [1, 2, 3]
+        assert list(stream_json_array([])) == [b"[", b"]"]
+
+
+@pytest.mark.django_db
+class TestStreamingList:
+
+    endpoint = "/api/product/"
+
+    @pytest.mark.parametrize("fast", [False, True])
+    def test_stream_matches_pages(self, api_client, settings, fast, full_product):
+        settings.STREAM_CHUNK_SIZE = 2
+        settings.FAST_READ_SERIALIZERS = fast
+        for i in range(5):
+            full_product(slug=f"p{i}")
+        response = api_client().get(f"{self.endpoint}?stream=true")
+        assert response.streaming and response["Content-Type"] == "application/json"
+        streamed = json.loads(b"".join(response.streaming_content))
+        paged = json.loads(api_client().get(f"{self.endpoint}?page_size=100").content)["results"]
+        assert streamed == paged and len(streamed) == 5
+
+    def test_stream_empty_catalogue(self, api_client):
+        response = api_client().get(f"{self.endpoint}?stream=1")
+        assert json.loads(b"".join(response.streaming_content)) == []
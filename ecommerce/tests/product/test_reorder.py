@@ -0,0 +1,100 @@
+import pytest
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from ecommerce.product.cache import get_product_version
+from ecommerce.product.models import ProductImage, ProductLine
+from ecommerce.product.reorder import reorder_product_images, reorder_product_lines
+
+pytestmark = pytest.mark.django_db
+
+
+def orders(model, **parent):
+    return list(model.objects.filter(**parent).order_by("order").values_list("pk", flat=True))
+
+
+def add_images(line, count):
+    return [image.pk for image in ProductImage.objects.bulk_create([
+        ProductImage(product_line=line, alternative_text="x", order=order) for order in range(1, count + 1)])]
+
+
+class TestReorderService:
+
+    def test_reverse_product_lines(self, product_factory, product_line_factory):
+        product = product_factory(slug="tv")
+        ids = [product_line_factory(product=product).pk for _ in range(5)]
+        version = get_product_version("tv")
+        reorder_product_lines(product.pk, ids[::-1])
+        assert orders(ProductLine, product=product) == ids[::-1]
+        assert sorted(ProductLine.objects.values_list("order", flat=True)) == [1, 2, 3, 4, 5]
+        assert get_product_version("tv") != version #cached detail dropped
+
+    def test_next_line_goes_last(self, product_factory, product_line_factory):
+        product = product_factory()
+        ids = [product_line_factory(product=product).pk for _ in range(3)]
+        reorder_product_lines(product.pk, ids[::-1])
+        assert product_line_factory(product=product).order == 4
+
+    @pytest.mark.parametrize("ids", ["empty", "missing", "duplicate", "foreign"])
+    def test_incomplete_order_rejected(self, ids, product_line_factory, product_image_factory):
+        line = product_line_factory()
+        images = add_images(line, 3)
+        other = product_image_factory().pk
+        ids = {"empty": [], "missing": images[:2], "duplicate": images + images[:1], "foreign": images + [other]}[ids]
+        with pytest.raises(ValidationError):
+            reorder_product_images(line.pk, ids)
+        assert orders(ProductImage, product_line=line) == images #unchanged
+
+    def test_query_count_does_not_grow_with_images(self, product_line_factory):
+        def reorder_queries(count):
+            line = product_line_factory()
+            images = add_images(line, count)
+            with CaptureQueriesContext(connection) as ctx:
+                reorder_product_images(line.pk, images[::-1])
+            assert orders(ProductImage, product_line=line) == images[::-1]
+            return len(ctx.captured_queries)
+
+        assert reorder_queries(3) == reorder_queries(300)
+
+    def test_more_images_than_the_parameter_limit(self, product_line_factory):
+        line = product_line_factory()
+        images = add_images(line, 700) #2100 parameters, chunked on SQLite (999)
+        reorder_product_images(line.pk, images[::-1])
+        assert orders(ProductImage, product_line=line) == images[::-1]
+        assert sorted(ProductImage.objects.filter(product_line=line).values_list("order", flat=True)) == list(
+            range(1, 701))
+
+    def test_unknown_parent_rejected(self):
+        with pytest.raises(ValidationError):
+            reorder_product_lines(999, [1])
+
+
+class TestReorderEndpoints:
+
+    endpoint = "/api/product/"
+
+    @pytest.fixture
+    def admin_client(self, api_client):
+        client = api_client()
+        client.force_authenticate(User.objects.create_superuser("admin", "admin@example.com", "pass"))
+        return client
+
+    def test_admin_only(self, api_client):
+        response = api_client().post(f"{self.endpoint}reorder-lines/", {"parent": 1, "order": [1]}, format="json")
+        assert response.status_code == 403
+
+    def test_reorder_images(self, admin_client, product_line_factory):
+        line = product_line_factory()
+        images = add_images(line, 4)
+        response = admin_client.post(f"{self.endpoint}reorder-images/",
+                                     {"parent": line.pk, "order": images[::-1]}, format="json")
+        assert response.status_code == 204
+        assert orders(ProductImage, product_line=line) == images[::-1]
+
+    def test_reorder_lines_invalid(self, admin_client, product_line_factory):
+        line = product_line_factory()
+        response = admin_client.post(f"{self.endpoint}reorder-lines/",
+                                     {"parent": line.product_id, "order": [line.pk, 999]}, format="json")
+        assert response.status_code == 400 and "order" in response.json()
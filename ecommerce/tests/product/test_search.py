@@ -0,0 +1,99 @@
+import json
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from ecommerce.product.models import ProductSearchDocument
+from ecommerce.product.search import search_product_ids, search_words
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def catalogue(product_factory, product_line_factory, attribute_value_factory):
+    tv = product_factory(name="Samsung OLED TV", slug="samsung-oled", description="A 55 inch television", pid="TV001")
+    line = product_line_factory(product=tv, sku="QE55S90C")
+    line.attribute_value.add(attribute_value_factory(attribute_value="Titan Black"))
+    phone = product_factory(name="Galaxy phone", slug="galaxy", description="Samsung phone with an OLED screen",
+                            pid="PH002")
+    product_line_factory(product=phone, sku="SM-S911B")
+    return tv, phone
+
+
+def search(api_client, query, **params):
+    response = api_client().get("/api/product/search/", {"q": query, **params})
+    assert response.status_code == 200
+    return json.loads(response.content)
+
+
+class TestSearchEndpoint:
+
+    def test_name_ranks_first(self, api_client, catalogue):
+        data = search(api_client, "samsung oled")
+        assert [card["slug"] for card in data["results"]] == ["samsung-oled", "galaxy"]
+
+    @pytest.mark.parametrize("query, slug", [("TV001", "samsung-oled"), ("qe55s90c", "samsung-oled"),
+                                             ("titan black", "samsung-oled"), ("SM-S911B", "galaxy"),
+                                             ("televis", "samsung-oled"), ("gal", "galaxy")])
+    def test_fields(self, api_client, catalogue, query, slug):
+        assert [card["slug"] for card in search(api_client, query)["results"]] == [slug]
+
+    def test_every_word_must_match(self, api_client, catalogue):
+        assert search(api_client, "samsung television")["results"][0]["slug"] == "samsung-oled"
+        assert search(api_client, "galaxy television")["results"] == []
+
+    def test_fts_syntax_is_not_interpreted(self, api_client, catalogue):
+        assert search(api_client, 'samsung" OR NEAR(')["results"] == []
+        assert search(api_client, "")["results"] == []
+
+    def test_pages(self, api_client, product_factory):
+        for i in range(3):
+            product_factory(name=f"lamp {i}", slug=f"lamp-{i}")
+        first = search(api_client, "lamp", page_size=2)
+        assert len(first["results"]) == 2
+        second = api_client().get(first["next"])
+        assert len(json.loads(second.content)["results"]) == 1
+        assert json.loads(second.content)["next"] is None
+        assert api_client().get("/api/product/search/?q=lamp&page=0").status_code == 404
+
+    def test_fast_serializers(self, api_client, settings, catalogue):
+        expected = search(api_client, "samsung")
+        settings.FAST_READ_SERIALIZERS = True
+        assert search(api_client, "samsung") == expected
+
+    def test_query_count(self, api_client, catalogue):
+        with CaptureQueriesContext(connection) as ctx:
+            search(api_client, "samsung")
+        assert len(ctx.captured_queries) == 2 #the ranked ids, the cards
+
+
+class TestSearchIndex:
+
+    def test_updated_on_save(self, catalogue):
+        tv, phone = catalogue
+        tv.name = "Sony Bravia"
+        tv.save()
+        assert search_product_ids("bravia", 10) == [tv.pk]
+        assert search_product_ids("oled", 10) == [phone.pk] #the old name is gone from the index
+
+    def test_product_line_changes(self, catalogue):
+        tv, _ = catalogue
+        line = tv.product_line.get()
+        line.sku = "NEW123"
+        line.save()
+        assert search_product_ids("new123", 10) == [tv.pk]
+        assert search_product_ids("qe55s90c", 10) == []
+
+    def test_inactive_and_deleted_products_are_removed(self, catalogue):
+        tv, phone = catalogue
+        tv.is_active = False
+        tv.save()
+        assert not ProductSearchDocument.objects.filter(product=tv).exists()
+        assert search_product_ids("samsung", 10) == [phone.pk]
+        phone.product_line.all().delete()
+        phone.delete()
+        assert search_product_ids("samsung", 10) == []
+
+    def test_words(self):
+        assert search_words('ABC-123 "x" OR*') == ["abc", "123", "x", "or"]
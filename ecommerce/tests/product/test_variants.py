@@ -0,0 +1,84 @@
+import json
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def shoe(product_factory, product_line_factory, attribute_factory, attribute_value_factory):
+    """Three lines: (10, blue), (11, blue), (10, red)"""
+    size, colour = attribute_factory(name="size"), attribute_factory(name="colour")
+    values = {value: attribute_value_factory(attribute=attribute, attribute_value=value)
+              for attribute, value in [(size, "10"), (size, "11"), (colour, "blue"), (colour, "red")]}
+    product = product_factory(slug="shoe")
+    lines = {}
+    for sku, pair in [("10-blue", ("10", "blue")), ("11-blue", ("11", "blue")), ("10-red", ("10", "red"))]:
+        lines[sku] = product_line_factory(product=product, sku=sku)
+        lines[sku].attribute_value.add(*[values[value] for value in pair])
+    return product, lines, values
+
+
+def get(api_client, values, slug="shoe"):
+    ids = ",".join(str(value.pk) for value in values)
+    return api_client().get(f"/api/product/{slug}/variant/?values={ids}")
+
+
+def available(data):
+    return {value["value"] for option in data["options"] for value in option["values"] if value["available"]}
+
+
+class TestVariantEndpoint:
+
+    def test_complete_selection(self, api_client, shoe):
+        _, lines, values = shoe
+        response = get(api_client, [values["11"], values["blue"]])
+        assert response.status_code == 200
+        line = json.loads(response.content)["product_line"]
+        assert line["id"] == lines["11-blue"].pk
+        assert line["sku"] == "11-blue"
+        assert line["specification"] == {"size": "11", "colour": "blue"}
+
+    def test_partial_selection(self, api_client, shoe):
+        _, _, values = shoe
+        data = json.loads(get(api_client, [values["red"]]).content)
+        assert data["product_line"] is None
+        assert available(data) == {"10", "blue", "red"} #no size 11 in red, the other colour stays pickable
+
+        data = json.loads(get(api_client, [values["11"]]).content)
+        assert available(data) == {"10", "11", "blue"}
+
+    def test_no_selection(self, api_client, shoe):
+        data = json.loads(get(api_client, []).content)
+        assert [option["attribute"] for option in data["options"]] == ["colour", "size"]
+        assert available(data) == {"10", "11", "blue", "red"}
+
+    def test_index_cached(self, api_client, shoe):
+        _, _, values = shoe
+        get(api_client, [values["10"]])
+        with CaptureQueriesContext(connection) as ctx:
+            assert get(api_client, [values["10"], values["red"]]).status_code == 200
+        assert len(ctx.captured_queries) == 0
+
+    def test_index_follows_writes(self, api_client, product_line_factory, shoe):
+        product, lines, values = shoe
+        get(api_client, [values["11"]])
+        new = product_line_factory(product=product, sku="11-red")
+        new.attribute_value.add(values["11"], values["red"])
+        assert "red" in available(json.loads(get(api_client, [values["11"]]).content))
+
+        lines["10-red"].is_active = False
+        lines["10-red"].save()
+        data = json.loads(get(api_client, [values["10"], values["red"]]).content)
+        assert data["product_line"] is None
+
+    def test_invalid_selections(self, api_client, attribute_value_factory, shoe):
+        _, _, values = shoe
+        assert get(api_client, [values["10"], values["11"]]).status_code == 400
+        assert get(api_client, [attribute_value_factory()]).status_code == 400
+        assert api_client().get("/api/product/shoe/variant/?values=a").status_code == 400
+
+    def test_unknown_product(self, api_client):
+        assert get(api_client, [], slug="missing").status_code == 404
@@ -3,7 +3,7 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
 
-from ecommerce.product import views
+from ecommerce.product import async_views, views
 
 
 router = DefaultRouter()
@@ -14,6 +14,11 @@ router.register(r"product", views.ProductView )
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/", include(router.urls)),
+    # Async read path for ASGI, same responses as the product endpoints above
+    path("api/async/product/", async_views.product_list, name="async-product-list"),
+    path("api/async/product/category/<slug:slug>/", async_views.product_list_by_category_slug,
+         name="async-product-category"),
+    path("api/async/product/<slug:slug>/", async_views.product_detail, name="async-product-detail"),
     path("api/schema/", SpectacularAPIView.as_view(), name="schema",),
     path("api/docs/", SpectacularSwaggerView.as_view(url_name="schema"), name="swagger"),
 ]
@@ -14,3 +14,6 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecommerce.settings')
 
 application = get_wsgi_application()
+
+from ecommerce.product.autocomplete import preload # noqa: E402 #the apps must be loaded first
+preload() #builds the in-memory autocomplete index when the worker starts